@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark della ricerca negozi per raggio su PostGIS.
+
+Confronta la query storica (filtro su ST_Distance, non indicizzabile) con
+quella basata su ST_DWithin e indice GiST su geom::geography, usando una
+tabella temporanea con un numero di negozi paragonabile a Milano.
+
+Uso (dalla root del progetto, con Postgres raggiungibile):
+    python deployment/scripts/bench_nearby_shops.py --shops 20000 --queries 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.configg import (  # noqa: E402
+    POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB,
+    MILANO_MIN_LAT, MILANO_MAX_LAT, MILANO_MIN_LON, MILANO_MAX_LON,
+)
+
+OLD_QUERY = """
+    SELECT shop_id, shop_name, category,
+           ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography) AS distance
+    FROM bench_shops
+    WHERE ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography) <= $3
+    ORDER BY distance
+    LIMIT 10
+"""
+
+NEW_QUERY = """
+    SELECT shop_id, shop_name, category,
+           ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography) AS distance
+    FROM bench_shops
+    WHERE ST_DWithin(geom::geography, ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography, $3)
+    ORDER BY distance
+    LIMIT 10
+"""
+
+
+async def setup(conn, shops: int) -> None:
+    """Crea la tabella temporanea con negozi casuali nella bounding box di Milano."""
+    await conn.execute("""
+        CREATE TEMP TABLE bench_shops (
+            shop_id SERIAL PRIMARY KEY,
+            shop_name VARCHAR(255),
+            category VARCHAR(100),
+            geom GEOMETRY(Point, 4326)
+        )
+    """)
+    rows = [
+        (f"shop {i}", "bar", random.uniform(MILANO_MIN_LON, MILANO_MAX_LON), random.uniform(MILANO_MIN_LAT, MILANO_MAX_LAT))
+        for i in range(shops)
+    ]
+    await conn.executemany(
+        "INSERT INTO bench_shops (shop_name, category, geom) VALUES ($1, $2, ST_SetSRID(ST_MakePoint($3, $4), 4326))",
+        rows
+    )
+    await conn.execute("ANALYZE bench_shops")
+
+
+async def run_queries(conn, query: str, points, radius: float):
+    """Esegue la query per ogni punto e restituisce le latenze in ms."""
+    stmt = await conn.prepare(query)
+    latencies = []
+    for lon, lat in points:
+        start = time.perf_counter()
+        await stmt.fetch(lon, lat, radius)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def plan(conn, query: str, lon: float, lat: float, radius: float) -> str:
+    """Prima riga significativa del piano di esecuzione."""
+    rows = await conn.fetch(f"EXPLAIN {query}", lon, lat, radius)
+    lines = [r[0].strip() for r in rows]
+    return next((line for line in lines if "Scan" in line), lines[0])
+
+
+def report(label: str, latencies) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<32} media {statistics.mean(latencies):8.2f} ms   p50 {statistics.median(latencies):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark ST_Distance vs ST_DWithin sui negozi")
+    parser.add_argument("--shops", type=int, default=20000, help="Numero di negozi sintetici")
+    parser.add_argument("--queries", type=int, default=500, help="Query per variante")
+    parser.add_argument("--radius", type=float, default=200, help="Raggio di ricerca in metri")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        host=POSTGRES_HOST, port=POSTGRES_PORT,
+        user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+        database=POSTGRES_DB
+    )
+    try:
+        await setup(conn, args.shops)
+        points = [
+            (random.uniform(MILANO_MIN_LON, MILANO_MAX_LON), random.uniform(MILANO_MIN_LAT, MILANO_MAX_LAT))
+            for _ in range(args.queries)
+        ]
+        print(f"{args.shops} negozi, {args.queries} query, raggio {args.radius:.0f} m\n")
+
+        report("ST_Distance <= r (no indice)", await run_queries(conn, OLD_QUERY, points, args.radius))
+        report("ST_DWithin (no indice)", await run_queries(conn, NEW_QUERY, points, args.radius))
+
+        await conn.execute("CREATE INDEX ON bench_shops USING GIST ((geom::geography))")
+        await conn.execute("ANALYZE bench_shops")
+        report("ST_Distance <= r (con indice)", await run_queries(conn, OLD_QUERY, points, args.radius))
+        report("ST_DWithin (con indice)", await run_queries(conn, NEW_QUERY, points, args.radius))
+
+        lon, lat = points[0]
+        print(f"\nPiano ST_Distance: {await plan(conn, OLD_QUERY, lon, lat, args.radius)}")
+        print(f"Piano ST_DWithin:  {await plan(conn, NEW_QUERY, lon, lat, args.radius)}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -59,4 +59,22 @@ docker exec -i clickhouse-server clickhouse-client --query "
     ORDER BY event_id;
 "
 
+# Finestre di attività dei negozi emesse dal worker Faust alla chiusura.
+# ReplacingMergeTree: una finestra riemessa (es. dopo un rebalance) sostituisce la precedente
+echo "Creazione della tabella shop_activity_windows..."
+docker exec -i clickhouse-server clickhouse-client --query "
+    USE nearyou;
+    CREATE TABLE IF NOT EXISTS shop_activity_windows (
+        shop_id         UInt32,
+        window_start    DateTime,
+        window_end      DateTime,
+        window_size_s   UInt32,
+        visits          UInt32,
+        unique_visitors UInt32,
+        inserted_at     DateTime DEFAULT now()
+    ) ENGINE = ReplacingMergeTree(inserted_at)
+    PARTITION BY toYYYYMM(window_start)
+    ORDER BY (window_size_s, shop_id, window_start);
+"
+
 echo "Inizializzazione di ClickHouse completata."
\ No newline at end of file
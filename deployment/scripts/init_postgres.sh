@@ -39,6 +39,11 @@ CREATE TABLE IF NOT EXISTS shops (
     geom GEOMETRY(Point, 4326),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Indice spaziale per le ricerche per raggio (ST_DWithin su geom::geography)
+CREATE INDEX IF NOT EXISTS shops_geom_geography_idx
+    ON shops USING GIST ((geom::geography));
+ANALYZE shops;
 EOF
 
 echo "Inizializzazione di PostGIS completata."
\ No newline at end of file
@@ -3,12 +3,13 @@ Dipendenze condivise per le API dashboard - gestisce connessioni DB, auth, ecc.
 """
 import os
 import logging
-from typing import Generator, Dict, Any
+from typing import Dict, Any
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from clickhouse_driver import Client as CHClient
+
+from src.utils.clickhouse_async import AsyncClickHouseClient
 
 # Constants
 JWT_SECRET = os.getenv("JWT_SECRET", "")
@@ -20,30 +21,31 @@ CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
 CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
 CLICKHOUSE_DATABASE = os.getenv("CLICKHOUSE_DATABASE", "nearyou")
+CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))
+CLICKHOUSE_QUERY_TIMEOUT_S = float(os.getenv("CLICKHOUSE_QUERY_TIMEOUT_S", "30"))
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 logger = logging.getLogger(__name__)
 
-def get_clickhouse_client() -> Generator[CHClient, None, None]:
+# Pool ClickHouse asincrono condiviso da tutte le richieste e dai WebSocket
+ch_pool = AsyncClickHouseClient(
+    pool_size=CLICKHOUSE_POOL_SIZE,
+    timeout=CLICKHOUSE_QUERY_TIMEOUT_S,
+    host=CLICKHOUSE_HOST,
+    port=CLICKHOUSE_PORT,
+    user=CLICKHOUSE_USER,
+    password=CLICKHOUSE_PASSWORD,
+    database=CLICKHOUSE_DATABASE
+)
+
+def get_clickhouse_client() -> AsyncClickHouseClient:
     """
-    Dipendenza FastAPI per ottenere un client ClickHouse.
-    Yield il client e chiudi la connessione quando terminato.
+    Dipendenza FastAPI per ottenere il client ClickHouse asincrono.
+    Le connessioni sono gestite dal pool condiviso, non per richiesta.
     """
-    client = CHClient(
-        host=CLICKHOUSE_HOST,
-        port=CLICKHOUSE_PORT,
-        user=CLICKHOUSE_USER,
-        password=CLICKHOUSE_PASSWORD,
-        database=CLICKHOUSE_DATABASE
-    )
-    
-    try:
-        yield client
-    finally:
-        
-        pass
+    return ch_pool
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
     """
@@ -6,7 +6,7 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from clickhouse_driver import Client as CHClient
+from src.utils.clickhouse_async import AsyncClickHouseClient
 
 from .models import (
     UserProfile, PositionsResponse, Position,
@@ -21,7 +21,7 @@ logger = logging.getLogger(__name__)
 @router.get("/profile", response_model=UserProfile)
 async def get_user_profile(
     current_user: dict = Depends(get_current_user),
-    ch_client: CHClient = Depends(get_clickhouse_client),
+    ch_client: AsyncClickHouseClient = Depends(get_clickhouse_client),
     user_id: Optional[int] = Query(None, description="ID dell'utente (solo per debug)")
 ):
     """Ottiene il profilo dell'utente autenticato."""
@@ -37,7 +37,7 @@ async def get_user_profile(
         LIMIT 1
     """
     
-    rows = ch_client.execute(query, {"uid": uid})
+    rows = await ch_client.query(query, {"uid": uid}, name="dashboard_profile")
     
     if not rows:
         raise HTTPException(
@@ -55,7 +55,7 @@ async def get_user_profile(
 @router.get("/positions", response_model=PositionsResponse)
 async def get_user_positions(
     current_user: dict = Depends(get_current_user),
-    ch_client: CHClient = Depends(get_clickhouse_client)
+    ch_client: AsyncClickHouseClient = Depends(get_clickhouse_client)
 ):
     """Ottiene le posizioni più recenti dell'utente."""
     uid = current_user["user_id"]
@@ -71,7 +71,7 @@ async def get_user_positions(
         GROUP BY user_id
         LIMIT 1
     """
-    rows = ch_client.execute(query, {"uid": uid})
+    rows = await ch_client.query(query, {"uid": uid}, name="dashboard_positions")
     
     if not rows:
         return {"positions": []}
@@ -92,7 +92,7 @@ async def get_user_positions(
 @router.get("/stats", response_model=UserStats)
 async def get_user_stats(
     current_user: dict = Depends(get_current_user),
-    ch_client: CHClient = Depends(get_clickhouse_client),
+    ch_client: AsyncClickHouseClient = Depends(get_clickhouse_client),
     time_period: str = Query("day", description="Periodo di tempo (day, week, month)")
 ):
     """Ottiene statistiche sull'attività dell'utente."""
@@ -119,10 +119,10 @@ async def get_user_stats(
           AND event_time >= %(since)s
     """
     
-    rows = ch_client.execute(query, {
+    rows = await ch_client.query(query, {
         "uid": uid,
         "since": since.strftime("%Y-%m-%d %H:%M:%S")
-    })
+    }, name="dashboard_stats")
     
     if not rows or not rows[0]:
         return UserStats()
@@ -137,7 +137,7 @@ async def get_user_stats(
 @router.get("/promotions", response_model=PromotionsResponse)
 async def get_user_promotions(
     current_user: dict = Depends(get_current_user),
-    ch_client: CHClient = Depends(get_clickhouse_client),
+    ch_client: AsyncClickHouseClient = Depends(get_clickhouse_client),
     limit: int = Query(10, description="Numero massimo di promozioni da restituire"),
     offset: int = Query(0, description="Offset per la paginazione")
 ):
@@ -158,11 +158,11 @@ async def get_user_promotions(
         OFFSET %(offset)s
     """
     
-    rows = ch_client.execute(query, {
+    rows = await ch_client.query(query, {
         "uid": uid,
         "limit": limit,
         "offset": offset
-    })
+    }, name="dashboard_promotions")
     
     result = []
     for row in rows:
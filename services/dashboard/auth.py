@@ -7,7 +7,8 @@ from typing import Dict, Any, Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from clickhouse_driver import Client
+
+from .api.dependencies import ch_pool
 
 logger = logging.getLogger(__name__)
 
@@ -16,26 +17,13 @@ JWT_SECRET = os.getenv("JWT_SECRET", "")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRATION_S = int(os.getenv("JWT_EXPIRATION_S", "3600"))
 
-# Configurazione ClickHouse
-CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse-server")
-CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
-CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
-CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
-CLICKHOUSE_DATABASE = os.getenv("CLICKHOUSE_DATABASE", "nearyou")
-
 # Setup OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
-# Client ClickHouse per login
-ch = Client(
-    host=CLICKHOUSE_HOST,
-    port=CLICKHOUSE_PORT,
-    user=CLICKHOUSE_USER,
-    password=CLICKHOUSE_PASSWORD,
-    database=CLICKHOUSE_DATABASE,
-)
+# Client ClickHouse per login (pool asincrono condiviso con le API)
+ch = ch_pool
 
-def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
+async def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     """
     Autentica un utente verificando username e password.
     
@@ -48,7 +36,7 @@ def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     """
     try:
         q = "SELECT user_id, password FROM users WHERE username = %(u)s LIMIT 1"
-        rows = ch.execute(q, {"u": username})
+        rows = await ch.query(q, {"u": username}, name="login")
         
         if not rows:
             logger.warning(f"Tentativo login fallito: utente {username} non trovato")
@@ -12,11 +12,10 @@ from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from jose import jwt
-from clickhouse_driver import Client as CHClient
 
 # Import nuovi moduli ristrutturati
 from .api import api_router
-from .api.dependencies import get_current_user, get_clickhouse_client
+from .api.dependencies import get_current_user, get_clickhouse_client, ch_pool
 from .api.models import Token
 
 # Import originali da mantenere
@@ -53,7 +52,7 @@ app.include_router(api_router, prefix="/api")
 @app.post("/api/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """Endpoint per l'autenticazione e generazione token JWT."""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Credenziali errate")
     token = create_access_token({"user_id": user["user_id"]})
@@ -161,14 +160,8 @@ async def websocket_positions(websocket: WebSocket):
             "user_id": user_id
         })
         
-        # Crea client ClickHouse per questo WebSocket
-        ch = CHClient(
-            host=os.getenv("CLICKHOUSE_HOST", "clickhouse-server"),
-            port=int(os.getenv("CLICKHOUSE_PORT", "9000")),
-            user=os.getenv("CLICKHOUSE_USER", "default"),
-            password=os.getenv("CLICKHOUSE_PASSWORD", ""),
-            database=os.getenv("CLICKHOUSE_DATABASE", "nearyou"),
-        )
+        # Usa il pool ClickHouse asincrono condiviso, senza bloccare il loop
+        ch = ch_pool
         
         # Loop principale: invia aggiornamenti posizione in tempo reale
         while True:
@@ -186,7 +179,7 @@ async def websocket_positions(websocket: WebSocket):
                 LIMIT 1
             """
             
-            rows = ch.execute(position_query, {"uid": user_id})
+            rows = await ch.query(position_query, {"uid": user_id}, name="ws_position")
             
             if rows:
                 r = rows[0]
@@ -5,18 +5,18 @@ import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 
-from clickhouse_driver import Client as CHClient
+from src.utils.clickhouse_async import AsyncClickHouseClient
 
 logger = logging.getLogger(__name__)
 
 class UserService:
     """Service per gestire operazioni relative agli utenti."""
     
-    def __init__(self, ch_client: CHClient):
-        """Inizializza il service con una connessione ClickHouse."""
+    def __init__(self, ch_client: AsyncClickHouseClient):
+        """Inizializza il service con il client ClickHouse asincrono."""
         self.ch_client = ch_client
     
-    def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+    async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Ottiene il profilo utente dal database."""
         try:
             query = """
@@ -27,7 +27,7 @@ class UserService:
                 LIMIT 1
             """
             
-            rows = self.ch_client.execute(query, {"uid": user_id})
+            rows = await self.ch_client.query(query, {"uid": user_id}, name="user_profile")
             
             if not rows:
                 logger.warning(f"Profilo utente {user_id} non trovato")
@@ -43,7 +43,7 @@ class UserService:
             logger.error(f"Errore recupero profilo utente {user_id}: {e}")
             return None
     
-    def get_recent_positions(self, user_id: int) -> List[Dict[str, Any]]:
+    async def get_recent_positions(self, user_id: int) -> List[Dict[str, Any]]:
         """Ottiene le posizioni più recenti dell'utente."""
         try:
             query = """
@@ -59,7 +59,7 @@ class UserService:
                 LIMIT 1
             """
             
-            rows = self.ch_client.execute(query, {"uid": user_id})
+            rows = await self.ch_client.query(query, {"uid": user_id}, name="user_positions")
             
             if not rows:
                 return []
@@ -76,7 +76,7 @@ class UserService:
             logger.error(f"Errore recupero posizioni utente {user_id}: {e}")
             return []
     
-    def get_promotions(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+    async def get_promotions(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
         """Ottiene le promozioni ricevute dall'utente."""
         try:
             query = """
@@ -93,11 +93,11 @@ class UserService:
                 OFFSET %(offset)s
             """
             
-            rows = self.ch_client.execute(query, {
+            rows = await self.ch_client.query(query, {
                 "uid": user_id,
                 "limit": limit,
                 "offset": offset
-            })
+            }, name="user_promotions")
             
             result = []
             for row in rows:
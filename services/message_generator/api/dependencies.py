@@ -1,12 +1,23 @@
 """
 Dipendenze condivise per il servizio message_generator.
+
+Client LLM, sessione HTTP verso il provider e MessageGeneratorService sono
+creati una sola volta all'avvio (lifespan dell'app) e condivisi da tutte le
+richieste. Se è configurato `LLM_CONFIG_PATH`, il file JSON viene
+controllato periodicamente e a ogni modifica i componenti vengono
+ricostruiti senza riavviare il processo (anche via POST /admin/reload).
 """
 import os
+import json
+import asyncio
 import logging
-from typing import Callable, Any, Dict
+from typing import Callable, Any, Dict, Optional, Set
 
+import aiohttp
 from langchain.chat_models import ChatOpenAI
 
+from ..services.generator_service import MessageGeneratorService
+
 logger = logging.getLogger(__name__)
 
 # Configurazione LLM
@@ -14,40 +25,237 @@ PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
 BASE_URL = os.getenv("OPENAI_API_BASE") or None
 API_KEY = os.getenv("OPENAI_API_KEY")
 
-def get_llm_client() -> ChatOpenAI:
+# Chiamate LLM contemporanee per processo e timeout di ciascuna chiamata
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "10"))
+
+# Numero massimo di coppie utente/POI accettate da /generate/batch
+GENERATE_BATCH_MAX_ITEMS = int(os.getenv("GENERATE_BATCH_MAX_ITEMS", "100"))
+
+# File JSON opzionale con override ricaricabili a caldo (provider, model,
+# temperature, base_url, timeout_s, max_concurrency, prompt_template)
+LLM_CONFIG_PATH = os.getenv("LLM_CONFIG_PATH") or None
+LLM_CONFIG_POLL_S = float(os.getenv("LLM_CONFIG_POLL_S", "5"))
+
+# Token richiesto da /admin/reload (header X-Admin-Token); vuoto = endpoint disabilitato
+ADMIN_TOKEN = os.getenv("MESSAGE_GENERATOR_ADMIN_TOKEN") or None
+
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "groq": "gemma2-9b-it",
+}
+
+def load_llm_settings() -> Dict[str, Any]:
+    """
+    Legge la configurazione LLM: variabili d'ambiente più override dal file.
+
+    Returns:
+        Dict: provider, model, temperature, base_url, timeout_s, max_concurrency, prompt_template
+    """
+    settings = {
+        "provider": PROVIDER,
+        "model": None,
+        "temperature": 0.7,
+        "base_url": BASE_URL,
+        "timeout_s": LLM_TIMEOUT_S,
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "prompt_template": get_prompt_template(),
+    }
+    if LLM_CONFIG_PATH and os.path.exists(LLM_CONFIG_PATH):
+        with open(LLM_CONFIG_PATH) as f:
+            overrides = json.load(f)
+        settings.update({k: v for k, v in overrides.items() if k in settings})
+    settings["provider"] = settings["provider"].lower()
+    if not settings["model"]:
+        # Seleziona il modello in base al provider
+        settings["model"] = DEFAULT_MODELS.get(settings["provider"], "gpt-3.5-turbo")
+    return settings
+
+def get_llm_client(settings: Optional[Dict[str, Any]] = None) -> ChatOpenAI:
     """
     Fornisce un client LLM configurato.
-    
+
+    Args:
+        settings: Configurazione da load_llm_settings() (letta ora se None)
+
     Returns:
         ChatOpenAI: Client configurato per interagire con il modello LLM
-    
+
     Raises:
         RuntimeError: Se la configurazione è mancante
     """
-    if PROVIDER in {"openai", "groq", "together", "fireworks"} and not API_KEY:
+    settings = settings or load_llm_settings()
+    if settings["provider"] in {"openai", "groq", "together", "fireworks"} and not API_KEY:
         raise RuntimeError("OPENAI_API_KEY mancante per il provider scelto")
-    
-    # Seleziona il modello in base al provider
-    if PROVIDER == "openai":
-        model_name = "gpt-4o-mini"
-    elif PROVIDER == "groq":
-        model_name = "gemma2-9b-it"
-    else:
-        model_name = "gpt-3.5-turbo"  # Default fallback
-    
-    logger.info(f"Inizializzazione LLM client con provider: {PROVIDER}, modello: {model_name}")
-    
+
+    logger.info(f"Inizializzazione LLM client con provider: {settings['provider']}, modello: {settings['model']}")
+
     return ChatOpenAI(
-        model=model_name,
-        temperature=0.7,
+        model=settings["model"],
+        temperature=settings["temperature"],
         openai_api_key=API_KEY,
-        openai_api_base=BASE_URL,
+        openai_api_base=settings["base_url"],
+        request_timeout=settings["timeout_s"],
+        # Il timeout complessivo è gestito dal service: niente retry lunghi nel client
+        max_retries=1,
     )
 
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """
+    Semaforo condiviso che limita le chiamate LLM concorrenti del processo.
+
+    Returns:
+        asyncio.Semaphore: Istanza unica per processo
+    """
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+
+class GeneratorRuntime:
+    """Componenti condivisi del message generator, ricostruibili a caldo."""
+
+    def __init__(self):
+        """Inizializza il contenitore vuoto; i componenti nascono in start()."""
+        self.settings: Optional[Dict[str, Any]] = None
+        self.service: Optional[MessageGeneratorService] = None
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self._session_limit: Optional[int] = None
+        self._retired_sessions: Set[asyncio.Task] = set()
+        self._started = False
+        self._config_mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _config_file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(LLM_CONFIG_PATH) if LLM_CONFIG_PATH else None
+        except OSError:
+            return None
+
+    def _resize_http_session(self, settings: Dict[str, Any]) -> None:
+        """Crea la sessione HTTP con un pool adeguato a max_concurrency (solo dopo start())."""
+        if not self._started or settings["max_concurrency"] == self._session_limit:
+            return
+        previous = self.http_session
+        # Connessioni keep-alive riusate per tutte le chiamate al provider
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings["max_concurrency"] * 2, keepalive_timeout=60)
+        )
+        self._session_limit = settings["max_concurrency"]
+        if previous is not None:
+            # Le chiamate in corso usano ancora la sessione precedente: la chiude allo scadere del loro timeout
+            delay = (self.settings or settings)["timeout_s"] + 1
+            task = asyncio.create_task(self._close_later(previous, delay))
+            self._retired_sessions.add(task)
+            task.add_done_callback(self._retired_sessions.discard)
+
+    @staticmethod
+    async def _close_later(session: aiohttp.ClientSession, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            await session.close()
+
+    def _build(self, settings: Dict[str, Any]) -> None:
+        """Crea client e service; le richieste in corso terminano con i precedenti."""
+        global _llm_semaphore
+        llm = get_llm_client(settings)
+        if self.settings is None or settings["max_concurrency"] != self.settings["max_concurrency"]:
+            _llm_semaphore = asyncio.Semaphore(settings["max_concurrency"])
+        self._resize_http_session(settings)
+        self.service = MessageGeneratorService(
+            llm,
+            settings["prompt_template"],
+            get_llm_semaphore(),
+            settings["timeout_s"],
+            http_session=self.http_session,
+        )
+        self.settings = settings
+
+    async def start(self) -> None:
+        """Crea sessione HTTP, client e service; avvia il controllo del file di configurazione."""
+        self._started = True
+        self._config_mtime = self._config_file_mtime()
+        try:
+            self._build(load_llm_settings())
+        except Exception as e:
+            # Il servizio parte comunque (health, cache); /generate riproverà alla prima richiesta
+            logger.error(f"Inizializzazione LLM fallita: {e}")
+        if LLM_CONFIG_PATH:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        """Ferma il controllo della configurazione e chiude le sessioni HTTP."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._retired_sessions):
+            task.cancel()
+        await asyncio.gather(*self._retired_sessions, return_exceptions=True)
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+        self._session_limit = None
+        self._started = False
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Rilegge la configurazione e ricostruisce i componenti se è cambiata.
+
+        Args:
+            force: Ricostruisce anche se la configurazione è invariata
+
+        Returns:
+            bool: True se i componenti sono stati ricostruiti
+        """
+        async with self._lock:
+            settings = load_llm_settings()
+            if not force and settings == self.settings:
+                return False
+            self._build(settings)
+            logger.info(f"Configurazione LLM ricaricata: provider {settings['provider']}, modello {settings['model']}")
+            return True
+
+    async def _watch(self) -> None:
+        """Ricarica la configurazione quando cambia la data di modifica del file."""
+        while True:
+            await asyncio.sleep(LLM_CONFIG_POLL_S)
+            mtime = self._config_file_mtime()
+            if mtime == self._config_mtime:
+                continue
+            self._config_mtime = mtime
+            try:
+                await self.reload()
+            except Exception as e:
+                # Una configurazione non valida non deve fermare il servizio
+                logger.error(f"Errore ricaricamento configurazione LLM, mantengo la precedente: {e}")
+
+
+runtime = GeneratorRuntime()
+
+def get_generator_service() -> MessageGeneratorService:
+    """
+    Fornisce il MessageGeneratorService condiviso.
+
+    Returns:
+        MessageGeneratorService: Istanza creata all'avvio (o alla prima richiesta)
+    """
+    if runtime.service is None:
+        runtime._build(load_llm_settings())
+    return runtime.service
+
 def get_prompt_template():
     """
     Restituisce il template per il prompt di generazione messaggi.
-    
+
     Returns:
         str: Template del prompt formattabile
     """
@@ -66,4 +274,4 @@ Condizioni:
 - L'utente è a pochi metri dal negozio.
 - Il messaggio deve essere breve (max 30 parole) e invogliare l'utente a fermarsi.
 
-Genera il messaggio in italiano:"""
\ No newline at end of file
+Genera il messaggio in italiano:"""
@@ -1,7 +1,7 @@
 """
 Modelli Pydantic per request/response nelle API del message generator.
 """
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 class User(BaseModel):
@@ -41,21 +41,39 @@ class GenerateResponse(BaseModel):
     """Response con messaggio generato."""
     message: str = Field(..., description="Messaggio personalizzato generato")
     cached: bool = Field(False, description="Indica se il messaggio è stato recuperato dalla cache")
+    fallback: bool = Field(False, description="Messaggio generico usato perché il LLM non ha risposto: da non memorizzare")
     
     class Config:
         schema_extra = {
             "example": {
                 "message": "Ciao! Sei a pochi passi dal Caffè Milano. Il loro cappuccino è perfetto per un ingegnere appassionato di tecnologia come te!",
-                "cached": False
+                "cached": False,
+                "fallback": False
             }
         }
 
+class BatchGenerateRequest(BaseModel):
+    """Request per generazione di più messaggi in una sola chiamata."""
+    items: List[GenerateRequest] = Field(..., description="Coppie utente/POI da elaborare")
+
+class BatchGenerateResponse(BaseModel):
+    """Response con i messaggi generati, nello stesso ordine della request."""
+    results: List[GenerateResponse]
+    cached: int = Field(0, description="Messaggi recuperati dalla cache o condivisi nel batch")
+    generated: int = Field(0, description="Messaggi generati con il LLM")
+
 class HealthResponse(BaseModel):
     """Risposta per health check."""
     status: str = "ok"
     version: str = "1.0.0"
     provider: str = Field(..., description="Provider LLM in uso")
 
+class TierStats(BaseModel):
+    """Statistiche di un livello della cache."""
+    hits: int
+    misses: int
+    hit_rate: float
+
 class CacheStats(BaseModel):
     """Statistiche della cache."""
     enabled: bool
@@ -63,4 +81,9 @@ class CacheStats(BaseModel):
     misses: Optional[int] = None
     total: Optional[int] = None
     hit_rate: Optional[float] = None
+    stale_served: Optional[int] = Field(None, description="Messaggi scaduti serviti durante la rigenerazione")
+    early_refreshes: Optional[int] = Field(None, description="Rigenerazioni anticipate prima della scadenza")
+    llm_calls_avoided: Optional[int] = Field(None, description="Chiamate LLM evitate dalla protezione stampede")
+    l1: Optional[TierStats] = Field(None, description="Cache in-process (tutte le richieste)")
+    l2: Optional[TierStats] = Field(None, description="Redis (solo le miss di L1)")
     cache_info: Optional[dict] = None
\ No newline at end of file
@@ -3,14 +3,15 @@ Router per le API del message generator.
 """
 import os
 import logging
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
 
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage
-from langchain import PromptTemplate
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 
-from .models import GenerateRequest, GenerateResponse, HealthResponse, CacheStats
-from .dependencies import get_llm_client, get_prompt_template
+from .models import (
+    GenerateRequest, GenerateResponse, BatchGenerateRequest, BatchGenerateResponse,
+    HealthResponse, CacheStats,
+)
+from .dependencies import get_generator_service, runtime, ADMIN_TOKEN, GENERATE_BATCH_MAX_ITEMS
 from ..services.generator_service import MessageGeneratorService
 from .. import cache_utils
 
@@ -23,7 +24,7 @@ async def health():
     return {
         "status": "ok",
         "version": "1.0.0",
-        "provider": os.getenv("LLM_PROVIDER", "openai")
+        "provider": runtime.settings["provider"] if runtime.settings else os.getenv("LLM_PROVIDER", "openai")
     }
 
 @router.get("/cache/stats", response_model=CacheStats)
@@ -34,14 +35,14 @@ async def cache_stats():
 @router.post("/generate", response_model=GenerateResponse)
 async def generate(
     req: GenerateRequest,
-    llm_client: ChatOpenAI = Depends(get_llm_client)
+    generator_service: MessageGeneratorService = Depends(get_generator_service)
 ):
     """
     Genera un messaggio personalizzato in base al profilo utente e POI.
     
     Args:
         req: Richiesta contenente dati utente e POI
-        llm_client: Client LLM configurato
+        generator_service: Service condiviso creato all'avvio
         
     Returns:
         GenerateResponse: Messaggio generato e info sulla provenienza (cache o no)
@@ -51,17 +52,92 @@ async def generate(
         user_params = req.user.dict()
         poi_params = req.poi.dict()
         
-        # Initializza il service
-        generator_service = MessageGeneratorService(llm_client, get_prompt_template())
+        # Genera o recupera il messaggio dalla cache senza bloccare l'event loop
+        message, is_cached, is_fallback = await generator_service.generate_message(user_params, poi_params)
         
-        # Genera o recupera il messaggio dalla cache
-        message, is_cached = generator_service.generate_message(user_params, poi_params)
-        
-        return GenerateResponse(message=message, cached=is_cached)
+        return GenerateResponse(message=message, cached=is_cached, fallback=is_fallback)
     
     except Exception as e:
         logger.error(f"Errore nella generazione del messaggio: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+@router.post("/generate/batch", response_model=BatchGenerateResponse)
+async def generate_batch(
+    req: BatchGenerateRequest,
+    generator_service: MessageGeneratorService = Depends(get_generator_service)
+):
+    """
+    Genera i messaggi per più coppie utente/POI in una sola richiesta.
+    
+    Le coppie equivalenti sono elaborate una volta, le hit di cache lette
+    insieme e le miss generate in parallelo.
+    
+    Args:
+        req: Richiesta con l'elenco delle coppie utente/POI
+        generator_service: Service condiviso creato all'avvio
+        
+    Returns:
+        BatchGenerateResponse: Messaggi nello stesso ordine della richiesta
+    """
+    if len(req.items) > GENERATE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Massimo {GENERATE_BATCH_MAX_ITEMS} elementi per batch"
+        )
+    
+    try:
+        results = await generator_service.generate_batch(
+            [(item.user.dict(), item.poi.dict()) for item in req.items]
+        )
+    except Exception as e:
+        logger.error(f"Errore nella generazione del batch di messaggi: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    
+    cached = sum(1 for _, is_cached, _ in results if is_cached)
+    return BatchGenerateResponse(
+        results=[
+            GenerateResponse(message=message, cached=is_cached, fallback=is_fallback)
+            for message, is_cached, is_fallback in results
+        ],
+        cached=cached,
+        generated=len(results) - cached
+    )
+
+@router.post("/admin/reload")
+async def reload_config(x_admin_token: Optional[str] = Header(None)):
+    """
+    Ricarica la configurazione LLM e ricostruisce client e service.
+    
+    Args:
+        x_admin_token: Token amministrativo (MESSAGE_GENERATOR_ADMIN_TOKEN)
+        
+    Returns:
+        Dict: Esito e modello attivo
+        
+    Raises:
+        HTTPException: 403 se il token non è configurato o non corrisponde
+    """
+    if not ADMIN_TOKEN:
+        # Senza token configurato l'endpoint resta disabilitato
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Reload amministrativo non configurato")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token non valido")
+    try:
+        await runtime.reload(force=True)
+    except Exception as e:
+        logger.error(f"Errore ricaricamento configurazione: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    return {
+        "reloaded": True,
+        "provider": runtime.settings["provider"],
+        "model": runtime.settings["model"]
+    }
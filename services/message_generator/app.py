@@ -1,17 +1,28 @@
 # services/message_generator/app.py
 
 import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 # Importa il router dalle api
 from .api import api_router
+from .api.dependencies import runtime
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea client LLM, sessione HTTP e service una volta per processo."""
+    await runtime.start()
+    yield
+    await runtime.stop()
 
 # Configurazione applicazione
 app = FastAPI(
     title="NearYou Message Generator",
     description="Servizio di generazione messaggi personalizzati per l'app NearYou",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurazione CORS
@@ -1,16 +1,31 @@
 import os
+import math
+import time
+import random
 import hashlib
 import logging
 import sys
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, NamedTuple, Optional
+
+from prometheus_client import Counter
 
 # Aggiungi il percorso principale al PYTHONPATH
 sys.path.insert(0, '/workspace')  # Percorso alla radice del progetto
 
+try:
+    from src.cache.message_keys import normalize_message_params
+except ImportError:
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("message_keys_module", '/workspace/src/cache/message_keys.py')
+    message_keys_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(message_keys_module)
+    normalize_message_params = message_keys_module.normalize_message_params
+
 try:
     # Tentativo di importazione diretta dalla nuova directory
     from src.cache.redis_cache import RedisCache
     from src.cache.memory_cache import MemoryCache
+    from src.cache.tiered_cache import TieredCache
     logging.info("Moduli di cache importati con successo")
 except ImportError as e:
     logging.warning(f"Errore importazione moduli cache: {e}")
@@ -22,6 +37,7 @@ except ImportError as e:
         # Percorsi aggiornati alla nuova directory
         redis_path = '/workspace/src/cache/redis_cache.py'
         memory_path = '/workspace/src/cache/memory_cache.py'
+        tiered_path = '/workspace/src/cache/tiered_cache.py'
         
         # Importa RedisCache
         spec = importlib.util.spec_from_file_location("redis_cache_module", redis_path)
@@ -35,6 +51,12 @@ except ImportError as e:
         spec.loader.exec_module(memory_cache_module)
         MemoryCache = memory_cache_module.MemoryCache
         
+        # Importa TieredCache
+        spec = importlib.util.spec_from_file_location("tiered_cache_module", tiered_path)
+        tiered_cache_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(tiered_cache_module)
+        TieredCache = tiered_cache_module.TieredCache
+        
         logging.info("Moduli di cache importati tramite percorso assoluto")
     except Exception as fallback_error:
         logging.error(f"Errore importazione moduli cache (fallback): {fallback_error}")
@@ -46,7 +68,11 @@ except ImportError as e:
                 logging.warning("Usando implementazione fallback di RedisCache")
             
             def get(self, key): return None
+            def get_many(self, keys): return {}
             def set(self, key, value, ttl=None): return False
+            def set_many(self, items, ttl=None): return False
+            def acquire_lock(self, name, ttl): return "fallback"
+            def release_lock(self, name, token): return False
             def info(self): return {"status": "fallback-implementation"}
             
         class MemoryCache:
@@ -55,11 +81,20 @@ except ImportError as e:
                 logging.warning("Usando implementazione fallback di MemoryCache")
             
             def get(self, key): return self.cache.get(key)
+            def get_many(self, keys): return {k: self.cache[k] for k in keys if k in self.cache}
             def set(self, key, value, ttl=None): 
                 self.cache[key] = value
                 return True
+            def set_many(self, items, ttl=None):
+                self.cache.update(items)
+                return True
+            def acquire_lock(self, name, ttl): return "fallback"
+            def release_lock(self, name, token): return True
             def info(self): 
                 return {"status": "fallback-memory", "total_keys": len(self.cache)}
+        
+        # Senza Redis la cache in-memory è già locale: nessun livello L1
+        TieredCache = None
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +105,24 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis-cache")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 
+# Livello L1 in-process davanti a Redis, per le chiavi più richieste
+CACHE_L1_ENABLED = os.getenv("CACHE_L1_ENABLED", "true").lower() in ("true", "1", "yes")
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "1000"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "nearyou:cache:invalidate")
+
+# Protezione dallo stampede sulle chiavi scadute:
+# - dopo il TTL logico il messaggio resta servibile (stale) per CACHE_STALE_TTL secondi
+#   mentre una sola richiesta lo rigenera in background;
+# - prima della scadenza la rigenerazione può partire in anticipo (XFetch, fattore beta);
+# - sulle miss solo chi ottiene il lock in Redis chiama il LLM, gli altri attendono
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "3600"))
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "15"))
+CACHE_LOCK_WAIT_S = float(os.getenv("CACHE_LOCK_WAIT_S", "5"))
+# TTL dei messaggi di fallback (LLM in errore), senza finestra stale
+CACHE_FALLBACK_TTL = int(os.getenv("CACHE_FALLBACK_TTL", "60"))
+
 # Gestione corretta della password: None se vuota o non presente
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 if not REDIS_PASSWORD:
@@ -82,9 +135,32 @@ else:
 cache_stats = {
     "hits": 0,
     "misses": 0,
-    "total": 0
+    "total": 0,
+    "stale_served": 0,
+    "early_refreshes": 0,
+    "llm_calls_avoided": 0
 }
 
+LLM_CALLS_AVOIDED = Counter(
+    "message_generator_llm_calls_avoided_total",
+    "Chiamate LLM evitate dalla protezione stampede della cache",
+    ["reason"],
+)
+
+# Stati di un messaggio trovato in cache
+FRESH = "fresh"        # valido
+REFRESH = "refresh"    # valido, ma da rigenerare in anticipo (XFetch)
+STALE = "stale"        # oltre il TTL logico, servibile durante la rigenerazione
+
+# Token restituito quando non c'è un backend per i lock (cache disattivata o Redis in errore)
+UNLOCKED = "unlocked"
+
+class CachedMessage(NamedTuple):
+    """Messaggio letto dalla cache con il suo stato di freschezza."""
+    message: str
+    state: str
+    fallback: bool = False  # messaggio generico salvato con il LLM in errore
+
 # Inizializza cache
 try:
     if CACHE_ENABLED:
@@ -113,6 +189,14 @@ try:
             cache = MemoryCache(default_ttl=CACHE_TTL)
         else:
             logger.info(f"Connessione Redis stabilita: {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+            if CACHE_L1_ENABLED and TieredCache is not None:
+                cache = TieredCache(
+                    cache,
+                    l1_max_entries=CACHE_L1_MAX_ENTRIES,
+                    l1_ttl=CACHE_L1_TTL,
+                    channel=CACHE_INVALIDATION_CHANNEL
+                )
+                logger.info(f"Cache L1 in-process attiva ({CACHE_L1_MAX_ENTRIES} voci, TTL {CACHE_L1_TTL}s)")
     else:
         logger.info("Cache disabilitata da configurazione")
         cache = None
@@ -123,75 +207,196 @@ except Exception as e:
 def generate_cache_key(user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> str:
     """
     Genera una chiave di cache basata sui parametri dell'utente e del POI.
-    Usa una strategia di fuzzy matching per aumentare gli hit di cache.
+    Usa una strategia di fuzzy matching per aumentare gli hit di cache
+    (vedi src.cache.message_keys, condiviso con il servizio di notifiche).
     """
-    # Normalizza età a range di 5 anni per aumentare la possibilità di cache hit
-    age = user_params.get("age", 0)
-    age_range = f"{(age // 5) * 5}-{((age // 5) * 5) + 4}"
-    
-    # Riordina gli interessi alfabeticamente 
-    interests = user_params.get("interests", "")
-    interests_list = sorted([i.strip().lower() for i in interests.split(",") if i.strip()])
-    normalized_interests = ",".join(interests_list)
-    
-    # Normalizza professione (minuscolo)
-    profession = user_params.get("profession", "").lower()
-    
-    # Combina parametri poi
-    poi_name = poi_params.get("name", "").lower()
-    poi_category = poi_params.get("category", "").lower()
-    
-    # Crea stringa combinata e genera hash MD5
-    combined = f"{age_range}:{profession}:{normalized_interests}:{poi_name}:{poi_category}"
+    combined = normalize_message_params(user_params, poi_params)
     hash_key = hashlib.md5(combined.encode()).hexdigest()
     
-    # Log per debug
-    logger.info(f"CACHE_KEY INPUTS: age={age}, profession={profession}")
-    logger.info(f"CACHE_KEY NORMALIZED: age_range={age_range}, normalized_interests={normalized_interests}")
-    logger.info(f"CACHE_KEY COMBINED: {combined}")
-    logger.info(f"CACHE_KEY HASH: {hash_key}")
+    logger.debug(f"CACHE_KEY COMBINED: {combined} -> {hash_key}")
     
     return hash_key
 
-def get_cached_message(user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> Optional[str]:
-    """Recupera un messaggio dalla cache se disponibile."""
-    if not cache or not CACHE_ENABLED:
-        return None
-        
-    cache_key = generate_cache_key(user_params, poi_params)
-    result = cache.get(cache_key)
-    
-    # Aggiorna statistiche
-    cache_stats["total"] += 1
-    if result:
-        cache_stats["hits"] += 1
-        logger.debug(f"Cache HIT: {cache_key}")
-    else:
-        cache_stats["misses"] += 1
-        logger.debug(f"Cache MISS: {cache_key}")
+def should_refresh_early(
+    delta: float,
+    expires_at: float,
+    now: Optional[float] = None,
+    beta: float = CACHE_XFETCH_BETA
+) -> bool:
+    """
+    Decide se rigenerare un messaggio prima della scadenza (XFetch).
+    
+    La probabilità cresce avvicinandosi a `expires_at` e con il costo della
+    generazione, così di norma una sola richiesta rinnova la chiave prima
+    che scada per tutti.
+    
+    Args:
+        delta: Durata in secondi dell'ultima generazione
+        expires_at: Scadenza logica in epoch secondi
+        now: Istante corrente (default time.time())
+        beta: > 1 anticipa il refresh, < 1 lo ritarda
         
-    return result
+    Returns:
+        bool: True se conviene rigenerare ora
+    """
+    now = time.time() if now is None else now
+    # 1 - random() è in (0, 1]: il logaritmo è sempre definito e <= 0
+    return now - delta * beta * math.log(1.0 - random.random()) >= expires_at
 
-def cache_message(user_params: Dict[str, Any], poi_params: Dict[str, Any], message: str) -> bool:
-    """Salva un messaggio in cache."""
+def _classify(value: Any, now: float) -> Optional[CachedMessage]:
+    """Converte il valore letto dalla cache in CachedMessage (None se assente)."""
+    if not value:
+        return None
+    if not isinstance(value, dict):
+        # Voce scritta senza scadenza logica: valida fino al TTL di Redis
+        return CachedMessage(value, FRESH)
+    fallback = value.get("fallback", False)
+    if now >= value["expires_at"]:
+        return CachedMessage(value["message"], STALE, fallback)
+    if should_refresh_early(value.get("delta", 0.0), value["expires_at"], now):
+        return CachedMessage(value["message"], REFRESH, fallback)
+    return CachedMessage(value["message"], FRESH, fallback)
+
+def _record_lookup(found: Dict[str, CachedMessage], total: int) -> None:
+    cache_stats["total"] += total
+    cache_stats["hits"] += len(found)
+    cache_stats["misses"] += total - len(found)
+    cache_stats["stale_served"] += sum(1 for entry in found.values() if entry.state == STALE)
+
+def lookup_message(cache_key: str, record: bool = True) -> Optional[CachedMessage]:
+    """
+    Recupera un messaggio dalla cache con il suo stato di freschezza.
+    
+    Args:
+        cache_key: Chiave generata con generate_cache_key
+        record: Aggiorna le statistiche hit/miss (False per i controlli ripetuti in attesa del lock)
+        
+    Returns:
+        Optional[CachedMessage]: Messaggio e stato, None se assente
+    """
     if not cache or not CACHE_ENABLED:
-        return False
+        return None
+    
+    entry = _classify(cache.get(cache_key), time.time())
+    if record:
+        _record_lookup({cache_key: entry} if entry else {}, 1)
+    logger.debug(f"Cache {'MISS' if entry is None else entry.state.upper()}: {cache_key}")
+    return entry
+
+def lookup_messages(cache_keys: List[str]) -> Dict[str, CachedMessage]:
+    """
+    Recupera più messaggi dalla cache con una sola lettura multipla.
+    
+    Args:
+        cache_keys: Chiavi generate con generate_cache_key (senza duplicati)
         
-    cache_key = generate_cache_key(user_params, poi_params)
+    Returns:
+        Dict[str, CachedMessage]: Messaggi trovati per chiave; le chiavi mancanti sono miss
+    """
+    if not cache or not CACHE_ENABLED or not cache_keys:
+        return {}
+    
+    now = time.time()
+    found = {}
+    for key, value in cache.get_many(cache_keys).items():
+        entry = _classify(value, now)
+        if entry is not None:
+            found[key] = entry
+    _record_lookup(found, len(cache_keys))
+    logger.debug(f"Cache batch: {len(found)}/{len(cache_keys)} hit")
     
-    # Determina TTL adattivo basato su popolarità categoria
-    ttl = CACHE_TTL
+    return found
+
+def get_cached_message(user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> Optional[str]:
+    """Recupera un messaggio dalla cache se disponibile (anche se da rigenerare)."""
+    entry = lookup_message(generate_cache_key(user_params, poi_params))
+    return entry.message if entry else None
+
+def message_ttl(poi_params: Dict[str, Any]) -> int:
+    """Determina TTL adattivo basato su popolarità categoria."""
     poi_category = poi_params.get("category", "").lower()
     popular_categories = ["ristorante", "bar", "abbigliamento", "supermercato"]
     
     # Messaggi per categorie popolari hanno TTL più lungo
     if poi_category in popular_categories:
-        ttl = CACHE_TTL * 2  # TTL doppio per categorie popolari
+        return CACHE_TTL * 2  # TTL doppio per categorie popolari
+    return CACHE_TTL
+
+def store_message(
+    cache_key: str,
+    poi_params: Dict[str, Any],
+    message: str,
+    delta: float = 0.0,
+    fallback: bool = False
+) -> bool:
+    """
+    Salva un messaggio con scadenza logica e costo di generazione.
+    
+    In Redis la voce resta CACHE_STALE_TTL secondi oltre la scadenza
+    logica, per servirla mentre viene rigenerata. I messaggi di fallback
+    restano solo CACHE_FALLBACK_TTL secondi.
+    
+    Args:
+        cache_key: Chiave generata con generate_cache_key
+        poi_params: Parametri del POI (per il TTL adattivo)
+        message: Messaggio da salvare
+        delta: Durata in secondi della generazione (per XFetch)
+        fallback: True se il messaggio è il fallback generico (LLM in errore)
         
-    result = cache.set(cache_key, message, ttl)
-    logger.debug(f"Salvato in cache: {cache_key} (TTL={ttl}s)")
+    Returns:
+        bool: True se la scrittura è riuscita
+    """
+    if not cache or not CACHE_ENABLED:
+        return False
+    
+    ttl = CACHE_FALLBACK_TTL if fallback else message_ttl(poi_params)
+    stale_ttl = 0 if fallback else CACHE_STALE_TTL
+    entry = {"message": message, "delta": delta, "expires_at": time.time() + ttl}
+    if fallback:
+        entry["fallback"] = True
+    result = cache.set(cache_key, entry, ttl + stale_ttl)
+    logger.debug(f"Salvato in cache: {cache_key} (TTL={ttl}s + {stale_ttl}s stale)")
     return result
 
+def cache_message(user_params: Dict[str, Any], poi_params: Dict[str, Any], message: str) -> bool:
+    """Salva un messaggio in cache."""
+    return store_message(generate_cache_key(user_params, poi_params), poi_params, message)
+
+def acquire_generation_lock(cache_key: str) -> Optional[str]:
+    """
+    Lock distribuito per la rigenerazione della chiave.
+    
+    Returns:
+        Optional[str]: Token del lock, None se la rigenerazione è già in corso altrove;
+        UNLOCKED se il backend dei lock non è disponibile (si genera subito, senza attese)
+    """
+    if not cache or not CACHE_ENABLED:
+        return UNLOCKED
+    try:
+        return cache.acquire_lock(f"lock:{cache_key}", CACHE_LOCK_TTL)
+    except Exception as e:
+        logger.warning(f"Lock di rigenerazione non disponibile per {cache_key}: {e}")
+        return UNLOCKED
+
+def release_generation_lock(cache_key: str, token: str) -> None:
+    """Rilascia il lock di rigenerazione della chiave."""
+    if cache and CACHE_ENABLED and token != UNLOCKED:
+        cache.release_lock(f"lock:{cache_key}", token)
+
+def record_early_refresh() -> None:
+    """Conta una rigenerazione anticipata avviata da XFetch."""
+    cache_stats["early_refreshes"] += 1
+
+def record_llm_call_avoided(reason: str) -> None:
+    """
+    Conta una chiamata LLM evitata.
+    
+    Args:
+        reason: "stale" (servito il messaggio scaduto) o "lock_wait" (atteso il messaggio generato da un'altra richiesta)
+    """
+    cache_stats["llm_calls_avoided"] += 1
+    LLM_CALLS_AVOIDED.labels(reason).inc()
+
 def get_cache_stats():
     """Restituisce statistiche sulla cache."""
     if not cache:
@@ -199,11 +404,18 @@ def get_cache_stats():
         
     hit_rate = cache_stats["hits"] / cache_stats["total"] if cache_stats["total"] > 0 else 0
     
-    return {
+    stats = {
         "enabled": CACHE_ENABLED,
         "hits": cache_stats["hits"],
         "misses": cache_stats["misses"],
         "total": cache_stats["total"],
         "hit_rate": hit_rate,
+        "stale_served": cache_stats["stale_served"],
+        "early_refreshes": cache_stats["early_refreshes"],
+        "llm_calls_avoided": cache_stats["llm_calls_avoided"],
         "cache_info": cache.info()
-    }
\ No newline at end of file
+    }
+    # Hit ratio separati per livello quando la L1 è attiva
+    if hasattr(cache, "tier_stats"):
+        stats.update(cache.tier_stats())
+    return stats
\ No newline at end of file
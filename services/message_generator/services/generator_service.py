@@ -1,10 +1,12 @@
 """
 Service per generazione messaggi personalizzati.
 """
+import asyncio
 import logging
 import time
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, List, Set, Tuple, Optional
 
+import openai
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage
 from langchain import PromptTemplate
@@ -18,27 +20,51 @@ class MessageGeneratorService:
     """
     Service per generare messaggi personalizzati usando LLM.
     Implementa caching e fallback.
+    
+    Le chiamate al LLM usano l'interfaccia asincrona di LangChain, quindi
+    l'event loop del worker resta libero durante la generazione. Un
+    semaforo condiviso limita le chiamate contemporanee e ogni chiamata ha
+    un timeout oltre il quale si usa il messaggio di fallback.
+    
+    Contro lo stampede sulle chiavi scadute solo la richiesta che ottiene il
+    lock di rigenerazione chiama il LLM: le altre servono il messaggio
+    scaduto (stale) o attendono quello nuovo. Le chiavi vicine alla
+    scadenza vengono rigenerate in anticipo in background (XFetch).
     """
     
-    def __init__(self, llm_client: ChatOpenAI, prompt_template: str):
+    def __init__(
+        self,
+        llm_client: ChatOpenAI,
+        prompt_template: str,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        timeout: Optional[float] = None,
+        http_session=None
+    ):
         """
         Inizializza il service.
         
         Args:
             llm_client: Client configurato per LLM
             prompt_template: Template per il prompt di generazione
+            semaphore: Limite di chiamate LLM concorrenti (nessuno se None)
+            timeout: Timeout in secondi per chiamata LLM, attesa del semaforo inclusa
+            http_session: aiohttp.ClientSession condivisa verso il provider (None = una per chiamata)
         """
         self.llm_client = llm_client
+        self.semaphore = semaphore
+        self.timeout = timeout
+        self.http_session = http_session
+        self._refreshes: Set[asyncio.Task] = set()
         self.prompt_template = PromptTemplate(
             input_variables=["age", "profession", "interests", "name", "category", "description"],
             template=prompt_template,
         )
     
-    def generate_message(
+    async def generate_message(
         self, 
         user_params: Dict[str, Any], 
         poi_params: Dict[str, Any]
-    ) -> Tuple[str, bool]:
+    ) -> Tuple[str, bool, bool]:
         """
         Genera un messaggio personalizzato o lo recupera dalla cache.
         
@@ -47,23 +73,191 @@ class MessageGeneratorService:
             poi_params: Parametri del POI
             
         Returns:
-            Tuple[str, bool]: Messaggio e flag se dalla cache
+            Tuple[str, bool, bool]: Messaggio, flag se dalla cache e flag se è il fallback
+        """
+        cache_key = cache_utils.generate_cache_key(user_params, poi_params)
+        
+        # Controlla cache (il client Redis è sincrono: fuori dall'event loop)
+        entry = await asyncio.to_thread(cache_utils.lookup_message, cache_key)
+        if entry is not None:
+            logger.info(f"Messaggio trovato in cache ({entry.state}) per POI {poi_params.get('name', '')}")
+            await self._maybe_refresh(cache_key, user_params, poi_params, entry)
+            return entry.message, True, entry.fallback
+        
+        # Se non in cache, genera nuovo messaggio (o attende chi lo sta generando)
+        return await self._fill(cache_key, user_params, poi_params)
+    
+    async def generate_batch(
+        self,
+        items: List[Tuple[Dict[str, Any], Dict[str, Any]]]
+    ) -> List[Tuple[str, bool, bool]]:
+        """
+        Genera i messaggi per più coppie utente/POI.
+        
+        Le coppie con la stessa chiave di cache vengono risolte una volta
+        sola; le hit arrivano da un'unica lettura multipla della cache e le
+        miss vanno al LLM in parallelo, entro il limite del semaforo.
+        
+        Args:
+            items: Coppie (parametri utente, parametri POI)
+            
+        Returns:
+            List[Tuple[str, bool, bool]]: Messaggio, flag cache e flag fallback per ogni coppia,
+            nello stesso ordine; i duplicati di una coppia già presente nel batch risultano dalla cache
         """
-        # Controlla cache
-        cached_message = cache_utils.get_cached_message(user_params, poi_params)
-        if cached_message:
-            logger.info(f"Messaggio trovato in cache per POI {poi_params.get('name', '')}")
-            return cached_message, True
+        keys = [cache_utils.generate_cache_key(user, poi) for user, poi in items]
+        
+        # Prima occorrenza di ogni chiave
+        first: Dict[str, int] = {}
+        for index, key in enumerate(keys):
+            first.setdefault(key, index)
         
-        # Se non in cache, genera nuovo messaggio
-        generated = self._call_llm(user_params, poi_params)
+        entries = await asyncio.to_thread(cache_utils.lookup_messages, list(first))
+        messages = {key: (entry.message, entry.fallback) for key, entry in entries.items()}
+        await asyncio.gather(*(
+            self._maybe_refresh(key, *items[first[key]], entry) for key, entry in entries.items()
+        ))
         
-        # Salva in cache
-        cache_utils.cache_message(user_params, poi_params, generated)
+        cached = set(entries)
+        misses = [key for key in first if key not in cached]
+        if misses:
+            filled = await asyncio.gather(*(self._fill(key, *items[first[key]]) for key in misses))
+            for key, (message, from_cache, fallback) in zip(misses, filled):
+                messages[key] = (message, fallback)
+                if from_cache:
+                    cached.add(key)
         
-        return generated, False
+        logger.info(
+            f"Batch di {len(items)} richieste: {len(first)} distinte, "
+            f"{len(entries)} dalla cache, {len(first) - len(cached)} generate"
+        )
+        return [
+            (messages[key][0], key in cached or first[key] != index, messages[key][1])
+            for index, key in enumerate(keys)
+        ]
     
-    def _call_llm(self, user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> str:
+    async def _fill(
+        self,
+        cache_key: str,
+        user_params: Dict[str, Any],
+        poi_params: Dict[str, Any]
+    ) -> Tuple[str, bool, bool]:
+        """
+        Genera e salva il messaggio di una chiave assente dalla cache.
+        
+        Se un'altra richiesta ha già il lock di rigenerazione, attende il suo
+        messaggio per al massimo CACHE_LOCK_WAIT_S secondi, poi genera comunque.
+        
+        Returns:
+            Tuple[str, bool, bool]: Messaggio, flag se generato da un'altra richiesta e flag se è il fallback
+        """
+        token = await asyncio.to_thread(cache_utils.acquire_generation_lock, cache_key)
+        if token is None:
+            entry = await self._wait_for_message(cache_key)
+            if entry is not None:
+                cache_utils.record_llm_call_avoided("lock_wait")
+                return entry.message, True, entry.fallback
+            logger.warning(f"Nessun messaggio dopo {cache_utils.CACHE_LOCK_WAIT_S}s di attesa, genero: {cache_key}")
+        
+        try:
+            message, delta, generated = await self._timed_call_llm(user_params, poi_params)
+            # Il fallback resta in cache poco: la prossima miss riprova il LLM
+            await asyncio.to_thread(
+                cache_utils.store_message, cache_key, poi_params, message, delta, fallback=not generated
+            )
+        finally:
+            if token is not None:
+                await asyncio.to_thread(cache_utils.release_generation_lock, cache_key, token)
+        return message, False, not generated
+    
+    async def _wait_for_message(self, cache_key: str) -> Optional["cache_utils.CachedMessage"]:
+        """Attende che la richiesta con il lock salvi il messaggio della chiave."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + cache_utils.CACHE_LOCK_WAIT_S
+        delay = 0.05
+        while loop.time() < deadline:
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            entry = await asyncio.to_thread(cache_utils.lookup_message, cache_key, record=False)
+            if entry is not None:
+                return entry
+            delay = min(delay * 2, 0.5)
+        return None
+    
+    async def _maybe_refresh(
+        self,
+        cache_key: str,
+        user_params: Dict[str, Any],
+        poi_params: Dict[str, Any],
+        entry: "cache_utils.CachedMessage"
+    ) -> None:
+        """Avvia in background la rigenerazione di un messaggio scaduto o in scadenza."""
+        if entry.state == cache_utils.FRESH:
+            return
+        token = await asyncio.to_thread(cache_utils.acquire_generation_lock, cache_key)
+        if token is None:
+            # Un'altra richiesta sta già rigenerando la chiave
+            if entry.state == cache_utils.STALE:
+                cache_utils.record_llm_call_avoided("stale")
+            return
+        if entry.state == cache_utils.REFRESH:
+            cache_utils.record_early_refresh()
+        task = asyncio.create_task(self._refresh(cache_key, user_params, poi_params, token))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+    
+    async def _refresh(
+        self,
+        cache_key: str,
+        user_params: Dict[str, Any],
+        poi_params: Dict[str, Any],
+        token: str
+    ) -> None:
+        """Rigenera il messaggio e rilascia il lock; se il LLM fallisce resta il messaggio attuale."""
+        try:
+            message, delta, generated = await self._timed_call_llm(user_params, poi_params)
+            if generated:
+                await asyncio.to_thread(cache_utils.store_message, cache_key, poi_params, message, delta)
+            else:
+                logger.warning(f"Rigenerazione fallita, mantengo il messaggio in cache: {cache_key}")
+        except Exception as e:
+            logger.error(f"Errore rigenerazione messaggio in background: {e}")
+        finally:
+            await asyncio.to_thread(cache_utils.release_generation_lock, cache_key, token)
+    
+    async def _timed_call_llm(
+        self,
+        user_params: Dict[str, Any],
+        poi_params: Dict[str, Any]
+    ) -> Tuple[str, float, bool]:
+        """
+        Chiama il LLM misurandone la durata (per XFetch).
+        
+        Returns:
+            Tuple[str, float, bool]: Messaggio, durata in secondi e False se è il fallback
+        """
+        start_time = time.monotonic()
+        try:
+            message = await self._call_llm(user_params, poi_params)
+            return message, time.monotonic() - start_time, True
+        except RuntimeError:
+            fallback = self._get_fallback_message(poi_params.get("name", "negozio"), poi_params.get("category", ""))
+            return fallback, time.monotonic() - start_time, False
+    
+    async def _invoke_llm(self, prompt_text: str) -> str:
+        """Chiamata asincrona al LLM, dentro il semaforo se configurato."""
+        if self.http_session is not None:
+            # Il client openai usa la sessione del ContextVar invece di aprirne una
+            # nuova (con handshake TLS) a ogni chiamata; vale solo per questo task
+            openai.aiosession.set(self.http_session)
+        messages = [HumanMessage(content=prompt_text)]
+        if self.semaphore is None:
+            result = await self.llm_client.apredict_messages(messages)
+        else:
+            async with self.semaphore:
+                result = await self.llm_client.apredict_messages(messages)
+        return result.content.strip()
+    
+    async def _call_llm(self, user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> str:
         """
         Effettua chiamata a LLM per generare il messaggio.
         
@@ -90,8 +284,8 @@ class MessageGeneratorService:
                 description=poi_params.get("description", ""),
             )
             
-            # Chiamata LLM
-            result = self.llm_client([HumanMessage(content=prompt_text)]).content.strip()
+            # Chiamata LLM non bloccante con timeout
+            result = await asyncio.wait_for(self._invoke_llm(prompt_text), self.timeout)
             
             # Log tempo di generazione
             generation_time = (time.time() - start_time) * 1000
@@ -99,11 +293,13 @@ class MessageGeneratorService:
             
             return result
         
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout generazione messaggio con LLM dopo {self.timeout}s")
+            raise RuntimeError(f"Timeout LLM dopo {self.timeout}s")
+        
         except Exception as e:
             logger.error(f"Errore generazione messaggio con LLM: {e}")
-            
-            # Fallback a messaggio generico
-            return self._get_fallback_message(poi_params.get("name", "negozio"), poi_params.get("category", ""))
+            raise RuntimeError(f"Errore LLM: {e}") from e
     
     def _get_fallback_message(self, shop_name: str, category: str) -> str:
         """
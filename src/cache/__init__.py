@@ -1,4 +1,11 @@
 from .redis_cache import RedisCache
 from .memory_cache import MemoryCache
+from .profile_cache import UserProfileCache
+from .single_flight import SingleFlightCache
+from .tiered_cache import TieredCache
+from .message_keys import generate_cache_key, normalize_message_params
 
-__all__ = ['RedisCache', 'MemoryCache']
\ No newline at end of file
+__all__ = [
+    'RedisCache', 'MemoryCache', 'UserProfileCache', 'SingleFlightCache', 'TieredCache',
+    'generate_cache_key', 'normalize_message_params',
+]
\ No newline at end of file
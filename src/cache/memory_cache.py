@@ -1,7 +1,8 @@
 import time
 import threading
 import logging
-from typing import Any, Dict, Optional
+import uuid
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +12,7 @@ class MemoryCache:
     def __init__(self, default_ttl: int = 86400):
         """Inizializza cache in-memory con pulizia periodica."""
         self.cache = {}  # {key: (value, expire_time)}
+        self.locks = {}  # {name: (token, expire_time)}
         self.default_ttl = default_ttl
         self.lock = threading.RLock()
         
@@ -36,6 +38,15 @@ class MemoryCache:
                 
             return value
     
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Recupera più chiavi; le chiavi assenti o scadute non compaiono nel risultato."""
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+    
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Salva valore nella cache."""
         ttl = ttl if ttl is not None else self.default_ttl
@@ -45,6 +56,12 @@ class MemoryCache:
             self.cache[key] = (value, expire_time)
             return True
     
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva più valori con lo stesso TTL."""
+        for key, value in items.items():
+            self.set(key, value, ttl)
+        return True
+    
     def delete(self, key: str) -> bool:
         """Elimina chiave dalla cache."""
         with self.lock:
@@ -68,6 +85,25 @@ class MemoryCache:
                 
             return True
     
+    def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        """Acquisisce un lock locale con scadenza; None se è già occupato."""
+        with self.lock:
+            holder = self.locks.get(name)
+            if holder is not None and time.time() <= holder[1]:
+                return None
+            token = uuid.uuid4().hex
+            self.locks[name] = (token, time.time() + ttl)
+            return token
+    
+    def release_lock(self, name: str, token: str) -> bool:
+        """Rilascia il lock se il token è ancora quello del proprietario."""
+        with self.lock:
+            holder = self.locks.get(name)
+            if holder is None or holder[0] != token:
+                return False
+            del self.locks[name]
+            return True
+    
     def info(self) -> Dict[str, Any]:
         """Restituisce statistiche sulla cache."""
         with self.lock:
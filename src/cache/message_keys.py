@@ -0,0 +1,50 @@
+"""
+Normalizzazione dei parametri dei messaggi personalizzati.
+
+Condivisa tra message-generator (chiave della cache Redis) e il servizio
+di notifiche Faust (coalescing delle richieste): due richieste con la
+stessa chiave ricevono lo stesso messaggio.
+"""
+import hashlib
+from typing import Any, Dict
+
+
+def normalize_message_params(user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> str:
+    """
+    Riduce i parametri di utente e POI alla forma usata per la chiave.
+
+    L'età è raggruppata in fasce di 5 anni, gli interessi sono ordinati e
+    tutto è in minuscolo, così profili simili condividono la chiave.
+
+    Args:
+        user_params: age, profession, interests
+        poi_params: name, category (la descrizione non partecipa alla chiave)
+
+    Returns:
+        str: Stringa normalizzata "fascia_età:professione:interessi:nome:categoria"
+    """
+    age = user_params.get("age") or 0
+    age_range = f"{(age // 5) * 5}-{((age // 5) * 5) + 4}"
+
+    interests = user_params.get("interests") or ""
+    normalized_interests = ",".join(sorted(i.strip().lower() for i in interests.split(",") if i.strip()))
+
+    profession = (user_params.get("profession") or "").lower()
+    poi_name = (poi_params.get("name") or "").lower()
+    poi_category = (poi_params.get("category") or "").lower()
+
+    return f"{age_range}:{profession}:{normalized_interests}:{poi_name}:{poi_category}"
+
+
+def generate_cache_key(user_params: Dict[str, Any], poi_params: Dict[str, Any]) -> str:
+    """
+    Chiave di cache di un messaggio (MD5 della forma normalizzata).
+
+    Args:
+        user_params: Parametri dell'utente
+        poi_params: Parametri del POI
+
+    Returns:
+        str: Hash esadecimale
+    """
+    return hashlib.md5(normalize_message_params(user_params, poi_params).encode()).hexdigest()
@@ -0,0 +1,182 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Profile = Dict[str, Any]
+
+async def get_user_profile(ch_client, user_id: int) -> Optional[Profile]:
+    """
+    Recupera il profilo dell'utente da ClickHouse.
+
+    Gli errori della query non vengono intercettati: None significa solo
+    "utente inesistente", così un errore temporaneo non finisce in cache
+    come voce negativa.
+
+    Returns:
+        Optional[Dict]: Profilo utente o None se la query non restituisce righe
+    """
+    result = await ch_client.query(
+        """
+        SELECT
+            user_id, age, profession, interests
+        FROM users
+        WHERE user_id = %(user_id)s
+        LIMIT 1
+        """,
+        {"user_id": user_id},
+        name="user_profile"
+    )
+    if not result:
+        logger.warning(f"Profilo utente {user_id} non trovato")
+        return None
+
+    return {
+        "user_id": result[0][0],
+        "age": result[0][1],
+        "profession": result[0][2],
+        "interests": result[0][3]
+    }
+
+async def get_all_user_profiles(ch_client) -> List[Profile]:
+    """Recupera tutti i profili utente da ClickHouse con un'unica query."""
+    rows = await ch_client.query(
+        "SELECT user_id, age, profession, interests FROM users",
+        name="user_profiles_bulk"
+    )
+    return [
+        {"user_id": r[0], "age": r[1], "profession": r[2], "interests": r[3]}
+        for r in rows
+    ]
+
+class UserProfileCache:
+    """
+    Cache LRU dei profili utente con precaricamento e refresh in blocco.
+
+    All'avvio e ogni `refresh_interval` secondi carica tutti i profili con
+    un'unica query (`fetch_all`); gli utenti non presenti vengono cercati
+    singolarmente (`fetch_one`) e, se inesistenti, memorizzati come voce
+    negativa con TTL breve per non ripetere la query a ogni evento.
+    Gli errori di `fetch_one` arrivano al chiamante e non vengono memorizzati.
+    """
+
+    def __init__(
+        self,
+        fetch_one: Callable[[int], Awaitable[Optional[Profile]]],
+        fetch_all: Callable[[], Awaitable[List[Profile]]],
+        ttl: float = 1800,
+        negative_ttl: float = 60,
+        max_entries: int = 100000,
+        refresh_interval: float = 600
+    ):
+        """
+        Inizializza la cache.
+
+        Args:
+            fetch_one: Coroutine che recupera un profilo per user_id (None se inesistente)
+            fetch_all: Coroutine che recupera tutti i profili in un'unica query
+            ttl: Validità in secondi di un profilo in cache
+            negative_ttl: Validità in secondi di una voce "utente inesistente"
+            max_entries: Numero massimo di voci (oltre si scartano le meno usate)
+            refresh_interval: Secondi tra due refresh in blocco
+        """
+        self.fetch_one = fetch_one
+        self.fetch_all = fetch_all
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+
+        self.entries = OrderedDict()  # {user_id: (profile | None, expire_time)}
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _store(self, user_id: int, profile: Optional[Profile], now: float) -> None:
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self.entries[user_id] = (profile, now + ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[Profile]:
+        """
+        Restituisce il profilo di un utente.
+
+        Args:
+            user_id: ID dell'utente
+
+        Returns:
+            Optional[Dict]: Profilo utente o None se l'utente non esiste
+
+        Raises:
+            Exception: L'errore di `fetch_one`; la voce non viene memorizzata
+        """
+        now = time.monotonic()
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[1] > now:
+            self.entries.move_to_end(user_id)
+            if entry[0] is None:
+                self.stats["negative_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+            return entry[0]
+
+        self.stats["misses"] += 1
+        profile = await self.fetch_one(user_id)
+        self._store(user_id, profile, time.monotonic())
+        return profile
+
+    async def refresh(self) -> int:
+        """
+        Ricarica tutti i profili con un'unica query.
+
+        Le voci negative restano valide fino alla loro scadenza.
+
+        Returns:
+            int: Numero di profili caricati
+        """
+        profiles = await self.fetch_all()
+        now = time.monotonic()
+        for profile in profiles:
+            self._store(profile["user_id"], profile, now)
+        logger.info("Cache profili aggiornata: %d profili", len(profiles))
+        return len(profiles)
+
+    async def run(self) -> None:
+        """Loop di refresh periodico."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Errore refresh cache profili: {e}")
+
+    def start(self) -> asyncio.Task:
+        """Avvia il refresh periodico in background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Ferma il refresh periodico."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def info(self) -> Dict[str, Any]:
+        """Restituisce statistiche sulla cache."""
+        return {
+            "status": "profiles",
+            "total_keys": len(self.entries),
+            **self.stats
+        }
@@ -1,10 +1,19 @@
 import json
 import logging
+import uuid
 import redis
-from typing import Any, Optional, Dict
+from typing import Any, Callable, Optional, Dict, List
 
 logger = logging.getLogger(__name__)
 
+# Rilascia il lock solo se è ancora del proprietario (compare-and-delete atomico)
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 class RedisCache:
     """Client Redis per caching con supporto TTL e serializzazione JSON."""
     
@@ -52,16 +61,32 @@ class RedisCache:
         try:
             value = self.client.get(key)
             if value:
-                try:
-                    return json.loads(value)
-                except json.JSONDecodeError:
-                    # Se non è JSON, ritorna il valore raw decodificato
-                    return value.decode('utf-8')
+                return self._decode(value)
             return None
         except Exception as e:
             logger.error(f"Errore cache get({key}): {e}")
             return None
     
+    def _decode(self, value: bytes) -> Any:
+        """Deserializza un valore letto da Redis (JSON o stringa raw)."""
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            # Se non è JSON, ritorna il valore raw decodificato
+            return value.decode('utf-8')
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Recupera più chiavi con un solo MGET; le chiavi assenti non compaiono nel risultato."""
+        if not self.client or not keys:
+            return {}
+        
+        try:
+            values = self.client.mget(keys)
+            return {key: self._decode(value) for key, value in zip(keys, values) if value}
+        except Exception as e:
+            logger.error(f"Errore cache get_many({len(keys)} chiavi): {e}")
+            return {}
+    
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Salva valore in cache con serializzazione JSON."""
         if not self.client:
@@ -83,6 +108,26 @@ class RedisCache:
             logger.error(f"Errore cache set({key}): {e}")
             return False
     
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva più valori con lo stesso TTL in un'unica pipeline."""
+        if not self.client or not items:
+            return False
+        
+        ttl = ttl if ttl is not None else self.default_ttl
+        
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in items.items():
+                if not isinstance(value, (str, bytes)):
+                    value = json.dumps(value)
+                if isinstance(value, str):
+                    value = value.encode('utf-8')
+                pipe.setex(key, ttl, value)
+            return all(pipe.execute())
+        except Exception as e:
+            logger.error(f"Errore cache set_many({len(items)} chiavi): {e}")
+            return False
+    
     def delete(self, key: str) -> bool:
         """Elimina chiave dalla cache."""
         if not self.client:
@@ -105,6 +150,81 @@ class RedisCache:
             logger.error(f"Errore cache exists({key}): {e}")
             return False
     
+    def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        """
+        Acquisisce un lock distribuito con SET NX e scadenza.
+        
+        Args:
+            name: Chiave del lock
+            ttl: Durata massima del lock in secondi (libera il lock se il proprietario muore)
+            
+        Returns:
+            Optional[str]: Token da passare a release_lock, None se il lock è di un altro
+            
+        Raises:
+            redis.RedisError: Se Redis non risponde (diverso da "lock occupato")
+            ConnectionError: Se il client Redis non è inizializzato
+        """
+        if not self.client:
+            raise ConnectionError("Redis non disponibile")
+        
+        token = uuid.uuid4().hex
+        if self.client.set(name, token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+    
+    def release_lock(self, name: str, token: str) -> bool:
+        """Rilascia il lock se il token è ancora quello del proprietario."""
+        if not self.client:
+            return False
+        
+        try:
+            return bool(self.client.eval(_RELEASE_LOCK, 1, name, token))
+        except Exception as e:
+            logger.error(f"Errore cache release_lock({name}): {e}")
+            return False
+    
+    def publish(self, channel: str, message: str) -> int:
+        """Pubblica un messaggio su un canale pub/sub; restituisce i destinatari."""
+        if not self.client:
+            return 0
+        
+        try:
+            return self.client.publish(channel, message)
+        except Exception as e:
+            logger.error(f"Errore cache publish({channel}): {e}")
+            return 0
+    
+    def subscribe(self, channel: str, handler: Callable[[str], None]):
+        """
+        Ascolta un canale pub/sub in un thread daemon.
+        
+        Args:
+            channel: Nome del canale
+            handler: Funzione chiamata con il testo di ogni messaggio
+            
+        Returns:
+            Thread del listener (None se Redis non è disponibile)
+        """
+        if not self.client:
+            return None
+        
+        def on_message(message):
+            handler(message["data"].decode("utf-8"))
+        
+        def on_error(error, pubsub, thread):
+            # Il thread si ferma: chi usa il canale deve tollerare messaggi persi
+            logger.error(f"Listener pub/sub su {channel} interrotto: {error}")
+            thread.stop()
+        
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: on_message})
+            return pubsub.run_in_thread(sleep_time=1.0, daemon=True, exception_handler=on_error)
+        except Exception as e:
+            logger.error(f"Errore cache subscribe({channel}): {e}")
+            return None
+    
     def info(self) -> Dict[str, Any]:
         """Restituisce statistiche sul server Redis."""
         if not self.client:
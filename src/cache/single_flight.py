@@ -0,0 +1,109 @@
+"""
+Coalescing delle richieste concorrenti con piccola cache a TTL.
+
+Se più coroutine chiedono la stessa chiave mentre il calcolo è in corso,
+attendono tutte lo stesso risultato invece di ripetere la chiamata; il
+risultato resta poi in una cache LRU locale per `ttl` secondi.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightCache:
+    """Single-flight per chiave con risultati memorizzati a TTL."""
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_entries: int = 10000,
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ):
+        """
+        Inizializza la cache.
+
+        Args:
+            ttl: Validità in secondi di un risultato (0 = solo coalescing)
+            max_entries: Numero massimo di risultati (oltre si scartano i meno usati)
+            cacheable: Predicato sui risultati da memorizzare (default: tutti)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cacheable = cacheable or (lambda value: True)
+
+        self.entries = OrderedDict()  # {key: (valore, expire_time)}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {"hits": 0, "coalesced": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0 or not self.cacheable(value):
+            return
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Restituisce il valore della chiave, calcolandolo al più una volta.
+
+        Args:
+            key: Chiave normalizzata della richiesta
+            compute: Coroutine factory che produce il valore
+
+        Returns:
+            Tuple[Any, bool]: (valore, condiviso) dove condiviso indica che il
+            valore viene dalla cache o da un calcolo avviato da un'altra richiesta
+
+        Raises:
+            Exception: L'errore di `compute`, propagato a tutte le richieste in attesa
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0], True
+            del self.entries[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            # shield: se un chiamante viene cancellato il calcolo continua per gli altri
+            return await asyncio.shield(future), True
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita "exception was never retrieved" se nessuno era in attesa
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value)
+            return value, False
+        finally:
+            self._inflight.pop(key, None)
+
+    def info(self) -> Dict[str, Any]:
+        """Restituisce statistiche sulla cache."""
+        return {
+            "status": "single-flight",
+            "total_keys": len(self.entries),
+            "inflight": len(self._inflight),
+            **self.stats
+        }
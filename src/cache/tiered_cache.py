@@ -0,0 +1,209 @@
+"""
+Cache a due livelli: LRU in-process (L1) davanti a Redis (L2).
+
+Il traffico si concentra su poche combinazioni profilo/negozio: per
+queste la L1 evita il round trip verso Redis. La L1 ha un TTL breve e una
+dimensione limitata; quando un processo scrive o cancella una chiave lo
+annuncia sul canale pub/sub di invalidazione e gli altri processi la
+tolgono dalla propria L1. Se il listener si interrompe, una voce non
+aggiornata resta al massimo per il TTL della L1.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """LRU locale con TTL breve sopra una cache condivisa (RedisCache o MemoryCache)."""
+
+    def __init__(
+        self,
+        l2,
+        l1_max_entries: int = 1000,
+        l1_ttl: float = 30,
+        channel: Optional[str] = "nearyou:cache:invalidate"
+    ):
+        """
+        Inizializza la cache e, se L2 supporta pub/sub, il listener di invalidazione.
+
+        Args:
+            l2: Cache condivisa con l'interfaccia di RedisCache
+            l1_max_entries: Numero massimo di voci in L1 (oltre si scartano le meno usate)
+            l1_ttl: Validità in secondi di una voce in L1
+            channel: Canale pub/sub di invalidazione (None = nessuna invalidazione)
+        """
+        self.l2 = l2
+        self.l1_max_entries = l1_max_entries
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+
+        self.l1 = OrderedDict()  # {key: (valore, expire_time)}
+        self.lock = threading.RLock()
+        self.stats = {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0, "invalidations": 0}
+
+        # Identifica i messaggi di questo processo, ignorati dal proprio listener
+        self.instance_id = uuid.uuid4().hex
+        self.listener = None
+        if channel and hasattr(l2, "subscribe"):
+            self.listener = l2.subscribe(channel, self._on_invalidation)
+
+    # --- L1 ------------------------------------------------------------------
+
+    def _l1_get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.l1.get(key)
+            if entry is None:
+                return None
+            value, expire_time = entry
+            if time.monotonic() > expire_time:
+                del self.l1[key]
+                return None
+            self.l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        l1_ttl = self.l1_ttl if ttl is None else min(self.l1_ttl, ttl)
+        with self.lock:
+            self.l1[key] = (value, time.monotonic() + l1_ttl)
+            self.l1.move_to_end(key)
+            while len(self.l1) > self.l1_max_entries:
+                self.l1.popitem(last=False)
+
+    def _l1_drop(self, key: str) -> None:
+        with self.lock:
+            self.l1.pop(key, None)
+
+    # --- Invalidazione -------------------------------------------------------
+
+    def _publish(self, keys: List[str]) -> None:
+        if self.listener is None:
+            return
+        for key in keys:
+            self.l2.publish(self.channel, f"{self.instance_id}:{key}")
+
+    def _on_invalidation(self, message: str) -> None:
+        """Rimuove dalla L1 una chiave modificata da un altro processo."""
+        sender, _, key = message.partition(":")
+        if sender == self.instance_id:
+            return
+        self._l1_drop(key)
+        with self.lock:
+            self.stats["invalidations"] += 1
+
+    def invalidate(self, key: str) -> None:
+        """Rimuove la chiave dalla L1 di tutti i processi senza toccare L2."""
+        self._l1_drop(key)
+        self._publish([key])
+
+    # --- Interfaccia cache ---------------------------------------------------
+
+    def get(self, key: str) -> Optional[Any]:
+        """Recupera valore da L1, poi da L2 (ricopiandolo in L1)."""
+        value = self._l1_get(key)
+        if value is not None:
+            with self.lock:
+                self.stats["l1_hits"] += 1
+            return value
+
+        value = self.l2.get(key)
+        with self.lock:
+            self.stats["l1_misses"] += 1
+            self.stats["l2_hits" if value is not None else "l2_misses"] += 1
+        if value is not None:
+            self._l1_set(key, value)
+        return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Recupera più chiavi: quelle assenti in L1 con una sola lettura da L2."""
+        result = {}
+        missing = []
+        for key in keys:
+            value = self._l1_get(key)
+            if value is not None:
+                result[key] = value
+            else:
+                missing.append(key)
+
+        found = self.l2.get_many(missing) if missing else {}
+        for key, value in found.items():
+            self._l1_set(key, value)
+        result.update(found)
+
+        with self.lock:
+            self.stats["l1_hits"] += len(keys) - len(missing)
+            self.stats["l1_misses"] += len(missing)
+            self.stats["l2_hits"] += len(found)
+            self.stats["l2_misses"] += len(missing) - len(found)
+        return result
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Salva valore in L2 e in L1, invalidando la chiave negli altri processi."""
+        result = self.l2.set(key, value, ttl)
+        self._l1_set(key, value, ttl)
+        self._publish([key])
+        return result
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva più valori con lo stesso TTL in L2 e in L1."""
+        result = self.l2.set_many(items, ttl)
+        for key, value in items.items():
+            self._l1_set(key, value, ttl)
+        self._publish(list(items))
+        return result
+
+    def delete(self, key: str) -> bool:
+        """Elimina la chiave da L2 e dalla L1 di tutti i processi."""
+        self._l1_drop(key)
+        result = self.l2.delete(key)
+        self._publish([key])
+        return result
+
+    def exists(self, key: str) -> bool:
+        """Verifica se la chiave esiste in L1 o in L2."""
+        return self._l1_get(key) is not None or self.l2.exists(key)
+
+    def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        """Acquisisce il lock su L2, condiviso tra i processi."""
+        return self.l2.acquire_lock(name, ttl)
+
+    def release_lock(self, name: str, token: str) -> bool:
+        """Rilascia il lock su L2."""
+        return self.l2.release_lock(name, token)
+
+    def tier_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Hit ratio separati per livello.
+
+        Returns:
+            Dict: Per "l1" e "l2" hits, misses e hit_rate; la L2 conta solo le miss di L1
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        tiers = {}
+        for tier in ("l1", "l2"):
+            hits, misses = stats[f"{tier}_hits"], stats[f"{tier}_misses"]
+            total = hits + misses
+            tiers[tier] = {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0}
+        return tiers
+
+    def info(self) -> Dict[str, Any]:
+        """Restituisce statistiche di entrambi i livelli."""
+        with self.lock:
+            l1_entries = len(self.l1)
+            invalidations = self.stats["invalidations"]
+        return {
+            "status": "tiered",
+            "l1": {
+                "entries": l1_entries,
+                "max_entries": self.l1_max_entries,
+                "ttl": self.l1_ttl,
+                "invalidations_received": invalidations,
+                "invalidation_listener": self.listener is not None and self.listener.is_alive(),
+            },
+            "l2": self.l2.info(),
+        }
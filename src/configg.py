@@ -20,6 +20,30 @@ KAFKA_BROKER = os.getenv("KAFKA_BROKER", "kafka:9093")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "gps_stream")
 CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "gps_consumers_group")
 
+# Simulatore GPS (producer): scheduler a tick centralizzato
+PRODUCER_TARGET_EPS = float(os.getenv("PRODUCER_TARGET_EPS", "1000"))
+PRODUCER_TICK_S = float(os.getenv("PRODUCER_TICK_S", "0.1"))
+PRODUCER_POINT_INTERVAL_S = float(os.getenv("PRODUCER_POINT_INTERVAL_S", "2.0"))
+PRODUCER_ROUTE_CONCURRENCY = int(os.getenv("PRODUCER_ROUTE_CONCURRENCY", "32"))
+PRODUCER_STATS_INTERVAL_S = float(os.getenv("PRODUCER_STATS_INTERVAL_S", "1.0"))
+
+# Profili del producer Kafka (batching, compressione, acks)
+KAFKA_PRODUCER_PROFILES = {
+    # Default di aiokafka: nessun batching né compressione
+    "default": {"linger_ms": 0, "max_batch_size": 16384, "compression_type": None, "acks": 1},
+    # Batch grandi e compressi: meno overhead per messaggio su broker e rete
+    "throughput": {"linger_ms": 20, "max_batch_size": 262144, "compression_type": "lz4", "acks": 1},
+    # Consegna confermata da tutte le repliche, senza duplicati
+    "durable": {
+        "linger_ms": 5, "max_batch_size": 65536, "compression_type": "zstd",
+        "acks": "all", "enable_idempotence": True,
+    },
+}
+KAFKA_PRODUCER_PROFILE = os.getenv("KAFKA_PRODUCER_PROFILE", "throughput")
+
+# Formato dei messaggi su gps_stream: "json" (storico) o "gps-v1" (binario compatto)
+GPS_WIRE_FORMAT = os.getenv("GPS_WIRE_FORMAT", "json")
+
 # Configurazione percorsi certificati
 SSL_CAFILE = os.getenv("SSL_CAFILE", "/workspace/certs/ca.crt")
 SSL_CERTFILE = os.getenv("SSL_CERTFILE", "/workspace/certs/client_cert.pem")
@@ -31,6 +55,8 @@ CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "pwe@123@l@")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "9000"))
 CLICKHOUSE_DATABASE = os.getenv("CLICKHOUSE_DATABASE", "nearyou")
+CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))
+CLICKHOUSE_QUERY_TIMEOUT_S = float(os.getenv("CLICKHOUSE_QUERY_TIMEOUT_S", "30"))
 
 # Configurazione Postgres
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres-postgis")
@@ -39,12 +65,83 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "nearypass")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "near_you_shops")
 POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
 
+# Indice spaziale in-memory dei negozi (consumer)
+SHOP_INDEX_REFRESH_S = float(os.getenv("SHOP_INDEX_REFRESH_S", "300"))
+SHOP_INDEX_CELL_M = float(os.getenv("SHOP_INDEX_CELL_M", "250"))
+
+# Scritture a micro-batch su ClickHouse (consumer)
+CH_BATCH_MAX_ROWS = int(os.getenv("CH_BATCH_MAX_ROWS", "1000"))
+CH_BATCH_MAX_AGE_S = float(os.getenv("CH_BATCH_MAX_AGE_S", "1.0"))
+# Righe in buffer oltre cui il writer applica backpressure (default 10 × max rows)
+CH_BATCH_MAX_BUFFER = int(os.getenv("CH_BATCH_MAX_BUFFER", "10000"))
+# Tentativi di INSERT per flush e backoff esponenziale tra un tentativo e l'altro
+CH_BATCH_RETRIES = int(os.getenv("CH_BATCH_RETRIES", "3"))
+CH_BATCH_BACKOFF_S = float(os.getenv("CH_BATCH_BACKOFF_S", "0.5"))
+
+# Scritture bufferizzate degli eventi di notifica (Faust analytics agent)
+ANALYTICS_BATCH_MAX_ROWS = int(os.getenv("ANALYTICS_BATCH_MAX_ROWS", "500"))
+ANALYTICS_BATCH_MAX_AGE_S = float(os.getenv("ANALYTICS_BATCH_MAX_AGE_S", "2.0"))
+ANALYTICS_BATCH_MAX_BUFFER = int(os.getenv("ANALYTICS_BATCH_MAX_BUFFER", "5000"))
+
+# State store delle tabelle Faust: con "rocksdb://" lo stato resta su disco
+# insieme all'offset di changelog già applicato, quindi al riavvio si
+# rilegge solo la coda del changelog invece dell'intero topic
+FAUST_STORE = os.getenv("FAUST_STORE", "rocksdb://")
+FAUST_DATADIR = os.getenv("FAUST_DATADIR", "faust-data")
+# Repliche standby: un altro worker tiene una copia calda delle partizioni
+FAUST_TABLE_STANDBY_REPLICAS = int(os.getenv("FAUST_TABLE_STANDBY_REPLICAS", "1"))
+# Posizioni recenti conservate per utente nella tabella user_states (max 255)
+USER_STATE_POSITIONS = int(os.getenv("USER_STATE_POSITIONS", "10"))
+
+# Finestre di attività dei negozi (Faust): tumbling breve e hopping lunga.
+# Una finestra viene chiusa, scritta in ClickHouse e rimossa dopo il ritardo
+# massimo tollerato per eventi in ritardo
+SHOP_WINDOW_SHORT_S = int(os.getenv("SHOP_WINDOW_SHORT_S", "300"))
+SHOP_WINDOW_LONG_S = int(os.getenv("SHOP_WINDOW_LONG_S", "3600"))
+SHOP_WINDOW_LONG_STEP_S = int(os.getenv("SHOP_WINDOW_LONG_STEP_S", "900"))
+SHOP_WINDOW_GRACE_S = int(os.getenv("SHOP_WINDOW_GRACE_S", "60"))
+
+# Elaborazione concorrente nel consumer (worker con shard per user_id)
+CONSUMER_CONCURRENCY = int(os.getenv("CONSUMER_CONCURRENCY", "16"))
+CONSUMER_QUEUE_SIZE = int(os.getenv("CONSUMER_QUEUE_SIZE", "100"))
+
+# Cache dei profili utente (consumer)
+PROFILE_CACHE_TTL_S = float(os.getenv("PROFILE_CACHE_TTL_S", "1800"))
+PROFILE_CACHE_NEGATIVE_TTL_S = float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL_S", "60"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "100000"))
+PROFILE_CACHE_REFRESH_S = float(os.getenv("PROFILE_CACHE_REFRESH_S", "600"))
+
 # URL del micro-servizio che genera i messaggi
 MESSAGE_GENERATOR_URL = os.getenv(
     "MESSAGE_GENERATOR_URL",
     "http://message-generator:8001/generate",
 )
 
+# Endpoint batch del message generator e raggruppamento delle richieste
+# (Faust e consumer): una POST per micro-batch invece che per notifica
+MESSAGE_GENERATOR_BATCH_URL = os.getenv(
+    "MESSAGE_GENERATOR_BATCH_URL",
+    MESSAGE_GENERATOR_URL.rstrip("/") + "/batch",
+)
+MESSAGE_BATCH_MAX_ITEMS = int(os.getenv("MESSAGE_BATCH_MAX_ITEMS", "32"))
+MESSAGE_BATCH_MAX_DELAY_S = float(os.getenv("MESSAGE_BATCH_MAX_DELAY_S", "0.02"))
+
+# Client HTTP condiviso verso il message generator
+MESSAGE_GENERATOR_MAX_CONNECTIONS = int(os.getenv("MESSAGE_GENERATOR_MAX_CONNECTIONS", "50"))
+MESSAGE_GENERATOR_MAX_KEEPALIVE = int(os.getenv("MESSAGE_GENERATOR_MAX_KEEPALIVE", "20"))
+MESSAGE_GENERATOR_TIMEOUT_S = float(os.getenv("MESSAGE_GENERATOR_TIMEOUT_S", "10"))
+MESSAGE_GENERATOR_DEADLINE_S = float(os.getenv("MESSAGE_GENERATOR_DEADLINE_S", "15"))
+MESSAGE_GENERATOR_RETRIES = int(os.getenv("MESSAGE_GENERATOR_RETRIES", "2"))
+MESSAGE_GENERATOR_HTTP2 = os.getenv("MESSAGE_GENERATOR_HTTP2", "false").lower() in ("true", "1", "yes")
+
+# Coalescing delle richieste al message generator (Faust): risultati
+# condivisi tra richieste con la stessa chiave normalizzata
+NOTIFICATION_CACHE_TTL_S = float(os.getenv("NOTIFICATION_CACHE_TTL_S", "60"))
+NOTIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("NOTIFICATION_CACHE_MAX_ENTRIES", "10000"))
+
+# Porta per le metriche Prometheus del consumer
+CONSUMER_METRICS_PORT = int(os.getenv("CONSUMER_METRICS_PORT", "8004"))
+
 # —————— Configurazione JWT ——————
 JWT_SECRET = os.getenv(
     "JWT_SECRET",
@@ -69,6 +166,14 @@ MILANO_MAX_LAT = float(os.getenv("MILANO_MAX_LAT", "45.50"))
 MILANO_MIN_LON = float(os.getenv("MILANO_MIN_LON", "9.10"))
 MILANO_MAX_LON = float(os.getenv("MILANO_MAX_LON", "9.30"))
 
+# Percorsi del simulatore: cache persistente, pool offline e fallback
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", "")
+ROUTE_POOL_PATH = os.getenv("ROUTE_POOL_PATH", "")
+ROUTE_CACHE_CELL_M = float(os.getenv("ROUTE_CACHE_CELL_M", "250"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "50000"))
+ROUTE_OSRM_CONCURRENCY = int(os.getenv("ROUTE_OSRM_CONCURRENCY", "16"))
+ROUTE_SYNTHETIC_FALLBACK = os.getenv("ROUTE_SYNTHETIC_FALLBACK", "true").lower() in ("true", "1", "yes")
+
 # Config Redis cache
 REDIS_HOST = os.getenv("REDIS_HOST", "redis-cache")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
@@ -97,6 +202,30 @@ def get_clickhouse_config() -> Dict[str, Any]:
         "database": CLICKHOUSE_DATABASE,
     }
 
+def get_kafka_producer_config() -> Dict[str, Any]:
+    """
+    Restituisce i parametri di AIOKafkaProducer per il profilo scelto.
+
+    Il profilo è KAFKA_PRODUCER_PROFILE; i singoli valori possono essere
+    sovrascritti con KAFKA_PRODUCER_LINGER_MS, KAFKA_PRODUCER_BATCH_SIZE,
+    KAFKA_PRODUCER_COMPRESSION ("none" per disattivarla) e KAFKA_PRODUCER_ACKS.
+    """
+    if KAFKA_PRODUCER_PROFILE not in KAFKA_PRODUCER_PROFILES:
+        logger.warning(f"Profilo producer Kafka sconosciuto '{KAFKA_PRODUCER_PROFILE}', uso 'default'")
+    config = dict(KAFKA_PRODUCER_PROFILES.get(KAFKA_PRODUCER_PROFILE, KAFKA_PRODUCER_PROFILES["default"]))
+
+    if os.getenv("KAFKA_PRODUCER_LINGER_MS"):
+        config["linger_ms"] = int(os.getenv("KAFKA_PRODUCER_LINGER_MS"))
+    if os.getenv("KAFKA_PRODUCER_BATCH_SIZE"):
+        config["max_batch_size"] = int(os.getenv("KAFKA_PRODUCER_BATCH_SIZE"))
+    if os.getenv("KAFKA_PRODUCER_COMPRESSION"):
+        compression = os.getenv("KAFKA_PRODUCER_COMPRESSION").lower()
+        config["compression_type"] = None if compression == "none" else compression
+    if os.getenv("KAFKA_PRODUCER_ACKS"):
+        acks = os.getenv("KAFKA_PRODUCER_ACKS")
+        config["acks"] = acks if acks == "all" else int(acks)
+    return config
+
 def get_postgres_uri() -> str:
     """Restituisce URI di connessione PostgreSQL."""
     return f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
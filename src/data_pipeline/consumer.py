@@ -2,24 +2,38 @@
 import os
 import asyncio
 import ssl
-import json
 import logging                
 from datetime import datetime, timezone
 
 import asyncpg
-import httpx
-from aiokafka import AIOKafkaConsumer
-from clickhouse_driver import Client as CHClient
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from prometheus_client import start_http_server
 
 from src.utils.logger_config import setup_logging
 from src.configg import (
     KAFKA_BROKER, KAFKA_TOPIC, CONSUMER_GROUP,
     SSL_CAFILE, SSL_CERTFILE, SSL_KEYFILE,
     POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB,
-    CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE,
-    MESSAGE_GENERATOR_URL,
+    MESSAGE_GENERATOR_URL, MESSAGE_GENERATOR_BATCH_URL,
+    MESSAGE_BATCH_MAX_ITEMS, MESSAGE_BATCH_MAX_DELAY_S,
+    MESSAGE_GENERATOR_MAX_CONNECTIONS, MESSAGE_GENERATOR_MAX_KEEPALIVE,
+    MESSAGE_GENERATOR_TIMEOUT_S, MESSAGE_GENERATOR_DEADLINE_S,
+    MESSAGE_GENERATOR_RETRIES, MESSAGE_GENERATOR_HTTP2,
+    CONSUMER_METRICS_PORT,
+    SHOP_INDEX_REFRESH_S, SHOP_INDEX_CELL_M,
+    CH_BATCH_MAX_ROWS, CH_BATCH_MAX_AGE_S, CH_BATCH_MAX_BUFFER, CH_BATCH_RETRIES, CH_BATCH_BACKOFF_S,
+    CONSUMER_CONCURRENCY, CONSUMER_QUEUE_SIZE,
+    PROFILE_CACHE_TTL_S, PROFILE_CACHE_NEGATIVE_TTL_S,
+    PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_REFRESH_S,
 )
 from src.utils.utils import wait_for_broker
+from src.utils.geo import ShopIndexRefresher
+from src.utils.clickhouse_writer import ClickHouseBatchWriter
+from src.utils.clickhouse_async import get_async_clickhouse
+from src.cache.profile_cache import UserProfileCache, get_user_profile, get_all_user_profiles
+from src.utils.gps_codec import decode_location
+from src.utils.http_client import PooledHTTPClient
+from src.utils.micro_batcher import MicroBatcher
 
 logger = logging.getLogger(__name__)
 setup_logging()
@@ -27,6 +41,12 @@ setup_logging()
 # Configurazione soglia distanza per messaggi (in metri)
 MAX_POI_DISTANCE = 200  # Utenti entro 200m riceveranno messaggi
 
+USER_EVENTS_INSERT = """
+    INSERT INTO user_events
+      (event_id, event_time, user_id, latitude, longitude, poi_range, poi_name, poi_info)
+    VALUES
+"""
+
 async def wait_for_postgres(retries: int = 30, delay: int = 2):
     for i in range(retries):
         try:
@@ -44,14 +64,10 @@ async def wait_for_postgres(retries: int = 30, delay: int = 2):
     raise RuntimeError("Postgres non pronto dopo troppe prove")
 
 async def wait_for_clickhouse(retries: int = 30, delay: int = 2):
+    ch = get_async_clickhouse()
     for i in range(retries):
         try:
-            ch = CHClient(
-                host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT,
-                user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD,
-                database=CLICKHOUSE_DATABASE
-            )
-            ch.execute("SELECT 1")
+            await ch.query("SELECT 1", timeout=5, name="healthcheck")
             logger.info("ClickHouse è pronto")
             return
         except Exception:
@@ -59,34 +75,6 @@ async def wait_for_clickhouse(retries: int = 30, delay: int = 2):
             await asyncio.sleep(delay)
     raise RuntimeError("ClickHouse non pronto dopo troppe prove")
 
-async def get_user_profile(ch_client, user_id):
-    """Recupera il profilo dell'utente da ClickHouse."""
-    try:
-        result = ch_client.execute(
-            """
-            SELECT
-                user_id, age, profession, interests
-            FROM users
-            WHERE user_id = %(user_id)s
-            LIMIT 1
-            """,
-            {"user_id": user_id}
-        )
-        if not result:
-            logger.warning(f"Profilo utente {user_id} non trovato")
-            return None
-            
-        user_data = {
-            "user_id": result[0][0],
-            "age": result[0][1],
-            "profession": result[0][2],
-            "interests": result[0][3]
-        }
-        return user_data
-    except Exception as e:
-        logger.error(f"Errore recupero profilo utente {user_id}: {e}")
-        return None
-
 async def get_shop_category(pool, shop_id):
     """Recupera la categoria del negozio da PostgreSQL."""
     try:
@@ -99,34 +87,275 @@ async def get_shop_category(pool, shop_id):
         logger.error(f"Errore recupero categoria negozio {shop_id}: {e}")
         return "negozio"
 
-async def get_personalized_message(user_data, poi_data):
+async def find_nearest_shop(pool, shop_index, latitude, longitude):
+    """
+    Trova il negozio più vicino a una posizione.
+
+    Usa l'indice spaziale in-memory; ricade su PostGIS solo se l'indice è vuoto
+    (es. tabella shops non ancora popolata all'avvio).
+    """
+    found = shop_index.index.nearest(latitude, longitude)
+    if found is not None:
+        shop, distance = found
+        return {
+            "shop_id": shop["shop_id"],
+            "shop_name": shop["shop_name"],
+            "category": shop["category"],
+            "distance": distance,
+        }
+
+    return await pool.fetchrow(
+        """
+        SELECT
+          shop_id,
+          shop_name,
+          category,
+          ST_Distance(
+            geom::geography,
+            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
+          ) AS distance
+        FROM shops
+        ORDER BY distance
+        LIMIT 1
+        """,
+        longitude, latitude
+    )
+
+def build_message_payload(user_data, poi_data):
+    """Prepara il payload per il message generator con solo i campi necessari."""
+    return {
+        "user": {
+            "age": user_data["age"],
+            "profession": user_data["profession"],
+            "interests": user_data["interests"]
+        },
+        "poi": poi_data
+    }
+
+async def get_personalized_message(http_client, user_data, poi_data):
     """Ottieni messaggio personalizzato dal message generator."""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Prepara il payload con solo i campi necessari
-            payload = {
-                "user": {
-                    "age": user_data["age"],
-                    "profession": user_data["profession"],
-                    "interests": user_data["interests"]
-                },
-                "poi": poi_data
-            }
-            
-            logger.debug(f"Chiamata message-generator con payload: {payload}")
-            response = await client.post(MESSAGE_GENERATOR_URL, json=payload)
-            
-            if response.status_code != 200:
-                logger.error(f"Errore message-generator: {response.status_code} - {response.text}")
-                return ""
-                
-            result = response.json()
-            logger.info(f"Messaggio generato per utente {user_data['user_id']} in {poi_data['name']}: {result['message'][:30]}...")
-            return result["message"]
+        payload = build_message_payload(user_data, poi_data)
+
+        logger.debug(f"Chiamata message-generator con payload: {payload}")
+        response = await http_client.post_json(
+            MESSAGE_GENERATOR_URL, payload, deadline=MESSAGE_GENERATOR_DEADLINE_S
+        )
+
+        if response.status_code != 200:
+            logger.error(f"Errore message-generator: {response.status_code} - {response.text}")
+            return ""
+
+        result = response.json()
+        logger.info(f"Messaggio generato per utente {user_data['user_id']} in {poi_data['name']}: {result['message'][:30]}...")
+        return result["message"]
     except Exception as e:
         logger.error(f"Errore chiamata message-generator: {e}")
         return ""
 
+async def get_personalized_messages(http_client, requests):
+    """
+    Ottieni i messaggi di un micro-batch con una sola chiamata a /generate/batch.
+
+    Args:
+        http_client: Client HTTP condiviso verso il message generator
+        requests: Coppie (profilo utente, dati POI)
+
+    Returns:
+        list: Messaggi nello stesso ordine delle richieste ("" in caso di errore)
+    """
+    if len(requests) == 1:
+        return [await get_personalized_message(http_client, *requests[0])]
+
+    try:
+        payload = {"items": [build_message_payload(user_data, poi_data) for user_data, poi_data in requests]}
+        response = await http_client.post_json(
+            MESSAGE_GENERATOR_BATCH_URL, payload, deadline=MESSAGE_GENERATOR_DEADLINE_S
+        )
+
+        if response.status_code != 200:
+            logger.error(f"Errore message-generator (batch): {response.status_code} - {response.text}")
+            return [""] * len(requests)
+
+        results = response.json()
+        logger.info(
+            f"Batch di {len(requests)} messaggi generato "
+            f"({results['cached']} dalla cache, {results['generated']} dal LLM)"
+        )
+        return [result["message"] for result in results["results"]]
+    except Exception as e:
+        logger.error(f"Errore chiamata message-generator (batch): {e}")
+        return [""] * len(requests)
+
+class OffsetTracker:
+    """
+    Tiene traccia degli offset in elaborazione per ogni partizione.
+
+    Con più worker in parallelo i messaggi terminano fuori ordine: l'offset
+    committabile di una partizione è il più basso ancora pendente, così un
+    riavvio non salta mai messaggi non ancora scritti in ClickHouse.
+    """
+
+    def __init__(self):
+        self._pending = {}  # tp -> set di offset ricevuti ma non ancora completati
+        self._next = {}     # tp -> offset successivo al più alto completato
+
+    def add(self, tp, offset):
+        """Registra un messaggio ricevuto."""
+        self._pending.setdefault(tp, set()).add(offset)
+
+    def done(self, tp, offset):
+        """Segna un messaggio come completato (scritto o scartato)."""
+        pending = self._pending.get(tp)
+        if pending is None:
+            # Partizione revocata mentre il messaggio era in elaborazione
+            return
+        pending.discard(offset)
+        self._next[tp] = max(self._next.get(tp, 0), offset + 1)
+
+    def revoke(self, tps):
+        """Dimentica le partizioni non più assegnate a questo consumer."""
+        for tp in tps:
+            self._pending.pop(tp, None)
+            self._next.pop(tp, None)
+
+    def committable(self, assigned=None):
+        """
+        Restituisce gli offset committabili per partizione.
+
+        Args:
+            assigned: Partizioni assegnate (es. consumer.assignment()); le altre vengono escluse
+        """
+        offsets = {}
+        for tp, next_offset in self._next.items():
+            if assigned is not None and tp not in assigned:
+                continue
+            pending = self._pending.get(tp)
+            offsets[tp] = min(pending) if pending else next_offset
+        return offsets
+
+
+class FlushOnRevoke(ConsumerRebalanceListener):
+    """
+    Listener di rebalance che scrive il buffer prima di perdere le partizioni.
+
+    Il flush fa commit degli offset finché le partizioni sono ancora
+    assegnate; poi il tracker le dimentica, così i commit successivi
+    riguardano solo le partizioni possedute.
+    """
+
+    def __init__(self, writer, tracker):
+        self.writer = writer
+        self.tracker = tracker
+
+    async def on_partitions_revoked(self, revoked):
+        if not revoked:
+            return
+        if not await self.writer.flush():
+            logger.warning("Flush prima del rebalance non riuscito: %d partizioni revocate", len(revoked))
+        self.tracker.revoke(revoked)
+
+    async def on_partitions_assigned(self, assigned):
+        pass
+
+
+async def process_message(msg, pg_pool, profiles, shop_index, messages):
+    """
+    Elabora un messaggio GPS e restituisce la riga per user_events.
+
+    Args:
+        msg: Messaggio Kafka con valore già deserializzato
+        pg_pool: Pool PostgreSQL (fallback per la ricerca negozi)
+        profiles: Cache dei profili utente
+        shop_index: Refresher dell'indice spaziale dei negozi
+        messages: Batcher delle richieste al message generator
+
+    Returns:
+        tuple: Riga da inserire in user_events
+    """
+    data = msg.value
+
+    # Estrai user_id
+    user_id = data["user_id"]
+
+    # Parse timestamp ISO -> datetime (rimuovo tzinfo per ClickHouse)
+    ts = datetime.fromisoformat(data["timestamp"]).astimezone(timezone.utc).replace(tzinfo=None)
+
+    # Cerca il negozio più vicino
+    row = await find_nearest_shop(pg_pool, shop_index, data["latitude"], data["longitude"])
+
+    shop_name = row["shop_name"]
+    shop_category = row["category"]
+    distance = row["distance"]
+
+    # Inizializza poi_info vuoto
+    poi_info = ""
+
+    # Se l'utente è abbastanza vicino, genera un messaggio personalizzato
+    if distance <= MAX_POI_DISTANCE:
+        logger.info(f"Utente {user_id} vicino a {shop_name} (d={distance:.1f}m). Generazione messaggio...")
+
+        # Ottieni il profilo utente; se ClickHouse non risponde l'evento
+        # viene comunque scritto, senza messaggio
+        try:
+            user_profile = await profiles.get(user_id)
+        except Exception as e:
+            logger.error(f"Errore recupero profilo utente {user_id}, evento senza messaggio: {e}")
+            user_profile = None
+
+        if user_profile:
+            # Dati POI per il messaggio
+            poi_data = {
+                "name": shop_name,
+                "category": shop_category,
+                "description": f"Negozio a {distance:.0f}m di distanza"
+            }
+
+            # Chiamata al message generator, raggruppata con quelle degli altri worker
+            poi_info = await messages.submit((user_profile, poi_data))
+        else:
+            logger.warning(f"Impossibile generare messaggio: profilo utente {user_id} non trovato")
+    else:
+        logger.debug(f"Utente {user_id} troppo lontano da {shop_name} (d={distance:.1f}m > {MAX_POI_DISTANCE}m)")
+
+    if poi_info:
+        logger.info(f"Evento con messaggio per utente {user_id} → negozio '{shop_name}' (d={distance:.1f}m)")
+    else:
+        logger.debug(f"Evento senza messaggio per utente {user_id} → negozio '{shop_name}' (d={distance:.1f}m)")
+
+    return (
+        msg.offset,
+        ts,
+        user_id,
+        data["latitude"],
+        data["longitude"],
+        distance,
+        shop_name,
+        poi_info,
+    )
+
+
+async def worker(queue, tracker, writer, pg_pool, profiles, shop_index, messages):
+    """
+    Worker che elabora in ordine i messaggi della propria coda.
+
+    Tutti i messaggi di uno stesso utente finiscono nella stessa coda,
+    quindi l'ordine per utente è preservato anche con più worker.
+    """
+    while True:
+        msg = await queue.get()
+        tp = TopicPartition(msg.topic, msg.partition)
+        try:
+            row = await process_message(msg, pg_pool, profiles, shop_index, messages)
+            await writer.add(row, meta=(tp, msg.offset))
+        except Exception as e:
+            logger.error(f"Errore elaborazione messaggio {msg}: {e}")
+            # Messaggio scartato: non deve bloccare il commit della partizione
+            tracker.done(tp, msg.offset)
+        finally:
+            queue.task_done()
+
+
 async def consumer_loop():
     # 1) Readiness
     host, port = KAFKA_BROKER.split(":")
@@ -143,12 +372,13 @@ async def consumer_loop():
 
     # 3) Inizializza consumer
     consumer = AIOKafkaConsumer(
-        KAFKA_TOPIC,
         bootstrap_servers=[KAFKA_BROKER],
         security_protocol="SSL",
         ssl_context=ssl_ctx,
         group_id=CONSUMER_GROUP,
-        value_deserializer=lambda b: json.loads(b.decode("utf-8")),
+        # Commit manuale: solo dopo che il batch è stato scritto in ClickHouse
+        enable_auto_commit=False,
+        # Nessun value_deserializer: il formato dipende dall'header del messaggio
     )
     await consumer.start()
 
@@ -159,99 +389,106 @@ async def consumer_loop():
         database=POSTGRES_DB,
         min_size=1, max_size=5
     )
-    ch = CHClient(
-        host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT,
-        user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD,
-        database=CLICKHOUSE_DATABASE
+    ch = get_async_clickhouse()
+
+    # 5) Indice spaziale dei negozi, ricaricato quando cambia la tabella shops
+    shop_index = ShopIndexRefresher(
+        pg_pool,
+        refresh_interval=SHOP_INDEX_REFRESH_S,
+        cell_size_m=SHOP_INDEX_CELL_M,
     )
+    await shop_index.load()
+    shop_index.start()
+
+    # 6) Cache dei profili utente, precaricata e aggiornata in blocco
+    profiles = UserProfileCache(
+        fetch_one=lambda user_id: get_user_profile(ch, user_id),
+        fetch_all=lambda: get_all_user_profiles(ch),
+        ttl=PROFILE_CACHE_TTL_S,
+        negative_ttl=PROFILE_CACHE_NEGATIVE_TTL_S,
+        max_entries=PROFILE_CACHE_MAX_ENTRIES,
+        refresh_interval=PROFILE_CACHE_REFRESH_S,
+    )
+    await profiles.refresh()
+    profiles.start()
+
+    # 7) Writer a micro-batch per user_events, con commit degli offset dopo il flush
+    tracker = OffsetTracker()
+
+    async def commit_offsets(metas):
+        for tp, offset in metas:
+            tracker.done(tp, offset)
+        offsets = tracker.committable(consumer.assignment())
+        if offsets:
+            await consumer.commit(offsets)
+
+    writer = ClickHouseBatchWriter(
+        ch,
+        USER_EVENTS_INSERT,
+        max_rows=CH_BATCH_MAX_ROWS,
+        max_age=CH_BATCH_MAX_AGE_S,
+        on_flushed=commit_offsets,
+        name="user_events",
+        max_buffer=CH_BATCH_MAX_BUFFER,
+        retries=CH_BATCH_RETRIES,
+        backoff=CH_BATCH_BACKOFF_S,
+    )
+    writer.start()
+    # Sottoscrizione dopo la creazione del writer: il listener lo usa per il flush
+    consumer.subscribe([KAFKA_TOPIC], listener=FlushOnRevoke(writer, tracker))
+
+    # 8) Client HTTP condiviso da tutti i worker verso il message generator
+    http_client = PooledHTTPClient(
+        "message_generator",
+        max_connections=MESSAGE_GENERATOR_MAX_CONNECTIONS,
+        max_keepalive_connections=MESSAGE_GENERATOR_MAX_KEEPALIVE,
+        timeout=MESSAGE_GENERATOR_TIMEOUT_S,
+        retries=MESSAGE_GENERATOR_RETRIES,
+        http2=MESSAGE_GENERATOR_HTTP2,
+    )
+    messages = MicroBatcher(
+        lambda requests: get_personalized_messages(http_client, requests),
+        max_items=MESSAGE_BATCH_MAX_ITEMS,
+        max_delay=MESSAGE_BATCH_MAX_DELAY_S,
+        name="consumer_messages",
+    )
+    start_http_server(CONSUMER_METRICS_PORT)
+    logger.info("Metriche Prometheus del consumer esposte sulla porta %d", CONSUMER_METRICS_PORT)
+
+    # 9) Pool di worker: shard per user_id, code limitate per la backpressure
+    queues = [asyncio.Queue(maxsize=CONSUMER_QUEUE_SIZE) for _ in range(CONSUMER_CONCURRENCY)]
+    workers = [
+        asyncio.create_task(worker(q, tracker, writer, pg_pool, profiles, shop_index, messages))
+        for q in queues
+    ]
+    logger.info("Consumer avviato con %d worker", CONSUMER_CONCURRENCY)
 
     try:
         async for msg in consumer:
-            data = msg.value
+            tp = TopicPartition(msg.topic, msg.partition)
+            tracker.add(tp, msg.offset)
             try:
-                # Estrai user_id
-                user_id = data["user_id"]
-                
-                # Parse timestamp ISO -> datetime (rimuovo tzinfo per ClickHouse)
-                ts = datetime.fromisoformat(data["timestamp"]).astimezone(timezone.utc).replace(tzinfo=None)
-
-                # Cerca il negozio più vicino
-                row = await pg_pool.fetchrow(
-                    """
-                    SELECT
-                      shop_id,
-                      shop_name,
-                      category,
-                      ST_Distance(
-                        geom::geography,
-                        ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
-                      ) AS distance
-                    FROM shops
-                    ORDER BY distance
-                    LIMIT 1
-                    """,
-                    data["longitude"], data["latitude"]
-                )
-                
-                shop_id = row["shop_id"]
-                shop_name = row["shop_name"]
-                shop_category = row["category"]
-                distance = row["distance"]
-                
-                # Inizializza poi_info vuoto
-                poi_info = ""
-                
-                # Se l'utente è abbastanza vicino, genera un messaggio personalizzato
-                if distance <= MAX_POI_DISTANCE:
-                    logger.info(f"Utente {user_id} vicino a {shop_name} (d={distance:.1f}m). Generazione messaggio...")
-                    
-                    # Ottieni il profilo utente
-                    user_profile = await get_user_profile(ch, user_id)
-                    
-                    if user_profile:
-                        # Dati POI per il messaggio
-                        poi_data = {
-                            "name": shop_name,
-                            "category": shop_category,
-                            "description": f"Negozio a {distance:.0f}m di distanza"
-                        }
-                        
-                        # Chiamata al message generator
-                        poi_info = await get_personalized_message(user_profile, poi_data)
-                    else:
-                        logger.warning(f"Impossibile generare messaggio: profilo utente {user_id} non trovato")
-                else:
-                    logger.debug(f"Utente {user_id} troppo lontano da {shop_name} (d={distance:.1f}m > {MAX_POI_DISTANCE}m)")
-
-                # Scrivi in ClickHouse con eventuale messaggio
-                ch.execute(
-                    """
-                    INSERT INTO user_events
-                      (event_id, event_time, user_id, latitude, longitude, poi_range, poi_name, poi_info)
-                    VALUES
-                    """,
-                    [
-                        (msg.offset,
-                         ts,
-                         user_id,
-                         data["latitude"],
-                         data["longitude"],
-                         distance,
-                         shop_name,
-                         poi_info)
-                    ]
-                )
-                
-                if poi_info:
-                    logger.info(f"Evento con messaggio per utente {user_id} → negozio '{shop_name}' (d={distance:.1f}m)")
-                else:
-                    logger.debug(f"Evento senza messaggio per utente {user_id} → negozio '{shop_name}' (d={distance:.1f}m)")
-                
+                # JSON o binario a seconda dell'header nearyou-encoding
+                msg.value = decode_location(msg.value, msg.headers)
+                shard = hash(msg.value["user_id"]) % CONSUMER_CONCURRENCY
             except Exception as e:
-                logger.error(f"Errore elaborazione messaggio {msg}: {e}")
+                logger.error(f"Messaggio GPS non valido {msg}: {e}")
+                tracker.done(tp, msg.offset)
+                continue
+            await queues[shard].put(msg)
     finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Flush finale prima di chiudere il consumer, così gli offset vengono committati
+        await writer.stop()
+        await messages.close()
+        await http_client.aclose()
+        await profiles.stop()
+        await shop_index.stop()
         await consumer.stop()
         await pg_pool.close()
+        await ch.close()
 
 if __name__ == "__main__":
-    asyncio.run(consumer_loop())
\ No newline at end of file
+    asyncio.run(consumer_loop())
@@ -9,7 +9,6 @@ from datetime import datetime, timezone
 
 import httpx
 from aiokafka import AIOKafkaProducer
-from clickhouse_driver import Client as CHClient
 
 from src.utils.logger_config import setup_logging
 from src.configg import (
@@ -18,10 +17,17 @@ from src.configg import (
     OSRM_URL,
     MILANO_MIN_LAT, MILANO_MAX_LAT,
     MILANO_MIN_LON, MILANO_MAX_LON,
-    CLICKHOUSE_HOST, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD,
-    CLICKHOUSE_PORT, CLICKHOUSE_DATABASE,
+    PRODUCER_TARGET_EPS, PRODUCER_TICK_S, PRODUCER_POINT_INTERVAL_S,
+    PRODUCER_ROUTE_CONCURRENCY, PRODUCER_STATS_INTERVAL_S,
+    KAFKA_PRODUCER_PROFILE, get_kafka_producer_config,
+    ROUTE_CACHE_PATH, ROUTE_POOL_PATH, ROUTE_CACHE_CELL_M, ROUTE_CACHE_MAX_ENTRIES,
+    ROUTE_OSRM_CONCURRENCY, ROUTE_SYNTHETIC_FALLBACK,
+    GPS_WIRE_FORMAT,
 )
 from src.utils.utils import wait_for_broker
+from src.utils.clickhouse_async import get_async_clickhouse
+from src.data_pipeline.tick_engine import TickEngine
+from src.data_pipeline.route_cache import RouteProvider, fetch_osrm_route
 
 logger = logging.getLogger(__name__)
 setup_logging()
@@ -41,14 +47,10 @@ async def wait_for_osrm(interval: int = 5, max_retries: int = 100):
     raise RuntimeError("OSRM non pronto dopo troppe prove")
 
 async def wait_for_clickhouse():
+    ch = get_async_clickhouse()
     for attempt in range(30):
         try:
-            client = CHClient(
-                host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT,
-                user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD,
-                database=CLICKHOUSE_DATABASE
-            )
-            client.execute("SELECT 1")
+            await ch.query("SELECT 1", timeout=5, name="healthcheck")
             logger.info("ClickHouse è pronto")
             return
         except Exception:
@@ -66,18 +68,18 @@ def random_point_in_bbox():
     lon = random.uniform(MILANO_MIN_LON, MILANO_MAX_LON)
     return lon, lat
 
+# client HTTP condiviso verso OSRM, creato al primo uso
+_osrm_client = None
+
 async def fetch_route(start: str, end: str):
-    async with httpx.AsyncClient() as client:
-        r = await client.get(
-            f"{OSRM_URL}/route/v1/bicycle/{start};{end}",
-            params={"overview": "full", "geometries": "geojson"},
-            timeout=10
-        )
-    r.raise_for_status()
-    coords = r.json()["routes"][0]["geometry"]["coordinates"]
+    global _osrm_client
+    if _osrm_client is None:
+        _osrm_client = httpx.AsyncClient(timeout=10)
+    coords = await fetch_osrm_route(_osrm_client, OSRM_URL, start, end)
     return [{"lon": lon, "lat": lat} for lon, lat in coords]
 
 async def producer_worker(producer: AIOKafkaProducer, user: tuple[int,int,str,str]):
+    """Simula un singolo utente con invio sincrono (usato per debug e test)."""
     uid, age, profession, interests = user
 
     while True:
@@ -110,43 +112,71 @@ async def producer_worker(producer: AIOKafkaProducer, user: tuple[int,int,str,st
             await asyncio.sleep(2)
 
 async def main():
-    # readiness checks
-    await asyncio.gather(
-        wait_for_kafka(),
-        wait_for_clickhouse(),
-        wait_for_osrm()
-    )
+    # readiness checks (OSRM non serve se i percorsi vengono dal pool offline)
+    checks = [wait_for_kafka(), wait_for_clickhouse()]
+    if not ROUTE_POOL_PATH:
+        checks.append(wait_for_osrm())
+    await asyncio.gather(*checks)
 
     # prepara SSLContext
     ssl_ctx = ssl.create_default_context(cafile=SSL_CAFILE)
     ssl_ctx.load_cert_chain(certfile=SSL_CERTFILE, keyfile=SSL_KEYFILE)
 
-    # inizializza producer con JSON serializer
+    producer_config = get_kafka_producer_config()
+    logger.info("Producer Kafka con profilo '%s': %s", KAFKA_PRODUCER_PROFILE, producer_config)
+
+    # inizializza producer: i payload già codificati (bytes) passano invariati,
+    # i dict vengono serializzati in JSON
     producer = AIOKafkaProducer(
         bootstrap_servers=[KAFKA_BROKER],
         security_protocol="SSL",
         ssl_context=ssl_ctx,
-        value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        value_serializer=lambda v: v if isinstance(v, bytes) else json.dumps(v).encode("utf-8"),
+        **producer_config,
     )
     await producer.start()
 
+    routes = RouteProvider(
+        osrm_url=OSRM_URL,
+        cache_path=ROUTE_CACHE_PATH or None,
+        pool_path=ROUTE_POOL_PATH or None,
+        cell_m=ROUTE_CACHE_CELL_M,
+        max_entries=ROUTE_CACHE_MAX_ENTRIES,
+        osrm_concurrency=ROUTE_OSRM_CONCURRENCY,
+        fallback=ROUTE_SYNTHETIC_FALLBACK,
+    )
+    autosave_task = asyncio.create_task(routes.autosave())
+
     try:
         # carica utenti
-        ch = CHClient(
-            host=CLICKHOUSE_HOST, port=CLICKHOUSE_PORT,
-            user=CLICKHOUSE_USER, password=CLICKHOUSE_PASSWORD,
-            database=CLICKHOUSE_DATABASE
+        ch = get_async_clickhouse()
+        users = await ch.query(
+            "SELECT user_id, age, profession, interests FROM users",
+            name="producer_users"
         )
-        users = ch.execute("SELECT user_id, age, profession, interests FROM users")
         if not users:
             logger.error("Nessun utente trovato in ClickHouse")
             return
 
-        # un worker per utente
-        tasks = [producer_worker(producer, u) for u in users]
-        await asyncio.gather(*tasks)
+        # un unico scheduler a tick per tutti gli utenti
+        engine = TickEngine(
+            producer,
+            KAFKA_TOPIC,
+            users,
+            routes.random_route,
+            target_eps=PRODUCER_TARGET_EPS,
+            tick_interval=PRODUCER_TICK_S,
+            point_interval=PRODUCER_POINT_INTERVAL_S,
+            route_concurrency=PRODUCER_ROUTE_CONCURRENCY,
+            stats_interval=PRODUCER_STATS_INTERVAL_S,
+            wire_format=GPS_WIRE_FORMAT,
+        )
+        await engine.run()
 
     finally:
+        autosave_task.cancel()
+        await routes.aclose()
+        # flush dei messaggi ancora nel buffer di batching
         await producer.stop()
 
 if __name__ == "__main__":
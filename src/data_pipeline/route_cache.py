@@ -0,0 +1,361 @@
+# src/data_pipeline/route_cache.py
+"""
+Sorgenti di percorsi per il simulatore GPS.
+
+`RouteProvider` restituisce percorsi bici evitando di chiamare OSRM a ogni
+viaggio:
+- cache persistente su disco con chiave (cella origine, cella destinazione),
+  dove le celle sono una griglia regolare sulla bounding box di Milano;
+- pool di percorsi pre-generato (file JSON) da cui campionare senza OSRM;
+- fallback sintetico in linea retta quando OSRM non risponde.
+
+Il pool si genera con:
+    python -m src.data_pipeline.route_cache --count 5000 --out /data/routes.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from src.configg import (
+    OSRM_URL,
+    MILANO_MIN_LAT, MILANO_MAX_LAT,
+    MILANO_MIN_LON, MILANO_MAX_LON,
+)
+from src.utils.geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+Coords = List[List[float]]  # [[lon, lat], ...] come nella geometria GeoJSON di OSRM
+Route = List[Dict[str, float]]
+CellKey = Tuple[int, int, int, int]
+
+# Metri per grado di latitudine (approssimazione sferica)
+M_PER_DEG_LAT = 111_320.0
+
+
+def to_points(coords: Coords) -> Route:
+    """Converte le coordinate [lon, lat] nel formato punto usato dal producer."""
+    return [{"lon": lon, "lat": lat} for lon, lat in coords]
+
+
+def synthetic_route(lon1: float, lat1: float, lon2: float, lat2: float, step_m: float = 50.0) -> Coords:
+    """
+    Percorso sintetico in linea retta con un punto ogni `step_m` metri circa.
+
+    Args:
+        lon1, lat1: Origine
+        lon2, lat2: Destinazione
+        step_m: Distanza approssimativa tra due punti consecutivi
+
+    Returns:
+        Coords: Coordinate [lon, lat] del percorso, estremi inclusi
+    """
+    steps = max(1, math.ceil(haversine_m(lat1, lon1, lat2, lon2) / step_m))
+    return [
+        [lon1 + (lon2 - lon1) * i / steps, lat1 + (lat2 - lat1) * i / steps]
+        for i in range(steps + 1)
+    ]
+
+
+async def fetch_osrm_route(client: httpx.AsyncClient, osrm_url: str, start: str, end: str) -> Coords:
+    """
+    Richiede un percorso bici a OSRM.
+
+    Args:
+        client: Client HTTP condiviso
+        osrm_url: URL base di OSRM
+        start: Origine "lon,lat"
+        end: Destinazione "lon,lat"
+
+    Returns:
+        Coords: Geometria del percorso
+    """
+    r = await client.get(
+        f"{osrm_url}/route/v1/bicycle/{start};{end}",
+        params={"overview": "full", "geometries": "geojson"},
+    )
+    r.raise_for_status()
+    return r.json()["routes"][0]["geometry"]["coordinates"]
+
+
+def load_routes_file(path: str, cell_m: Optional[float] = None) -> Dict[str, Coords]:
+    """
+    Carica un file di percorsi (cache o pool).
+
+    Args:
+        path: File JSON dei percorsi
+        cell_m: Lato delle celle atteso; se diverso da quello salvato le chiavi
+            non sono valide e il file viene ignorato (None = nessun controllo)
+
+    Returns:
+        Dict[str, Coords]: Percorsi per chiave di cella, {} se assente, illeggibile o incompatibile
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Impossibile leggere il file percorsi {path}: {e}")
+        return {}
+    if cell_m is not None and data.get("cell_m") != cell_m:
+        logger.warning(
+            "File percorsi %s con celle da %s m invece di %s m: ignorato",
+            path, data.get("cell_m"), cell_m
+        )
+        return {}
+    return data.get("routes", {})
+
+
+def save_routes_file(path: str, routes: Dict[str, Coords], cell_m: float) -> None:
+    """Scrive i percorsi su disco in modo atomico (file temporaneo + rename)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"cell_m": cell_m, "routes": routes}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class RouteProvider:
+    """
+    Fornisce percorsi casuali da pool, cache o OSRM, con fallback sintetico.
+
+    Quando tutte le richieste OSRM consentite sono già in corso, un percorso
+    mancante in cache viene sostituito da uno già noto invece di accodarsi:
+    così OSRM non limita la velocità con cui gli utenti iniziano nuovi viaggi.
+    """
+
+    def __init__(
+        self,
+        osrm_url: str = OSRM_URL,
+        cache_path: Optional[str] = None,
+        pool_path: Optional[str] = None,
+        cell_m: float = 250.0,
+        max_entries: int = 50000,
+        osrm_concurrency: int = 16,
+        osrm_timeout: float = 10.0,
+        fallback: bool = True
+    ):
+        """
+        Inizializza il provider.
+
+        Args:
+            osrm_url: URL base di OSRM
+            cache_path: File JSON della cache persistente (None = solo in memoria)
+            pool_path: File JSON del pool pre-generato; se presente OSRM non viene usato
+            cell_m: Lato in metri delle celle usate come chiave della cache
+            max_entries: Numero massimo di percorsi in cache
+            osrm_concurrency: Richieste OSRM contemporanee
+            osrm_timeout: Timeout delle richieste OSRM in secondi
+            fallback: Usa il percorso in linea retta se OSRM fallisce
+        """
+        self.osrm_url = osrm_url
+        self.cache_path = cache_path
+        self.cell_m = cell_m
+        self.max_entries = max_entries
+        self.osrm_concurrency = osrm_concurrency
+        self.fallback = fallback
+
+        self.cell_lat = cell_m / M_PER_DEG_LAT
+        self.cell_lon = cell_m / (M_PER_DEG_LAT * math.cos(math.radians((MILANO_MIN_LAT + MILANO_MAX_LAT) / 2)))
+
+        # Le chiavi dipendono dal lato delle celle: una cache salvata con un altro lato si ricostruisce
+        self.cache: Dict[str, Coords] = load_routes_file(cache_path, cell_m) if cache_path else {}
+        self._cache_keys: List[str] = list(self.cache)
+        self._dirty = False
+        self._save_lock = asyncio.Lock()
+
+        self.pool: List[Coords] = list(load_routes_file(pool_path).values()) if pool_path else []
+        if pool_path:
+            logger.info("Pool percorsi: %d percorsi caricati da %s", len(self.pool), pool_path)
+        if cache_path:
+            logger.info("Cache percorsi: %d percorsi caricati da %s", len(self.cache), cache_path)
+
+        self._in_flight = 0
+        self._client = httpx.AsyncClient(
+            timeout=osrm_timeout,
+            limits=httpx.Limits(max_connections=osrm_concurrency, max_keepalive_connections=osrm_concurrency),
+        )
+        self.stats = {"pool": 0, "hits": 0, "misses": 0, "reused": 0, "osrm": 0, "synthetic": 0}
+
+    def snap(self, lon: float, lat: float) -> Tuple[int, int]:
+        """Indici della cella che contiene il punto."""
+        return (int((lat - MILANO_MIN_LAT) / self.cell_lat), int((lon - MILANO_MIN_LON) / self.cell_lon))
+
+    def cell_center(self, cell: Tuple[int, int]) -> Tuple[float, float]:
+        """Centro (lon, lat) di una cella."""
+        return (
+            MILANO_MIN_LON + (cell[1] + 0.5) * self.cell_lon,
+            MILANO_MIN_LAT + (cell[0] + 0.5) * self.cell_lat,
+        )
+
+    def _store(self, key: str, coords: Coords) -> None:
+        if key not in self.cache:
+            if len(self.cache) >= self.max_entries:
+                # Rimpiazzo casuale: la cache serve a coprire molte coppie, non a tenere le recenti
+                idx = random.randrange(len(self._cache_keys))
+                del self.cache[self._cache_keys[idx]]
+                self._cache_keys[idx] = key
+            else:
+                self._cache_keys.append(key)
+        self.cache[key] = coords
+        self._dirty = True
+
+    async def get_route(self, lon1: float, lat1: float, lon2: float, lat2: float) -> Route:
+        """
+        Restituisce un percorso tra le celle che contengono origine e destinazione.
+
+        Args:
+            lon1, lat1: Origine
+            lon2, lat2: Destinazione
+
+        Returns:
+            Route: Punti del percorso
+        """
+        o, d = self.snap(lon1, lat1), self.snap(lon2, lat2)
+        key = f"{o[0]},{o[1]},{d[0]},{d[1]}"
+
+        coords = self.cache.get(key)
+        if coords is not None:
+            self.stats["hits"] += 1
+            return to_points(coords)
+        self.stats["misses"] += 1
+
+        # OSRM saturo: meglio riusare un percorso noto che mettersi in coda
+        if self._in_flight >= self.osrm_concurrency and self._cache_keys:
+            self.stats["reused"] += 1
+            return to_points(self.cache[random.choice(self._cache_keys)])
+
+        start_lon, start_lat = self.cell_center(o)
+        end_lon, end_lat = self.cell_center(d)
+        self._in_flight += 1
+        try:
+            coords = await fetch_osrm_route(
+                self._client, self.osrm_url,
+                f"{start_lon},{start_lat}", f"{end_lon},{end_lat}"
+            )
+            self.stats["osrm"] += 1
+        except Exception as e:
+            if not self.fallback:
+                raise
+            logger.warning("OSRM non disponibile (%s), uso percorso sintetico", e)
+            self.stats["synthetic"] += 1
+            # Il sintetico non va in cache: quando OSRM torna si usano percorsi reali
+            return to_points(synthetic_route(start_lon, start_lat, end_lon, end_lat))
+        finally:
+            self._in_flight -= 1
+
+        self._store(key, coords)
+        return to_points(coords)
+
+    async def random_route(self) -> Route:
+        """Percorso tra due punti casuali della bounding box di Milano."""
+        if self.pool:
+            self.stats["pool"] += 1
+            return to_points(random.choice(self.pool))
+        return await self.get_route(
+            random.uniform(MILANO_MIN_LON, MILANO_MAX_LON), random.uniform(MILANO_MIN_LAT, MILANO_MAX_LAT),
+            random.uniform(MILANO_MIN_LON, MILANO_MAX_LON), random.uniform(MILANO_MIN_LAT, MILANO_MAX_LAT),
+        )
+
+    async def save(self) -> None:
+        """
+        Salva la cache su disco se modificata.
+
+        La serializzazione avviene in un thread su una copia della cache, così
+        l'event loop continua a servire i viaggi; i salvataggi non si sovrappongono.
+        """
+        async with self._save_lock:
+            if not self.cache_path or not self._dirty:
+                return
+            routes = dict(self.cache)
+            self._dirty = False
+            try:
+                await asyncio.to_thread(save_routes_file, self.cache_path, routes, self.cell_m)
+                logger.info("Cache percorsi salvata: %d percorsi", len(routes))
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Errore salvataggio cache percorsi: {e}")
+
+    async def autosave(self, interval: float = 60.0) -> None:
+        """Salva periodicamente la cache su disco."""
+        while True:
+            await asyncio.sleep(interval)
+            # Una cancellazione non interrompe un salvataggio già avviato
+            await asyncio.shield(self.save())
+
+    async def aclose(self) -> None:
+        """Salva la cache e chiude il client HTTP."""
+        await self.save()
+        await self._client.aclose()
+
+
+async def build_pool(count: int, out: str, osrm_url: str, cell_m: float, concurrency: int) -> int:
+    """
+    Genera un pool di percorsi interrogando OSRM.
+
+    Args:
+        count: Numero di percorsi da generare
+        out: File JSON di destinazione
+        osrm_url: URL base di OSRM
+        cell_m: Lato delle celle usate come chiave
+        concurrency: Richieste OSRM contemporanee
+
+    Returns:
+        int: Numero di percorsi scritti
+    """
+    provider = RouteProvider(
+        osrm_url=osrm_url, cell_m=cell_m, max_entries=count,
+        osrm_concurrency=concurrency, fallback=False
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    async def one() -> None:
+        async with semaphore:
+            try:
+                await provider.random_route()
+            except Exception as e:
+                logger.warning(f"Percorso scartato: {e}")
+
+    try:
+        while len(provider.cache) < count:
+            before = len(provider.cache)
+            await asyncio.gather(*(one() for _ in range(min(concurrency * 4, count - before))))
+            logger.info("Pool percorsi: %d/%d", len(provider.cache), count)
+            if len(provider.cache) == before:
+                logger.error("Nessun nuovo percorso da OSRM, interrompo la generazione")
+                break
+    finally:
+        await provider.aclose()
+
+    save_routes_file(out, provider.cache, cell_m)
+    logger.info("Pool di %d percorsi scritto in %s (%.1fs)", len(provider.cache), out, time.monotonic() - start)
+    return len(provider.cache)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera un pool di percorsi OSRM per il simulatore")
+    parser.add_argument("--count", type=int, default=5000, help="Numero di percorsi")
+    parser.add_argument("--out", required=True, help="File JSON di destinazione")
+    parser.add_argument("--osrm-url", default=OSRM_URL, help="URL base di OSRM")
+    parser.add_argument("--cell-m", type=float, default=250.0, help="Lato delle celle in metri")
+    parser.add_argument("--concurrency", type=int, default=16, help="Richieste OSRM contemporanee")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(build_pool(args.count, args.out, args.osrm_url, args.cell_m, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# src/data_pipeline/tick_engine.py
+"""
+Scheduler centralizzato del simulatore GPS.
+
+Invece di una coroutine (e un timer) per ogni utente, un unico loop avanza
+tutti i percorsi attivi a tick regolari ed emette i punti con `send()` non
+bloccante: i messaggi finiscono nel buffer di batching di aiokafka e la
+conferma del broker viene gestita in callback, senza fermare il tick.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from src.utils.gps_codec import JSON, encode_location
+
+logger = logging.getLogger(__name__)
+
+Route = List[Dict[str, float]]
+
+
+@dataclass
+class SimulatedUser:
+    """Stato di un utente simulato lungo il percorso corrente."""
+    user_id: int
+    age: int
+    profession: str
+    interests: str
+    route: Route = field(default_factory=list)
+    position: int = 0
+    next_due: float = 0.0
+
+
+class TickEngine:
+    """
+    Avanza tutti gli utenti simulati a tick regolari rispettando un target di eventi/s.
+
+    Gli utenti attivi sono in una coda round-robin ordinata per `next_due`:
+    a ogni tick si emettono al massimo `target_eps * tick_interval` punti,
+    prendendo gli utenti in testa la cui scadenza è passata. Un utente non
+    emette più di un punto ogni `point_interval` secondi. Gli utenti a fine
+    percorso passano ai fetcher, che ne calcolano uno nuovo in parallelo
+    con concorrenza limitata.
+    """
+
+    def __init__(
+        self,
+        producer,
+        topic: str,
+        users: List[Tuple[int, int, str, str]],
+        fetch_route: Callable[[], Awaitable[Route]],
+        target_eps: float = 1000.0,
+        tick_interval: float = 0.1,
+        point_interval: float = 2.0,
+        route_concurrency: int = 32,
+        stats_interval: float = 1.0,
+        wire_format: str = JSON
+    ):
+        """
+        Inizializza lo scheduler.
+
+        Args:
+            producer: AIOKafkaProducer già avviato
+            topic: Topic Kafka di destinazione
+            users: Righe (user_id, age, profession, interests)
+            fetch_route: Coroutine che restituisce un nuovo percorso casuale
+            target_eps: Eventi al secondo da emettere in totale
+            tick_interval: Durata di un tick in secondi
+            point_interval: Intervallo minimo tra due punti dello stesso utente
+            route_concurrency: Numero massimo di percorsi calcolati in parallelo
+            stats_interval: Secondi tra due log di statistiche
+            wire_format: Formato dei messaggi (vedi src.utils.gps_codec)
+        """
+        self.producer = producer
+        self.topic = topic
+        self.fetch_route = fetch_route
+        self.target_eps = target_eps
+        self.tick_interval = tick_interval
+        self.point_interval = point_interval
+        self.route_concurrency = route_concurrency
+        self.stats_interval = stats_interval
+        self.wire_format = wire_format
+
+        self.users = [SimulatedUser(*u) for u in users]
+        self.active: Deque[SimulatedUser] = deque()
+        self.needs_route: asyncio.Queue = asyncio.Queue()
+        for user in self.users:
+            self.needs_route.put_nowait(user)
+
+        self._budget = 0.0
+        self.stats = {"sent": 0, "delivered": 0, "errors": 0, "routes": 0, "route_errors": 0}
+        # Errori di invio per tipo nell'intervallo corrente di statistiche
+        self.error_types: Counter = Counter()
+
+    def _count_error(self, error: BaseException) -> None:
+        self.stats["errors"] += 1
+        self.error_types[type(error).__name__] += 1
+
+    def _on_delivery(self, future: asyncio.Future) -> None:
+        """Callback di consegna: conta consegne ed errori senza bloccare il tick."""
+        if future.cancelled():
+            self._count_error(asyncio.CancelledError())
+        elif future.exception() is not None:
+            self._count_error(future.exception())
+        else:
+            self.stats["delivered"] += 1
+
+    def _message(self, user: SimulatedUser, point: Dict[str, float], timestamp: str) -> Dict[str, Any]:
+        return {
+            "user_id":     user.user_id,
+            "latitude":    point["lat"],
+            "longitude":   point["lon"],
+            "timestamp":   timestamp,
+            "age":         user.age,
+            "profession":  user.profession,
+            "interests":   user.interests,
+        }
+
+    async def tick(self, now: Optional[float] = None) -> int:
+        """
+        Esegue un tick: emette i punti degli utenti scaduti entro il budget.
+
+        Args:
+            now: Istante monotono del tick (default time.monotonic())
+
+        Returns:
+            int: Numero di punti emessi
+        """
+        now = time.monotonic() if now is None else now
+        # Il budget frazionario non usato si accumula, ma al massimo per un tick
+        per_tick = self.target_eps * self.tick_interval
+        self._budget = min(self._budget + per_tick, max(per_tick * 2, 1.0))
+
+        # Un solo timestamp per tick: tutti i punti del tick sono contemporanei
+        timestamp = datetime.now(timezone.utc).isoformat()
+        emitted = 0
+
+        while self.active and self._budget >= 1 and self.active[0].next_due <= now:
+            user = self.active.popleft()
+            point = user.route[user.position]
+            user.position += 1
+            self._budget -= 1
+
+            try:
+                value, headers = encode_location(self._message(user, point, timestamp), self.wire_format)
+                # send() accoda nel batch del producer e ritorna subito un future
+                # di consegna; attende solo se il buffer del producer è pieno
+                future = await self.producer.send(
+                    self.topic,
+                    value=value,
+                    key=str(user.user_id).encode("utf-8"),
+                    headers=headers,
+                )
+                future.add_done_callback(self._on_delivery)
+                emitted += 1
+            except Exception as e:
+                self._count_error(e)
+                logger.error("Utente %d: errore invio Kafka: %s", user.user_id, e)
+
+            if user.position < len(user.route):
+                user.next_due = now + self.point_interval
+                self.active.append(user)
+            else:
+                self.needs_route.put_nowait(user)
+
+        self.stats["sent"] += emitted
+        return emitted
+
+    async def route_fetcher(self) -> None:
+        """Assegna nuovi percorsi agli utenti che hanno terminato il precedente."""
+        while True:
+            user = await self.needs_route.get()
+            try:
+                route = await self.fetch_route()
+            except Exception as e:
+                self.stats["route_errors"] += 1
+                logger.error("Utente %d: impossibile fetchare percorso: %s", user.user_id, e)
+                await asyncio.sleep(5)
+                self.needs_route.put_nowait(user)
+                continue
+
+            if not route:
+                await asyncio.sleep(1)
+                self.needs_route.put_nowait(user)
+                continue
+
+            user.route = route
+            user.position = 0
+            # In coda con scadenza futura: la coda resta ordinata per next_due
+            user.next_due = time.monotonic() + self.point_interval
+            self.active.append(user)
+            self.stats["routes"] += 1
+
+    def stats_summary(self, previous: Dict[str, int], elapsed: float) -> str:
+        """
+        Riepilogo di throughput ed errori rispetto all'istantanea precedente.
+
+        Args:
+            previous: Copia di `stats` all'inizio dell'intervallo
+            elapsed: Durata dell'intervallo in secondi
+
+        Returns:
+            str: Riga di log con tassi al secondo ed errori per tipo
+        """
+        rate = {k: (self.stats[k] - previous.get(k, 0)) / elapsed for k in ("sent", "delivered", "errors")}
+        errors = ", ".join(f"{name}={count}" for name, count in self.error_types.most_common(3))
+        return (
+            f"{rate['sent']:.0f} inviati/s (target {self.target_eps:.0f}), "
+            f"{rate['delivered']:.0f} consegnati/s, {rate['errors']:.1f} errori/s"
+            f"{' [' + errors + ']' if errors else ''}, "
+            f"{len(self.active)} utenti attivi, {self.needs_route.qsize()} in attesa di percorso"
+        )
+
+    async def _log_stats(self) -> None:
+        previous, last_time = dict(self.stats), time.monotonic()
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            now = time.monotonic()
+            summary = self.stats_summary(previous, now - last_time)
+            previous, last_time = dict(self.stats), now
+            self.error_types.clear()
+            logger.info("Simulatore: %s", summary)
+
+    async def run(self) -> None:
+        """Avvia fetcher e loop dei tick finché non viene cancellato."""
+        helpers = [asyncio.create_task(self.route_fetcher()) for _ in range(self.route_concurrency)]
+        helpers.append(asyncio.create_task(self._log_stats()))
+        logger.info(
+            "Simulatore avviato: %d utenti, target %.0f eventi/s, tick %.2fs",
+            len(self.users), self.target_eps, self.tick_interval
+        )
+
+        try:
+            next_tick = time.monotonic()
+            while True:
+                await self.tick()
+                # Scheduling a cadenza fissa: se un tick è in ritardo non si dorme
+                next_tick += self.tick_interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
+                    await asyncio.sleep(0)
+        finally:
+            for task in helpers:
+                task.cancel()
+            await asyncio.gather(*helpers, return_exceptions=True)
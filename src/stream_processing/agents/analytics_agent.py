@@ -2,12 +2,12 @@
 Agent Faust per processare eventi analytics e aggiornare ClickHouse.
 """
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import AsyncGenerator
 
-from ..app import app
+from ..app import app, batches
 from ..topics.topics import notification_events_topic, analytics_events_topic
-from ..tables.state_tables import system_stats_table
+from ..tables.state_tables import system_stats_table, system_stats_shard_key
 from ..models.events import NotificationEvent, AnalyticsEvent
 from ..services.analytics_service import AnalyticsService
 
@@ -16,48 +16,61 @@ logger = logging.getLogger(__name__)
 # Inizializza il servizio analytics
 analytics_service = AnalyticsService()
 
+@app.on_before_shutdown.connect
+async def flush_analytics(app, **kwargs) -> None:
+    """Scrive in ClickHouse le notifiche ancora in buffer prima dello stop."""
+    if not await analytics_service.stop():
+        logger.error("Flush finale delle notifiche su ClickHouse non riuscito")
+
 @app.agent(notification_events_topic)
 async def store_notifications(stream) -> AsyncGenerator[None, None]:
     """
     Salva gli eventi di notifica in ClickHouse per la dashboard.
+    
+    Gli eventi passano dal writer bufferizzato del servizio, che li
+    scrive a blocchi e rallenta l'agent se ClickHouse non tiene il passo.
     """
-    async for event in stream:
+    async for events in batches(stream, 'notifications'):
         try:
-            await analytics_service.store_notification_event(event)
-            logger.debug(f"Stored notification event {event.event_id} in ClickHouse")
+            await analytics_service.store_notification_events(events)
+            logger.debug(f"Queued {len(events)} notification events for ClickHouse")
             
         except Exception as e:
-            logger.error(f"Error storing notification event: {e}")
+            logger.error(f"Error storing notification events: {e}")
             continue
 
 @app.agent(analytics_events_topic)
 async def process_analytics(stream) -> AsyncGenerator[None, None]:
     """
     Processa eventi analytics per statistiche e reporting.
+    
+    Le statistiche di sistema vengono aggiornate una volta per batch, sullo
+    shard della partizione corrente: worker diversi non scrivono mai la
+    stessa chiave.
     """
-    async for event in stream:
+    async for events in batches(stream, 'analytics'):
         try:
             # Aggiorna statistiche di sistema
-            system_stats = system_stats_table.get('global', {
+            shard_key = system_stats_shard_key()
+            system_stats = system_stats_table.get(shard_key, {
                 'total_events_processed': 0,
                 'total_notifications_sent': 0,
-                'active_users_count': 0,
-                'last_updated': datetime.now(timezone.utc)
+                'last_updated': datetime.now(timezone.utc).timestamp()
             })
             
-            system_stats['total_events_processed'] += 1
-            
-            if event.event_type == 'notification':
-                system_stats['total_notifications_sent'] += 1
-            
-            system_stats['last_updated'] = event.timestamp
-            system_stats_table['global'] = system_stats
+            system_stats['total_events_processed'] += len(events)
+            system_stats['total_notifications_sent'] += sum(
+                1 for event in events if event.event_type == 'notification'
+            )
+            system_stats['last_updated'] = max(event.timestamp for event in events).timestamp()
+            system_stats_table[shard_key] = system_stats
             
             # Invia a servizio analytics per elaborazioni più complesse
-            await analytics_service.process_analytics_event(event)
+            for event in events:
+                await analytics_service.process_analytics_event(event)
             
-            logger.debug(f"Processed analytics event: {event.event_type}")
+            logger.debug(f"Processed {len(events)} analytics events")
             
         except Exception as e:
-            logger.error(f"Error processing analytics event: {e}")
-            continue
\ No newline at end of file
+            logger.error(f"Error processing analytics events: {e}")
+            continue
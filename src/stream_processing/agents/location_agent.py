@@ -5,96 +5,137 @@ import logging
 from datetime import datetime, timezone
 from typing import AsyncGenerator
 
-from ..app import app
+from ..app import app, batches
 from ..topics.topics import location_events_topic, shop_proximity_topic
 from ..tables.state_tables import user_states_table
 from ..models.events import LocationEvent, ShopProximityEvent
-from ..models.state import UserState
 from ..services.location_service import LocationService
+from src.cache.profile_cache import UserProfileCache, get_user_profile, get_all_user_profiles
+from src.utils.clickhouse_async import get_async_clickhouse
+from src.utils.user_state import apply_location_batch
+from src.configg import (
+    PROFILE_CACHE_TTL_S, PROFILE_CACHE_NEGATIVE_TTL_S,
+    PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_REFRESH_S,
+    USER_STATE_POSITIONS,
+)
 
 logger = logging.getLogger(__name__)
 
 # Inizializza il servizio di localizzazione
 location_service = LocationService()
 
+# Profili utente per gli eventi in formato binario (senza campi profilo)
+ch_client = get_async_clickhouse()
+profile_cache = UserProfileCache(
+    fetch_one=lambda user_id: get_user_profile(ch_client, user_id),
+    fetch_all=lambda: get_all_user_profiles(ch_client),
+    ttl=PROFILE_CACHE_TTL_S,
+    negative_ttl=PROFILE_CACHE_NEGATIVE_TTL_S,
+    max_entries=PROFILE_CACHE_MAX_ENTRIES,
+    refresh_interval=PROFILE_CACHE_REFRESH_S,
+)
+
+@app.task
+async def start_profile_cache() -> None:
+    """Precarica la cache dei profili e avvia il refresh periodico."""
+    try:
+        await profile_cache.refresh()
+    except Exception as e:
+        logger.error(f"Errore precaricamento profili: {e}")
+    profile_cache.start()
+
+@app.task
+async def start_proximity_engine() -> None:
+    """Carica l'indice locale dei negozi usato per le ricerche di prossimità."""
+    try:
+        await location_service.start_proximity_engine()
+    except Exception as e:
+        logger.error(f"Errore avvio motore di prossimità, uso PostGIS: {e}")
+
+async def resolve_profile(event: LocationEvent):
+    """Restituisce (age, profession, interests) dall'evento o dalla cache profili."""
+    if event.age is not None:
+        return event.age, event.profession, event.interests
+    profile = await profile_cache.get(event.user_id)
+    if profile is None:
+        return None
+    return profile["age"], profile["profession"], profile["interests"]
+
+def update_user_states(events) -> None:
+    """
+    Aggiorna lo stato degli utenti per un batch di eventi.
+
+    Lo stato viene letto e scritto una sola volta per utente e le distanze
+    percorse sono calcolate in blocco (vedi `apply_location_batch`).
+    """
+    states = apply_location_batch(
+        events,
+        user_states_table.get,
+        location_service.calculate_distances_paired,
+        capacity=USER_STATE_POSITIONS
+    )
+    for user_id, state in states.items():
+        user_states_table[user_id] = state
+
 @app.agent(location_events_topic)
 async def process_location_events(stream) -> AsyncGenerator[None, None]:
     """
-    Processa eventi di posizione degli utenti.
+    Processa eventi di posizione degli utenti a micro-batch.
     
-    - Aggiorna stato utente
+    - Aggiorna stato utente (una scrittura per utente per batch)
     - Calcola distanza percorsa
-    - Trova negozi nelle vicinanze
+    - Trova negozi nelle vicinanze (una ricerca in blocco per batch)
     - Pubblica eventi di prossimità
     """
-    async for event in stream:
+    async for events in batches(stream, 'location'):
         try:
-            logger.debug(f"Processing location event for user {event.user_id}")
-            
-            # Ottieni stato utente corrente
-            current_state = user_states_table.get(event.user_id, UserState(
-                user_id=event.user_id,
-                last_latitude=event.latitude,
-                last_longitude=event.longitude,
-                last_seen=event.timestamp
-            ))
+            logger.debug(f"Processing {len(events)} location events")
             
-            # Calcola distanza percorsa se abbiamo posizione precedente
-            distance_traveled = 0.0
-            if hasattr(current_state, 'last_latitude'):
-                distance_traveled = location_service.calculate_distance(
-                    current_state.last_latitude, current_state.last_longitude,
-                    event.latitude, event.longitude
-                )
+            update_user_states(events)
             
-            # Aggiorna stato utente
-            updated_state = UserState(
-                user_id=event.user_id,
-                last_latitude=event.latitude,
-                last_longitude=event.longitude,
-                last_seen=event.timestamp,
-                total_distance=current_state.total_distance + distance_traveled,
-                shops_visited=current_state.shops_visited,
-                notifications_received=current_state.notifications_received,
-                recent_positions=current_state.recent_positions[-9:] + [{
-                    'lat': event.latitude,
-                    'lon': event.longitude,
-                    'timestamp': event.timestamp.isoformat()
-                }],
-                recent_notifications=current_state.recent_notifications
+            # Trova negozi nelle vicinanze di tutte le posizioni del batch
+            nearby_per_event = await location_service.find_nearby_shops_batch(
+                [e.latitude for e in events], [e.longitude for e in events], max_distance=200
             )
-            
-            # Salva stato aggiornato
-            user_states_table[event.user_id] = updated_state
-            
-            # Trova negozi nelle vicinanze
-            nearby_shops = await location_service.find_nearby_shops(
-                event.latitude, event.longitude, max_distance=200
-            )
-            
-            # Pubblica eventi di prossimità per ogni negozio vicino
-            for shop in nearby_shops:
-                proximity_event = ShopProximityEvent(
-                    user_id=event.user_id,
-                    shop_id=shop['shop_id'],
-                    shop_name=shop['shop_name'],
-                    shop_category=shop['category'],
-                    distance=shop['distance'],
-                    latitude=event.latitude,
-                    longitude=event.longitude,
-                    timestamp=event.timestamp,
-                    user_age=event.age,
-                    user_profession=event.profession,
-                    user_interests=event.interests
-                )
-                
-                # Pubblica su topic prossimità
-                await shop_proximity_topic.send(value=proximity_event)
-                
-                logger.info(f"User {event.user_id} near shop {shop['shop_name']} "
-                           f"(distance: {shop['distance']:.1f}m)")
-                
         except Exception as e:
-            logger.error(f"Error processing location event: {e}")
+            logger.error(f"Error processing location batch: {e}")
             # In un sistema di produzione, qui potresti voler inviare a un DLQ
-            continue
\ No newline at end of file
+            continue
+        
+        for event, nearby_shops in zip(events, nearby_per_event):
+            if not nearby_shops:
+                continue
+            
+            try:
+                # Profilo risolto solo quando serve (eventi binari non lo contengono)
+                profile = await resolve_profile(event)
+                if profile is None:
+                    logger.warning(f"Profilo utente {event.user_id} non trovato, nessun evento di prossimità")
+                    continue
+                age, profession, interests = profile
+                
+                # Pubblica eventi di prossimità per ogni negozio vicino
+                for shop in nearby_shops:
+                    proximity_event = ShopProximityEvent(
+                        user_id=event.user_id,
+                        shop_id=shop['shop_id'],
+                        shop_name=shop['shop_name'],
+                        shop_category=shop['category'],
+                        distance=shop['distance'],
+                        latitude=event.latitude,
+                        longitude=event.longitude,
+                        timestamp=event.timestamp,
+                        user_age=age,
+                        user_profession=profession,
+                        user_interests=interests
+                    )
+                    
+                    # Pubblica su topic prossimità
+                    await shop_proximity_topic.send(value=proximity_event)
+                    
+                    logger.info(f"User {event.user_id} near shop {shop['shop_name']} "
+                               f"(distance: {shop['distance']:.1f}m)")
+                    
+            except Exception as e:
+                logger.error(f"Error processing location event: {e}")
+                continue
@@ -1,13 +1,16 @@
 """
 Agent Faust per processare eventi di prossimità e generare notifiche.
 """
+import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import AsyncGenerator
 
-from ..app import app
+from src.utils.user_state import filter_cooldown, record_notifications
+
+from ..app import app, batches
 from ..topics.topics import shop_proximity_topic, notification_events_topic, analytics_events_topic
-from ..tables.state_tables import user_states_table, shop_stats_table
+from ..tables.state_tables import user_states_table
 from ..models.events import ShopProximityEvent, NotificationEvent, AnalyticsEvent
 from ..services.notification_service import NotificationService
 
@@ -16,52 +19,69 @@ logger = logging.getLogger(__name__)
 # Inizializza il servizio di notifiche
 notification_service = NotificationService()
 
+# Intervallo minimo tra due notifiche dello stesso negozio allo stesso utente
+COOLDOWN_PERIOD = timedelta(minutes=30)
+
+async def generate_notification(event: ShopProximityEvent):
+    """Genera il messaggio per un evento di prossimità; None se non generato."""
+    message, from_cache, generation_time = await notification_service.generate_personalized_message(
+        user_data={
+            'age': event.user_age,
+            'profession': event.user_profession,
+            'interests': event.user_interests
+        },
+        poi_data={
+            'name': event.shop_name,
+            'category': event.shop_category,
+            'description': f"Negozio a {event.distance:.0f}m di distanza"
+        }
+    )
+    if not message:
+        return None
+    return message, from_cache, generation_time
+
 @app.agent(shop_proximity_topic)
 async def process_proximity_events(stream) -> AsyncGenerator[None, None]:
     """
     Processa eventi di prossimità ai negozi e genera notifiche personalizzate.
     
+    Per ogni micro-batch:
     - Verifica se l'utente ha già ricevuto notifiche recenti per il negozio
-    - Genera messaggio personalizzato
-    - Pubblica evento di notifica
-    - Aggiorna statistiche
+    - Genera in parallelo i messaggi personalizzati
+    - Pubblica eventi di notifica e analytics
+    - Aggiorna lo stato utenti una volta per utente
+    
+    Lo stato viene riletto dopo la generazione: nel frattempo l'agent delle
+    posizioni può averlo aggiornato, e qui si applicano solo cooldown e
+    contatore delle notifiche.
     """
-    async for event in stream:
+    async for events in batches(stream, 'proximity'):
         try:
-            logger.debug(f"Processing proximity event: User {event.user_id} "
-                        f"near {event.shop_name} ({event.distance:.1f}m)")
-            
-            # Ottieni stato utente corrente
-            user_state = user_states_table.get(event.user_id)
-            if not user_state:
-                logger.warning(f"No state found for user {event.user_id}")
-                continue
-            
-            # Controlla se abbiamo già inviato una notifica recente per questo negozio
-            cooldown_period = timedelta(minutes=30)  # 30 minuti tra notifiche dello stesso negozio
-            last_notification_time = user_state.recent_notifications.get(event.shop_id)
+            # Filtro cooldown, con stato letto una volta per utente; anche due
+            # eventi dello stesso batch per lo stesso negozio contano come duplicati
+            candidates = filter_cooldown(
+                events, user_states_table.get, COOLDOWN_PERIOD.total_seconds()
+            )
             
-            if (last_notification_time and 
-                event.timestamp - last_notification_time < cooldown_period):
-                logger.debug(f"Skipping notification for user {event.user_id}, "
-                           f"shop {event.shop_id} due to cooldown")
+            if not candidates:
                 continue
             
-            # Genera messaggio personalizzato
-            message, from_cache, generation_time = await notification_service.generate_personalized_message(
-                user_data={
-                    'age': event.user_age,
-                    'profession': event.user_profession,
-                    'interests': event.user_interests
-                },
-                poi_data={
-                    'name': event.shop_name,
-                    'category': event.shop_category,
-                    'description': f"Negozio a {event.distance:.0f}m di distanza"
-                }
+            # Genera i messaggi del batch in parallelo
+            results = await asyncio.gather(
+                *(generate_notification(event) for event in candidates),
+                return_exceptions=True
             )
             
-            if message:
+            sent_by_user = {}
+            for event, result in zip(candidates, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error generating message for user {event.user_id}: {result}")
+                    result = None
+                if result is None:
+                    # Nessuna notifica inviata: non deve far scattare il cooldown
+                    continue
+                message, from_cache, generation_time = result
+                
                 # Crea evento di notifica
                 notification_event = NotificationEvent(
                     event_id=f"{event.user_id}_{event.shop_id}_{int(event.timestamp.timestamp())}",
@@ -81,17 +101,7 @@ async def process_proximity_events(stream) -> AsyncGenerator[None, None]:
                 # Pubblica evento di notifica
                 await notification_events_topic.send(value=notification_event)
                 
-                # Aggiorna stato utente con nuova notifica
-                user_state.recent_notifications[event.shop_id] = event.timestamp
-                user_state.notifications_received += 1
-                user_states_table[event.user_id] = user_state
-                
-                # Aggiorna statistiche negozio
-                shop_stats = shop_stats_table.get(event.shop_id)
-                if shop_stats:
-                    shop_stats.notifications_sent += 1
-                    shop_stats.last_updated = event.timestamp
-                    shop_stats_table[event.shop_id] = shop_stats
+                sent_by_user.setdefault(event.user_id, []).append(event)
                 
                 # Pubblica evento analytics
                 analytics_event = AnalyticsEvent(
@@ -111,7 +121,15 @@ async def process_proximity_events(stream) -> AsyncGenerator[None, None]:
                 
                 logger.info(f"Notification sent to user {event.user_id} "
                           f"for shop {event.shop_name}: {message[:50]}...")
+            
+            # Aggiorna lo stato riletto con le nuove notifiche (una scrittura per utente)
+            for user_id, sent in sent_by_user.items():
+                user_state = user_states_table.get(user_id)
+                if user_state is None:
+                    continue
+                record_notifications(user_state, sent)
+                user_states_table[user_id] = user_state
                 
         except Exception as e:
-            logger.error(f"Error processing proximity event: {e}")
-            continue
\ No newline at end of file
+            logger.error(f"Error processing proximity batch: {e}")
+            continue
@@ -0,0 +1,36 @@
+"""
+Agent Faust per le statistiche a finestre dei negozi.
+"""
+import logging
+from typing import AsyncGenerator
+
+from ..app import app
+from ..topics.topics import shop_proximity_topic
+from ..tables.window_tables import shop_activity_short, shop_activity_long
+from ..models.events import ShopProximityEvent
+from src.utils.shop_activity import ShopWindow
+
+logger = logging.getLogger(__name__)
+
+
+def record_visit(window: ShopWindow, user_id: int) -> ShopWindow:
+    """Operazione applicata a ogni finestra che contiene l'evento."""
+    window.add_visit(user_id)
+    return window
+
+
+@app.agent(shop_proximity_topic)
+async def track_shop_activity(stream) -> AsyncGenerator[None, None]:
+    """
+    Aggiorna visite e visitatori unici per negozio nelle tabelle a finestre.
+    
+    Gli eventi di prossimità vengono ripartizionati per shop_id, così ogni
+    finestra di un negozio vive su un solo worker. La finestra è scelta dal
+    timestamp dell'evento, quindi l'elaborazione è per evento.
+    """
+    async for event in stream.group_by(ShopProximityEvent.shop_id, name='shop_proximity_by_shop'):
+        try:
+            shop_activity_short[event.shop_id].apply(record_visit, event.user_id)
+            shop_activity_long[event.shop_id].apply(record_visit, event.user_id)
+        except Exception as e:
+            logger.error(f"Error updating shop activity for shop {event.shop_id}: {e}")
@@ -7,16 +7,58 @@ import ssl
 from faust import App
 
 from src.configg import (
-    KAFKA_BROKER, SSL_CAFILE, SSL_CERTFILE, SSL_KEYFILE
+    KAFKA_BROKER, SSL_CAFILE, SSL_CERTFILE, SSL_KEYFILE,
+    FAUST_STORE, FAUST_DATADIR, FAUST_TABLE_STANDBY_REPLICAS,
 )
 
 logger = logging.getLogger(__name__)
 
+# Micro-batch per agent: numero massimo di eventi e attesa massima in secondi
+# per stream.take(). Con batch_size <= 1 l'agent elabora un evento alla volta.
+AGENT_BATCHING = {
+    'location': {
+        'batch_size': int(os.getenv('FAUST_LOCATION_BATCH_SIZE', '500')),
+        'within': float(os.getenv('FAUST_LOCATION_BATCH_WITHIN_S', '0.5')),
+    },
+    'proximity': {
+        'batch_size': int(os.getenv('FAUST_PROXIMITY_BATCH_SIZE', '50')),
+        'within': float(os.getenv('FAUST_PROXIMITY_BATCH_WITHIN_S', '0.5')),
+    },
+    'notifications': {
+        'batch_size': int(os.getenv('FAUST_NOTIFICATIONS_BATCH_SIZE', '1000')),
+        'within': float(os.getenv('FAUST_NOTIFICATIONS_BATCH_WITHIN_S', '1.0')),
+    },
+    'analytics': {
+        'batch_size': int(os.getenv('FAUST_ANALYTICS_BATCH_SIZE', '1000')),
+        'within': float(os.getenv('FAUST_ANALYTICS_BATCH_WITHIN_S', '1.0')),
+    },
+}
+
+
+async def batches(stream, agent: str):
+    """
+    Itera lo stream a micro-batch secondo la configurazione dell'agent.
+
+    Args:
+        stream: Stream Faust dell'agent
+        agent: Chiave in AGENT_BATCHING
+
+    Yields:
+        list: Eventi del batch (uno solo se il batching è disattivato)
+    """
+    config = AGENT_BATCHING[agent]
+    if config['batch_size'] <= 1:
+        async for event in stream:
+            yield [event]
+    else:
+        async for batch in stream.take(config['batch_size'], within=config['within']):
+            yield batch
+
 # Configurazione SSL per Kafka
 ssl_context = ssl.create_default_context(cafile=SSL_CAFILE)
 ssl_context.load_cert_chain(certfile=SSL_CERTFILE, keyfile=SSL_KEYFILE)
 
-# Configurazione Faust app (usa memory store)
+# Configurazione Faust app
 app = App(
     'nearyou-stream-processor',
     broker=f'kafka+ssl://{KAFKA_BROKER}',
@@ -25,8 +67,13 @@ app = App(
     web_host='0.0.0.0',
     web_port=8002,
     
-    # Usa memory store (nessuna persistenza ma molto più semplice)
-    store='memory://',
+    # State store delle tabelle: con RocksDB lo stato e l'offset di changelog
+    # applicato restano nel datadir, quindi al riavvio il restore riparte da
+    # lì invece di rileggere tutto il changelog. Le repliche standby tengono
+    # una copia calda su un altro worker per i rebalance.
+    store=FAUST_STORE,
+    datadir=FAUST_DATADIR,
+    table_standby_replicas=FAUST_TABLE_STANDBY_REPLICAS,
     
     # Configurazioni per produzione
     stream_buffer_maxsize=1000,
@@ -62,6 +109,9 @@ app = App(
 )
 
 # Import agents dopo la creazione dell'app per evitare circular imports
-from .agents import location_agent, notification_agent, analytics_agent
+from .agents import location_agent, notification_agent, analytics_agent, shop_activity_agent
+from . import recovery, web
 
-logger.info("Faust app configurata per NearYou stream processing (memory store)")
\ No newline at end of file
+if FAUST_STORE.startswith('memory'):
+    logger.warning("Store Faust in memoria: al riavvio le tabelle vengono ricostruite dall'intero changelog")
+logger.info(f"Faust app configurata per NearYou stream processing (store {FAUST_STORE}, datadir {FAUST_DATADIR})")
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Codec Faust per i messaggi di gps_stream e per gli stati binari delle tabelle.
+"""
+import json
+
+from faust.serializers import codecs
+
+from src.utils.gps_codec import decode_location
+from src.utils.shop_activity import ShopWindow
+from src.utils.user_state import UserState
+
+
+class GpsCodec(codecs.Codec):
+    """
+    Legge entrambi i formati di gps_stream (JSON e binario gps-v1).
+
+    I codec Faust non ricevono gli header Kafka: il formato viene
+    riconosciuto dal prefisso magico del payload binario.
+    """
+
+    def _dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def _loads(self, s: bytes):
+        return decode_location(s)
+
+
+class UserStateCodec(codecs.Codec):
+    """Serializza UserState nel formato binario per il changelog di user_states."""
+
+    def _dumps(self, obj) -> bytes:
+        return obj.encode()
+
+    def _loads(self, s: bytes):
+        return UserState.decode(s)
+
+
+class ShopWindowCodec(codecs.Codec):
+    """Serializza le finestre di attività dei negozi (visite + HyperLogLog)."""
+
+    def _dumps(self, obj) -> bytes:
+        return obj.encode()
+
+    def _loads(self, s: bytes):
+        return ShopWindow.decode(s)
+
+
+codecs.register("nearyou_gps", GpsCodec())
+codecs.register("nearyou_user_state", UserStateCodec())
+codecs.register("nearyou_shop_window", ShopWindowCodec())
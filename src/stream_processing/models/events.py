@@ -7,14 +7,19 @@ from typing import Optional
 
 
 class LocationEvent(faust.Record, serializer='json'):
-    """Evento di posizione utente."""
+    """
+    Evento di posizione utente.
+
+    I campi profilo sono presenti solo nel formato JSON; con il formato
+    binario restano None e vengono risolti dalla cache dei profili.
+    """
     user_id: int
     latitude: float
     longitude: float
     timestamp: datetime
-    age: int
-    profession: str
-    interests: str
+    age: Optional[int] = None
+    profession: Optional[str] = None
+    interests: Optional[str] = None
 
 
 class ShopProximityEvent(faust.Record, serializer='json'):
@@ -0,0 +1,55 @@
+"""
+Metriche di recovery delle tabelle Faust.
+
+Misura il tempo tra l'assegnazione delle partizioni e la fine del restore
+dei changelog: è il buco di elaborazione che un worker introduce a ogni
+deploy o rebalance. Con lo store persistente il valore dovrebbe restare
+basso anche al crescere del numero di utenti.
+"""
+import logging
+import time
+from typing import Any, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .app import app
+
+logger = logging.getLogger(__name__)
+
+TABLE_RECOVERY_SECONDS = Histogram(
+    "faust_table_recovery_seconds",
+    "Durata del restore delle tabelle dopo un'assegnazione di partizioni",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+TABLE_RECOVERY_LAST_SECONDS = Gauge(
+    "faust_table_recovery_last_seconds",
+    "Durata dell'ultimo restore delle tabelle",
+)
+TABLE_RECOVERIES = Counter(
+    "faust_table_recoveries_total",
+    "Restore delle tabelle completati",
+)
+
+_recovery_started: Optional[float] = None
+
+
+@app.on_partitions_assigned.connect
+async def on_partitions_assigned(app, assigned: Any, **kwargs) -> None:
+    """Segna l'inizio del restore per le partizioni appena assegnate."""
+    global _recovery_started
+    _recovery_started = time.monotonic()
+
+
+@app.on_rebalance_complete.connect
+async def on_rebalance_complete(app, **kwargs) -> None:
+    """Registra la durata del restore appena concluso."""
+    global _recovery_started
+    if _recovery_started is None:
+        return
+    elapsed = time.monotonic() - _recovery_started
+    _recovery_started = None
+
+    TABLE_RECOVERY_SECONDS.observe(elapsed)
+    TABLE_RECOVERY_LAST_SECONDS.set(elapsed)
+    TABLE_RECOVERIES.inc()
+    logger.info(f"Recovery tabelle completata in {elapsed:.2f}s (store {app.conf.store})")
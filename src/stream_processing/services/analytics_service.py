@@ -3,20 +3,59 @@ Servizio per analytics e salvataggio in ClickHouse.
 """
 import logging
 from datetime import datetime
-from clickhouse_driver import Client as CHClient
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from src.configg import get_clickhouse_config
+from src.configg import (
+    ANALYTICS_BATCH_MAX_ROWS, ANALYTICS_BATCH_MAX_AGE_S, ANALYTICS_BATCH_MAX_BUFFER,
+    CH_BATCH_RETRIES, CH_BATCH_BACKOFF_S,
+)
+from src.utils.clickhouse_async import get_async_clickhouse
+from src.utils.clickhouse_writer import ClickHouseBatchWriter
 from ..models.events import NotificationEvent, AnalyticsEvent
 
 logger = logging.getLogger(__name__)
 
+USER_EVENTS_INSERT = """
+    INSERT INTO user_events
+    (event_id, event_time, user_id, latitude, longitude, 
+     poi_range, poi_name, poi_info)
+    VALUES
+"""
+
 class AnalyticsService:
     """Servizio per gestire analytics e storage in ClickHouse."""
     
     def __init__(self):
         """Inizializza il servizio."""
-        self.ch_client = CHClient(**get_clickhouse_config())
+        self.ch_client = get_async_clickhouse()
+        # Le notifiche vengono accumulate e scritte a blocchi: le INSERT
+        # piccole e frequenti sono il caso peggiore per MergeTree
+        self.writer = ClickHouseBatchWriter(
+            self.ch_client,
+            USER_EVENTS_INSERT,
+            max_rows=ANALYTICS_BATCH_MAX_ROWS,
+            max_age=ANALYTICS_BATCH_MAX_AGE_S,
+            name="notification_events",
+            max_buffer=ANALYTICS_BATCH_MAX_BUFFER,
+            retries=CH_BATCH_RETRIES,
+            backoff=CH_BATCH_BACKOFF_S,
+        )
+    
+    @staticmethod
+    def _notification_row(event: NotificationEvent) -> tuple:
+        """Converte un evento di notifica in una riga di user_events."""
+        # Converte timestamp in formato ClickHouse
+        timestamp = event.timestamp.replace(tzinfo=None) if event.timestamp.tzinfo else event.timestamp
+        return (
+            int(event.event_id.split('_')[-1]),  # Usa timestamp come event_id
+            timestamp,
+            event.user_id,
+            event.latitude,
+            event.longitude,
+            event.distance,
+            event.shop_name,
+            event.message
+        )
     
     async def store_notification_event(self, event: NotificationEvent) -> None:
         """
@@ -25,34 +64,42 @@ class AnalyticsService:
         Args:
             event: Evento di notifica da salvare
         """
-        try:
-            # Converte timestamp in formato ClickHouse
-            timestamp = event.timestamp.replace(tzinfo=None) if event.timestamp.tzinfo else event.timestamp
-            
-            self.ch_client.execute(
-                """
-                INSERT INTO user_events
-                (event_id, event_time, user_id, latitude, longitude, 
-                 poi_range, poi_name, poi_info)
-                VALUES
-                """,
-                [(
-                    int(event.event_id.split('_')[-1]),  # Usa timestamp come event_id
-                    timestamp,
-                    event.user_id,
-                    event.latitude,
-                    event.longitude,
-                    event.distance,
-                    event.shop_name,
-                    event.message
-                )]
-            )
-            
-            logger.debug(f"Stored notification event {event.event_id} in ClickHouse")
-            
-        except Exception as e:
-            logger.error(f"Error storing notification event in ClickHouse: {e}")
-            raise
+        await self.store_notification_events([event])
+    
+    async def store_notification_events(self, events: List[NotificationEvent]) -> None:
+        """
+        Accoda più eventi di notifica nel writer bufferizzato.
+        
+        Le righe vengono scritte in ClickHouse quando il buffer raggiunge la
+        dimensione o l'età massima. Se ClickHouse è lento e il buffer è pieno
+        la chiamata attende, rallentando l'agent invece di accumulare memoria.
+        
+        Consegna at-most-once: Faust fa ack del batch appena le righe sono
+        nel buffer, quindi un crash del processo perde fino a
+        ANALYTICS_BATCH_MAX_BUFFER notifiche non ancora scritte (un flush
+        fallito invece le conserva per il tentativo successivo). Sono dati
+        per la dashboard: si accetta la perdita in cambio di INSERT a blocchi.
+        
+        Args:
+            events: Eventi di notifica da salvare
+        """
+        if not events:
+            return
+        # Avvio lazy: il loop di flush per età richiede un event loop attivo
+        self.writer.start()
+        for event in events:
+            await self.writer.add(self._notification_row(event))
+        
+        logger.debug(f"Buffered {len(events)} notification events for ClickHouse")
+    
+    async def stop(self) -> bool:
+        """
+        Scrive le notifiche ancora in buffer e ferma il writer.
+        
+        Returns:
+            bool: True se il flush finale è riuscito
+        """
+        return await self.writer.stop()
     
     async def process_analytics_event(self, event: AnalyticsEvent) -> None:
         """
@@ -5,21 +5,81 @@ import asyncio
 import logging
 import math
 import asyncpg
-from typing import List, Dict, Any
+import numpy as np
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
 from src.configg import (
     POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, 
-    POSTGRES_PASSWORD, POSTGRES_DB
+    POSTGRES_PASSWORD, POSTGRES_DB,
+    SHOP_INDEX_REFRESH_S, SHOP_INDEX_CELL_M
+)
+from src.utils.geo import (
+    ShopIndexRefresher, group_rows_by_position, nearby_shops_batch,
+    haversine_many, haversine_paired, haversine_within
 )
 
 logger = logging.getLogger(__name__)
 
+# ST_DWithin sull'espressione geom::geography usa l'indice GiST
+# shops_geom_geography_idx (vedi deployment/scripts/init_postgres.sh):
+# la distanza esatta viene calcolata solo per i candidati nel raggio.
+NEARBY_SHOPS_QUERY = """
+    SELECT
+        shop_id,
+        shop_name,
+        category,
+        ST_Distance(
+            geom::geography,
+            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
+        ) AS distance
+    FROM shops
+    WHERE ST_DWithin(
+        geom::geography,
+        ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography,
+        $3
+    )
+    ORDER BY distance
+    LIMIT 10
+"""
+
+# Variante in blocco: una sola query per tutte le posizioni di un batch
+NEARBY_SHOPS_BATCH_QUERY = """
+    SELECT
+        q.idx,
+        s.shop_id,
+        s.shop_name,
+        s.category,
+        s.distance
+    FROM unnest($1::float8[], $2::float8[]) WITH ORDINALITY AS q(lon, lat, idx)
+    CROSS JOIN LATERAL (
+        SELECT
+            shop_id,
+            shop_name,
+            category,
+            ST_Distance(
+                geom::geography,
+                ST_SetSRID(ST_MakePoint(q.lon, q.lat), 4326)::geography
+            ) AS distance
+        FROM shops
+        WHERE ST_DWithin(
+            geom::geography,
+            ST_SetSRID(ST_MakePoint(q.lon, q.lat), 4326)::geography,
+            $3
+        )
+        ORDER BY distance
+        LIMIT 10
+    ) s
+    ORDER BY q.idx, s.distance
+"""
+
 class LocationService:
     """Servizio per gestire operazioni di localizzazione."""
     
     def __init__(self):
         """Inizializza il servizio."""
         self.pool = None
+        # Motore di prossimità locale (indice dei negozi in memoria)
+        self.shop_index: Optional[ShopIndexRefresher] = None
     
     async def _get_pool(self):
         """Ottiene il pool di connessioni PostgreSQL."""
@@ -35,6 +95,27 @@ class LocationService:
             )
         return self.pool
     
+    async def start_proximity_engine(self) -> None:
+        """
+        Carica i negozi nell'indice locale e avvia il ricaricamento automatico.
+        
+        L'indice viene ricostruito quando cambia la tabella shops; finché è
+        vuoto le ricerche ricadono sulla query PostGIS.
+        """
+        if self.shop_index is None:
+            self.shop_index = ShopIndexRefresher(
+                await self._get_pool(),
+                refresh_interval=SHOP_INDEX_REFRESH_S,
+                cell_size_m=SHOP_INDEX_CELL_M
+            )
+        await self.shop_index.load()
+        self.shop_index.start()
+    
+    async def stop_proximity_engine(self) -> None:
+        """Ferma il ricaricamento dell'indice locale."""
+        if self.shop_index is not None:
+            await self.shop_index.stop()
+    
     def calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
         Calcola la distanza haversine tra due punti in metri.
@@ -60,6 +141,68 @@ class LocationService:
         
         return R * c
     
+    def calculate_distances(
+        self,
+        lat: float,
+        lon: float,
+        lats: Sequence[float],
+        lons: Sequence[float]
+    ) -> np.ndarray:
+        """
+        Calcola in blocco le distanze da un punto a molte posizioni.
+        
+        Args:
+            lat, lon: Coordinate del punto di riferimento
+            lats, lons: Coordinate delle posizioni
+            
+        Returns:
+            np.ndarray: Distanze in metri
+        """
+        return haversine_many(lat, lon, lats, lons)
+    
+    def calculate_distances_paired(
+        self,
+        lats1: Sequence[float],
+        lons1: Sequence[float],
+        lats2: Sequence[float],
+        lons2: Sequence[float]
+    ) -> np.ndarray:
+        """
+        Calcola in blocco le distanze tra coppie di posizioni.
+        
+        Usata per la distanza percorsa di un batch di eventi: posizioni
+        precedenti contro posizioni correnti.
+        
+        Args:
+            lats1, lons1: Coordinate di partenza
+            lats2, lons2: Coordinate di arrivo
+            
+        Returns:
+            np.ndarray: Distanze in metri, una per coppia
+        """
+        return haversine_paired(lats1, lons1, lats2, lons2)
+    
+    def find_pairs_within(
+        self,
+        lats1: Sequence[float],
+        lons1: Sequence[float],
+        lats2: Sequence[float],
+        lons2: Sequence[float],
+        radius_m: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Trova tutte le coppie di punti entro un raggio (molti contro molti).
+        
+        Args:
+            lats1, lons1: Coordinate del primo insieme
+            lats2, lons2: Coordinate del secondo insieme
+            radius_m: Distanza massima in metri
+            
+        Returns:
+            Tuple: Indici nel primo insieme, indici nel secondo e distanze in metri
+        """
+        return haversine_within(lats1, lons1, lats2, lons2, radius_m)
+    
     async def find_nearby_shops(
         self, 
         latitude: float, 
@@ -77,30 +220,59 @@ class LocationService:
         Returns:
             List[Dict]: Lista dei negozi nelle vicinanze
         """
+        if self.shop_index is not None and len(self.shop_index.index):
+            return nearby_shops_batch(self.shop_index.index, [latitude], [longitude], max_distance)[0]
+        
         try:
             pool = await self._get_pool()
             
             async with pool.acquire() as conn:
-                rows = await conn.fetch("""
-                    SELECT
-                        shop_id,
-                        shop_name,
-                        category,
-                        ST_Distance(
-                            geom::geography,
-                            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
-                        ) AS distance
-                    FROM shops
-                    WHERE ST_Distance(
-                        geom::geography,
-                        ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
-                    ) <= $3
-                    ORDER BY distance
-                    LIMIT 10
-                """, longitude, latitude, max_distance)
+                rows = await conn.fetch(NEARBY_SHOPS_QUERY, longitude, latitude, max_distance)
                 
                 return [dict(row) for row in rows]
                 
         except Exception as e:
             logger.error(f"Error finding nearby shops: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    async def find_nearby_shops_batch(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        max_distance: float = 200
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Trova i negozi vicini a più posizioni con una sola ricerca.
+        
+        Con l'indice locale caricato non serve alcuna query: le posizioni
+        della stessa cella sono confrontate in blocco con i negozi candidati
+        tramite `find_pairs_within`. Altrimenti le posizioni vengono inviate
+        a PostGIS in un'unica query.
+        
+        Args:
+            latitudes: Latitudini delle posizioni
+            longitudes: Longitudini delle posizioni
+            max_distance: Distanza massima in metri
+            
+        Returns:
+            List[List[Dict]]: Per ogni posizione, i negozi vicini ordinati per distanza
+        """
+        if self.shop_index is not None and len(self.shop_index.index):
+            # Confronto in blocco posizioni/negozi candidati con find_pairs_within
+            return nearby_shops_batch(
+                self.shop_index.index, latitudes, longitudes, max_distance,
+                pairs_within=self.find_pairs_within
+            )
+        
+        try:
+            pool = await self._get_pool()
+            
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(
+                    NEARBY_SHOPS_BATCH_QUERY, list(longitudes), list(latitudes), max_distance
+                )
+            
+            return group_rows_by_position(rows, len(latitudes))
+        except Exception as e:
+            logger.error(f"Error finding nearby shops for batch: {e}")
+            return [[] for _ in latitudes]
@@ -4,18 +4,46 @@ Servizio per gestire la generazione di notifiche.
 import logging
 import time
 import httpx
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple
 
-from src.configg import MESSAGE_GENERATOR_URL
+from src.cache.message_keys import generate_cache_key
+from src.cache.single_flight import SingleFlightCache
+from src.configg import (
+    MESSAGE_GENERATOR_URL, MESSAGE_GENERATOR_BATCH_URL,
+    MESSAGE_BATCH_MAX_ITEMS, MESSAGE_BATCH_MAX_DELAY_S,
+    NOTIFICATION_CACHE_TTL_S, NOTIFICATION_CACHE_MAX_ENTRIES,
+)
+from src.utils.micro_batcher import MicroBatcher
 
 logger = logging.getLogger(__name__)
 
 class NotificationService:
-    """Servizio per gestire notifiche personalizzate."""
+    """
+    Servizio per gestire notifiche personalizzate.
+    
+    Le richieste con la stessa chiave del message-generator (profilo e
+    negozio normalizzati) vengono coalescenti: se una è già in corso le
+    altre ne attendono il risultato, che resta poi in cache per qualche
+    secondo. Le richieste distinte arrivate a breve distanza vengono
+    inviate insieme a /generate/batch.
+    """
     
     def __init__(self):
         """Inizializza il servizio."""
         self.http_client = None
+        # Solo i messaggi veri finiscono in cache: non errori, risposte vuote
+        # o fallback del generatore (LLM in errore)
+        self.messages = SingleFlightCache(
+            ttl=NOTIFICATION_CACHE_TTL_S,
+            max_entries=NOTIFICATION_CACHE_MAX_ENTRIES,
+            cacheable=lambda result: bool(result[0]) and not result[2]
+        )
+        self.batcher = MicroBatcher(
+            self._request_messages,
+            max_items=MESSAGE_BATCH_MAX_ITEMS,
+            max_delay=MESSAGE_BATCH_MAX_DELAY_S,
+            name="notification_messages"
+        )
     
     async def _get_http_client(self) -> httpx.AsyncClient:
         """Ottiene il client HTTP."""
@@ -39,33 +67,22 @@ class NotificationService:
             Tuple[str, bool, float]: (messaggio, from_cache, tempo_generazione_ms)
         """
         start_time = time.time()
+        payload = {
+            "user": {
+                "age": user_data["age"],
+                "profession": user_data["profession"],
+                "interests": user_data["interests"]
+            },
+            "poi": poi_data
+        }
         
         try:
-            client = await self._get_http_client()
-            
-            payload = {
-                "user": {
-                    "age": user_data["age"],
-                    "profession": user_data["profession"],
-                    "interests": user_data["interests"]
-                },
-                "poi": poi_data
-            }
-            
-            response = await client.post(MESSAGE_GENERATOR_URL, json=payload)
-            
-            if response.status_code == 200:
-                result = response.json()
-                generation_time = (time.time() - start_time) * 1000
-                
-                return (
-                    result.get("message", ""), 
-                    result.get("cached", False),
-                    generation_time
-                )
-            else:
-                logger.error(f"Message generator error: {response.status_code}")
-                return "", False, 0.0
+            (message, cached, _), shared = await self.messages.get_or_compute(
+                generate_cache_key(payload["user"], poi_data),
+                lambda: self.batcher.submit(payload)
+            )
+            generation_time = (time.time() - start_time) * 1000 if message else 0.0
+            return message, cached or shared, generation_time
                 
         except Exception as e:
             logger.error(f"Error generating personalized message: {e}")
@@ -74,11 +91,52 @@ class NotificationService:
             generation_time = (time.time() - start_time) * 1000
             return fallback_msg, False, generation_time
     
+    async def _request_message(self, payload: Dict[str, Any]) -> Tuple[str, bool, bool]:
+        """
+        Chiede un messaggio al message-generator.
+        
+        Returns:
+            Tuple[str, bool, bool]: (messaggio, cached lato generatore, fallback del generatore);
+            messaggio vuoto in caso di errore HTTP
+        """
+        client = await self._get_http_client()
+        response = await client.post(MESSAGE_GENERATOR_URL, json=payload)
+        
+        if response.status_code != 200:
+            logger.error(f"Message generator error: {response.status_code}")
+            return "", False, False
+        
+        result = response.json()
+        return result.get("message", ""), result.get("cached", False), result.get("fallback", False)
+    
+    async def _request_messages(self, payloads: List[Dict[str, Any]]) -> List[Tuple[str, bool, bool]]:
+        """
+        Chiede al message-generator i messaggi di un micro-batch.
+        
+        Returns:
+            List[Tuple[str, bool, bool]]: (messaggio, cached, fallback) per ogni payload, nello stesso ordine
+        """
+        if len(payloads) == 1:
+            return [await self._request_message(payloads[0])]
+        
+        client = await self._get_http_client()
+        response = await client.post(MESSAGE_GENERATOR_BATCH_URL, json={"items": payloads})
+        
+        if response.status_code != 200:
+            logger.error(f"Message generator batch error: {response.status_code}")
+            return [("", False, False)] * len(payloads)
+        
+        return [
+            (result.get("message", ""), result.get("cached", False), result.get("fallback", False))
+            for result in response.json()["results"]
+        ]
+    
     def _generate_fallback_message(self, shop_name: str) -> str:
         """Genera un messaggio di fallback."""
         return f"Sei vicino a {shop_name}! Fermati a dare un'occhiata."
     
     async def close(self):
         """Chiude le risorse del servizio."""
+        await self.batcher.close()
         if self.http_client:
             await self.http_client.aclose()
\ No newline at end of file
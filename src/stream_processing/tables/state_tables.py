@@ -1,28 +1,94 @@
 """
 Tabelle di stato per Faust stream processing.
 """
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from faust import current_event
+
 from ..app import app
-from ..models.state import UserState, ShopStats, SystemStats
+from ..models import codecs  # noqa: F401  registra il codec nearyou_user_state
+from ..topics.topics import analytics_events_topic
 
-# Tabella stato utenti
+# Tabella stato utenti: valori UserState serializzati in binario nel changelog.
+# Nessun default: gli agent creano lo stato alla prima posizione dell'utente
 user_states_table = app.Table(
     'user_states',
-    default=UserState,
     partitions=4,
+    value_serializer='nearyou_user_state',
     help='Stato corrente di ogni utente'
 )
 
-# Tabella statistiche negozi
-shop_stats_table = app.Table(
-    'shop_stats',
-    default=ShopStats,
-    partitions=2,
-    help='Statistiche per ogni negozio'
-)
+# Le statistiche dei negozi sono in tabelle a finestre (vedi window_tables)
 
-# Tabella statistiche sistema
+# Tabella statistiche sistema, divisa in un contatore per partizione di
+# analytics_events (chiavi "p0", "p1", ...): ogni worker aggiorna solo le
+# proprie chiavi e i totali si ottengono sommando gli shard in lettura.
+# Le partizioni coincidono con quelle del topic sorgente. I valori sono dict
+# JSON: last_updated è in epoch secondi, così resta uguale dopo il decode.
 system_stats_table = app.Table(
     'system_stats',
-    default=SystemStats,
-    help='Statistiche aggregate di sistema'
-)
\ No newline at end of file
+    partitions=analytics_events_topic.partitions,
+    help='Statistiche di sistema per partizione'
+)
+
+
+def _epoch(value: Any) -> Optional[float]:
+    """Converte last_updated in epoch secondi (accetta anche ISO e datetime dei vecchi shard)."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def system_stats_shard_key() -> str:
+    """
+    Chiave dello shard di system_stats per l'evento corrente.
+
+    Faust scrive nel changelog sulla partizione dell'evento corrente, quindi
+    usare la stessa partizione come chiave mantiene ogni shard su un solo
+    worker.
+
+    Returns:
+        str: Chiave "p<partizione>"
+    """
+    event = current_event()
+    partition = event.message.partition if event is not None else 0
+    return f"p{partition}"
+
+
+def local_stats_partitions() -> Set[int]:
+    """Partizioni di system_stats attive su questo worker (standby escluse)."""
+    topic = system_stats_table.changelog_topic.get_topic_name()
+    return {tp.partition for tp in app.assignor.assigned_actives() if tp.topic == topic}
+
+
+def aggregate_system_stats(partitions: Optional[Set[int]] = None) -> Dict[str, Any]:
+    """
+    Somma gli shard di system_stats presenti in locale.
+
+    Args:
+        partitions: Partizioni da includere (default tutte quelle attive sul worker)
+
+    Returns:
+        Dict: Totali di sistema (last_updated in epoch secondi) e dettaglio per shard
+    """
+    if partitions is None:
+        partitions = local_stats_partitions()
+    totals = {
+        'total_events_processed': 0,
+        'total_notifications_sent': 0,
+        'last_updated': None,
+        'shards': {},
+    }
+    for key, shard in system_stats_table.items():
+        if not (isinstance(key, str) and key.startswith('p') and int(key[1:]) in partitions):
+            continue
+        totals['total_events_processed'] += shard['total_events_processed']
+        totals['total_notifications_sent'] += shard['total_notifications_sent']
+        last_updated = _epoch(shard.get('last_updated'))
+        if last_updated is not None and (totals['last_updated'] is None or last_updated > totals['last_updated']):
+            totals['last_updated'] = last_updated
+        totals['shards'][key] = shard
+    return totals
@@ -0,0 +1,82 @@
+"""
+Tabelle a finestre per l'attività dei negozi.
+
+Per ogni negozio si tengono visite e visitatori unici (HyperLogLog) in una
+finestra tumbling breve e in una hopping lunga. Le finestre scadute vengono
+rimosse da Faust; alla chiusura sono accodate e scritte in ClickHouse a
+blocchi nella tabella shop_activity_windows.
+"""
+import logging
+from datetime import timedelta
+
+from src.configg import (
+    SHOP_WINDOW_SHORT_S, SHOP_WINDOW_LONG_S, SHOP_WINDOW_LONG_STEP_S, SHOP_WINDOW_GRACE_S,
+    CH_BATCH_MAX_ROWS, CH_BATCH_MAX_AGE_S, CH_BATCH_MAX_BUFFER, CH_BATCH_RETRIES, CH_BATCH_BACKOFF_S,
+)
+from src.utils.clickhouse_async import get_async_clickhouse
+from src.utils.clickhouse_writer import ClickHouseBatchWriter
+from src.utils.shop_activity import SHOP_ACTIVITY_INSERT, ShopWindow, window_row
+
+from ..app import app
+from ..models import codecs  # noqa: F401  registra il codec nearyou_shop_window
+from ..models.events import ShopProximityEvent
+
+logger = logging.getLogger(__name__)
+
+# Partizioni del topic di repartition per shop_id (vedi shop_activity_agent)
+SHOP_WINDOW_PARTITIONS = 4
+
+shop_window_writer = ClickHouseBatchWriter(
+    get_async_clickhouse(),
+    SHOP_ACTIVITY_INSERT,
+    max_rows=CH_BATCH_MAX_ROWS,
+    # Le finestre si chiudono a ondate ogni table_cleanup_interval: un'età
+    # più lunga accorpa la chiusura di più cicli in una INSERT
+    max_age=max(CH_BATCH_MAX_AGE_S, 30.0),
+    name="shop_activity_windows",
+    max_buffer=CH_BATCH_MAX_BUFFER,
+    retries=CH_BATCH_RETRIES,
+    backoff=CH_BATCH_BACKOFF_S,
+)
+
+
+def _on_close(size_s: int):
+    """Callback di chiusura finestra che accoda la riga per ClickHouse."""
+    async def on_window_close(key, window: ShopWindow) -> None:
+        if window is None:
+            return
+        shop_window_writer.start()
+        await shop_window_writer.add(window_row(key, window, size_s))
+    return on_window_close
+
+
+def _shop_window_table(name: str, size_s: int):
+    return app.Table(
+        name,
+        default=ShopWindow,
+        partitions=SHOP_WINDOW_PARTITIONS,
+        value_serializer='nearyou_shop_window',
+        on_window_close=_on_close(size_s),
+        help=f'Attività dei negozi per finestre di {size_s}s',
+    )
+
+
+# Visite e visitatori unici per negozio, finestre tumbling brevi (default 5 min)
+shop_activity_short = _shop_window_table('shop_activity_short', SHOP_WINDOW_SHORT_S).tumbling(
+    timedelta(seconds=SHOP_WINDOW_SHORT_S),
+    expires=timedelta(seconds=SHOP_WINDOW_GRACE_S),
+).relative_to_field(ShopProximityEvent.timestamp)
+
+# Stesse metriche su finestre hopping lunghe (default 1 h ogni 15 min)
+shop_activity_long = _shop_window_table('shop_activity_long', SHOP_WINDOW_LONG_S).hopping(
+    timedelta(seconds=SHOP_WINDOW_LONG_S),
+    timedelta(seconds=SHOP_WINDOW_LONG_STEP_S),
+    expires=timedelta(seconds=SHOP_WINDOW_GRACE_S),
+).relative_to_field(ShopProximityEvent.timestamp)
+
+
+@app.on_before_shutdown.connect
+async def flush_shop_windows(app, **kwargs) -> None:
+    """Scrive in ClickHouse le finestre chiuse ancora in buffer."""
+    if not await shop_window_writer.stop():
+        logger.error("Flush finale delle finestre negozi su ClickHouse non riuscito")
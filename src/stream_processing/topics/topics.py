@@ -2,15 +2,17 @@
 Definizione dei topic Kafka per Faust.
 """
 from ..app import app
+from ..models import codecs  # noqa: F401  registra il codec nearyou_gps
 from ..models.events import (
     LocationEvent, ShopProximityEvent, 
     NotificationEvent, AnalyticsEvent
 )
 
-# Topic input dal producer esistente
+# Topic input dal producer esistente (JSON o binario, vedi src.utils.gps_codec)
 location_events_topic = app.topic(
     'gps_stream',
     value_type=LocationEvent,
+    value_serializer='nearyou_gps',
     partitions=4,
     replicas=1,
 )
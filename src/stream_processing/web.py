@@ -0,0 +1,60 @@
+"""
+Pagine web del worker Faust (porta 8002).
+
+- /stats/system: totali di sistema sommando gli shard attivi sul worker
+- /metrics: metriche Prometheus del processo, con i contatori di sistema per shard
+
+Ogni worker espone solo i propri shard: i totali di cluster si ottengono
+sommando in Prometheus (es. `sum(nearyou_system_events_processed)`).
+"""
+from datetime import datetime, timezone
+
+from faust.web import Request, Response, View
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, generate_latest
+
+from .app import app
+from .tables.state_tables import aggregate_system_stats
+
+SYSTEM_EVENTS_PROCESSED = Gauge(
+    "nearyou_system_events_processed",
+    "Eventi analytics elaborati per shard di system_stats",
+    ["shard"],
+)
+SYSTEM_NOTIFICATIONS_SENT = Gauge(
+    "nearyou_system_notifications_sent",
+    "Notifiche inviate per shard di system_stats",
+    ["shard"],
+)
+
+
+@app.page('/stats/system')
+class SystemStatsView(View):
+    """Totali di sistema calcolati sugli shard locali."""
+
+    async def get(self, request: Request) -> Response:
+        stats = aggregate_system_stats()
+        last_updated = stats['last_updated']
+        return self.json({
+            'total_events_processed': stats['total_events_processed'],
+            'total_notifications_sent': stats['total_notifications_sent'],
+            'last_updated': (
+                datetime.fromtimestamp(last_updated, tz=timezone.utc).isoformat() if last_updated else None
+            ),
+            'shards': sorted(stats['shards']),
+        })
+
+
+@app.page('/metrics')
+class MetricsView(View):
+    """Endpoint Prometheus del worker."""
+
+    async def get(self, request: Request) -> Response:
+        # I contatori per shard vengono letti dalla tabella al momento dello scrape
+        stats = aggregate_system_stats()
+        SYSTEM_EVENTS_PROCESSED.clear()
+        SYSTEM_NOTIFICATIONS_SENT.clear()
+        for shard, values in stats['shards'].items():
+            SYSTEM_EVENTS_PROCESSED.labels(shard).set(values['total_events_processed'])
+            SYSTEM_NOTIFICATIONS_SENT.labels(shard).set(values['total_notifications_sent'])
+        # aiohttp rifiuta il charset in content_type: va passato come header
+        return self.bytes(generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -0,0 +1,165 @@
+# src/utils/clickhouse_async.py
+"""
+Accesso asincrono a ClickHouse condiviso da tutti i servizi.
+
+`clickhouse_driver.Client` è sincrono e non thread-safe: questo modulo
+mantiene un pool di client, ciascuno usato da un solo thread alla volta,
+ed esegue le query in un ThreadPoolExecutor dedicato così che l'event loop
+non resti mai bloccato in attesa di ClickHouse.
+
+Uso:
+    from src.utils.clickhouse_async import get_async_clickhouse
+
+    ch = get_async_clickhouse()
+    rows = await ch.query("SELECT 1", name="healthcheck")
+"""
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from clickhouse_driver import Client as CHClient
+from prometheus_client import Counter, Histogram
+
+from src.configg import get_clickhouse_config, CLICKHOUSE_POOL_SIZE, CLICKHOUSE_QUERY_TIMEOUT_S
+
+logger = logging.getLogger(__name__)
+
+CLICKHOUSE_QUERIES = Counter(
+    "clickhouse_queries_total",
+    "Query ClickHouse eseguite per nome ed esito",
+    ["query", "kind", "outcome"],
+)
+CLICKHOUSE_QUERY_LATENCY = Histogram(
+    "clickhouse_query_seconds",
+    "Durata delle query ClickHouse (attesa del client inclusa)",
+    ["query", "kind"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+class AsyncClickHouseClient:
+    """Pool di client ClickHouse con API asincrona, timeout e metriche per query."""
+
+    def __init__(self, pool_size: int = 8, timeout: float = 30.0, **client_kwargs):
+        """
+        Inizializza il pool.
+
+        Args:
+            pool_size: Numero di client (e thread) disponibili in parallelo
+            timeout: Timeout di default in secondi per ogni query
+            **client_kwargs: Parametri di connessione per clickhouse_driver.Client
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="clickhouse")
+        # clickhouse_driver si connette in modo lazy: creare i client non apre connessioni
+        self._clients: asyncio.Queue = asyncio.Queue()
+        for _ in range(pool_size):
+            self._clients.put_nowait(CHClient(**client_kwargs))
+
+    async def _run(self, kind: str, name: str, timeout: Optional[float], fn) -> Any:
+        """Esegue `fn(client)` su un client libero del pool."""
+        timeout = timeout if timeout is not None else self.timeout
+        start = time.monotonic()
+        outcome = "ok"
+
+        client = await self._clients.get()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, fn, client)
+        # Il client torna nel pool solo quando il thread ha davvero finito,
+        # anche se il chiamante ha già rinunciato per timeout
+        future.add_done_callback(lambda _: self._clients.put_nowait(client))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.error("Timeout query ClickHouse '%s' dopo %.1fs", name, timeout)
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            CLICKHOUSE_QUERIES.labels(name, kind, outcome).inc()
+            CLICKHOUSE_QUERY_LATENCY.labels(name, kind).observe(time.monotonic() - start)
+
+    async def query(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        name: str = "query"
+    ) -> List[tuple]:
+        """
+        Esegue una query di lettura.
+
+        Args:
+            sql: Query SQL
+            params: Parametri della query
+            timeout: Timeout in secondi (default del pool se None)
+            name: Nome della query usato come label delle metriche
+
+        Returns:
+            List[tuple]: Righe restituite
+        """
+        # max_execution_time è in secondi interi e 0 significa "nessun limite"
+        limit = timeout if timeout is not None else self.timeout
+        settings = {"max_execution_time": max(1, math.ceil(limit))}
+        return await self._run(
+            "select", name, timeout,
+            lambda client: client.execute(sql, params, settings=settings)
+        )
+
+    async def insert(
+        self,
+        sql: str,
+        rows: Sequence[Sequence[Any]],
+        timeout: Optional[float] = None,
+        name: str = "insert"
+    ) -> int:
+        """
+        Esegue una INSERT ... VALUES con le righe fornite.
+
+        Args:
+            sql: Query INSERT senza valori
+            rows: Righe da inserire
+            timeout: Timeout in secondi (default del pool se None)
+            name: Nome dell'insert usato come label delle metriche
+
+        Returns:
+            int: Numero di righe inserite
+        """
+        return await self._run("insert", name, timeout, lambda client: client.execute(sql, rows))
+
+    async def close(self) -> None:
+        """Chiude le connessioni e l'executor; se è il client condiviso, il prossimo ne crea uno nuovo."""
+        global _default_client
+        while not self._clients.empty():
+            client = self._clients.get_nowait()
+            client.disconnect()
+        self._executor.shutdown(wait=False)
+        if _default_client is self:
+            _default_client = None
+
+
+_default_client: Optional[AsyncClickHouseClient] = None
+
+
+def get_async_clickhouse() -> AsyncClickHouseClient:
+    """
+    Restituisce il client asincrono condiviso, configurato da src.configg.
+
+    Returns:
+        AsyncClickHouseClient: Istanza unica per processo
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncClickHouseClient(
+            pool_size=CLICKHOUSE_POOL_SIZE,
+            timeout=CLICKHOUSE_QUERY_TIMEOUT_S,
+            **get_clickhouse_config()
+        )
+    return _default_client
@@ -0,0 +1,230 @@
+# src/utils/clickhouse_writer.py
+"""
+Writer ClickHouse a micro-batch.
+
+Accumula le righe in memoria e le scrive con un'unica INSERT quando il
+batch raggiunge una dimensione massima o un'età massima. La INSERT passa
+dal client asincrono condiviso, quindi non blocca l'event loop.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.utils.clickhouse_async import AsyncClickHouseClient
+
+logger = logging.getLogger(__name__)
+
+WRITER_FLUSH_LATENCY = Histogram(
+    "clickhouse_writer_flush_seconds",
+    "Durata dei flush del writer a micro-batch (retry inclusi)",
+    ["writer"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+WRITER_ROWS = Counter(
+    "clickhouse_writer_rows_total",
+    "Righe gestite dal writer per esito del flush",
+    ["writer", "outcome"],
+)
+WRITER_RETRIES = Counter(
+    "clickhouse_writer_retries_total",
+    "Tentativi di INSERT ripetuti dopo un errore",
+    ["writer"],
+)
+WRITER_BUFFERED = Gauge(
+    "clickhouse_writer_buffered_rows",
+    "Righe in attesa di flush",
+    ["writer"],
+)
+WRITER_BACKPRESSURE = Counter(
+    "clickhouse_writer_backpressure_total",
+    "Chiamate ad add() sospese perché il buffer era pieno",
+    ["writer"],
+)
+
+
+class ClickHouseBatchWriter:
+    """
+    Buffer di righe con flush per dimensione o età.
+
+    Ogni riga può essere accompagnata da un metadato opaco (es. offset
+    Kafka): dopo un flush riuscito i metadati delle righe scritte vengono
+    passati a `on_flushed`, così il chiamante può fare commit solo di ciò
+    che è effettivamente persistito. La callback gira sotto il lock del
+    flush, quindi le chiamate sono serializzate e in ordine. Ogni flush ritenta la INSERT con backoff
+    esponenziale; se tutti i tentativi falliscono le righe restano nel buffer
+    e vengono ritentate al flush successivo. Quando il buffer raggiunge
+    `max_buffer` righe, `add()` attende che si liberi spazio.
+    """
+
+    def __init__(
+        self,
+        client: AsyncClickHouseClient,
+        insert_query: str,
+        max_rows: int = 1000,
+        max_age: float = 1.0,
+        on_flushed: Optional[Callable[[List[Any]], Awaitable[None]]] = None,
+        name: str = "batch_insert",
+        max_buffer: Optional[int] = None,
+        retries: int = 0,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
+        """
+        Inizializza il writer.
+
+        Args:
+            client: Client ClickHouse asincrono
+            insert_query: Query INSERT ... VALUES a cui accodare le righe
+            max_rows: Numero di righe che forza un flush
+            max_age: Età massima in secondi della riga più vecchia nel buffer
+            on_flushed: Callback async invocata con i metadati delle righe scritte
+            name: Nome dell'insert usato come label delle metriche
+            max_buffer: Righe oltre cui `add()` si sospende (default 10 × max_rows)
+            retries: Tentativi aggiuntivi della INSERT all'interno di un flush
+            backoff: Base in secondi del backoff esponenziale con jitter
+            max_backoff: Attesa massima in secondi tra due tentativi
+        """
+        self.client = client
+        self.insert_query = insert_query
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.on_flushed = on_flushed
+        self.name = name
+        self.max_buffer = max_buffer if max_buffer is not None else max_rows * 10
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._failures = 0  # flush consecutivi falliti
+        self._rows: List[Sequence[Any]] = []
+        self._metas: List[Any] = []
+        self._first_added: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _sleep_time(self, attempt: int) -> float:
+        """Backoff esponenziale con full jitter."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    async def add(self, row: Sequence[Any], meta: Any = None) -> None:
+        """
+        Accoda una riga; esegue il flush se il batch è pieno.
+
+        Se il buffer è pieno (ClickHouse lento o irraggiungibile) attende
+        finché un flush non libera spazio: il chiamante rallenta invece di
+        far crescere la memoria senza limite.
+
+        Args:
+            row: Valori della riga nell'ordine delle colonne della INSERT
+            meta: Metadato opaco restituito a `on_flushed`
+        """
+        if len(self._rows) >= self.max_buffer:
+            WRITER_BACKPRESSURE.labels(self.name).inc()
+            while len(self._rows) >= self.max_buffer:
+                if not await self.flush():
+                    await asyncio.sleep(self._sleep_time(self._failures))
+
+        if not self._rows:
+            self._first_added = time.monotonic()
+        self._rows.append(row)
+        self._metas.append(meta)
+        WRITER_BUFFERED.labels(self.name).set(len(self._rows))
+
+        if len(self._rows) >= self.max_rows:
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Scrive il contenuto del buffer in ClickHouse.
+
+        Returns:
+            bool: True se il buffer è stato scritto (o era vuoto)
+        """
+        async with self._lock:
+            if not self._rows:
+                return True
+
+            rows, metas = self._rows, self._metas
+            self._rows, self._metas = [], []
+            first_added, self._first_added = self._first_added, None
+
+            start = time.monotonic()
+            attempt = 0
+            while True:
+                try:
+                    await self.client.insert(self.insert_query, rows, name=self.name)
+                    break
+                except Exception as e:
+                    if attempt >= self.retries:
+                        logger.error(f"Errore flush di {len(rows)} righe su ClickHouse: {e}")
+                        self._failures += 1
+                        WRITER_ROWS.labels(self.name, "failed").inc(len(rows))
+                        WRITER_FLUSH_LATENCY.labels(self.name).observe(time.monotonic() - start)
+                        # Rimetti in testa le righe non scritte per il prossimo tentativo
+                        self._rows = rows + self._rows
+                        self._metas = metas + self._metas
+                        self._first_added = first_added
+                        WRITER_BUFFERED.labels(self.name).set(len(self._rows))
+                        return False
+                    attempt += 1
+                    WRITER_RETRIES.labels(self.name).inc()
+                    logger.warning(
+                        "Flush ClickHouse '%s' fallito (%s), tentativo %d/%d",
+                        self.name, e, attempt, self.retries
+                    )
+                    await asyncio.sleep(self._sleep_time(attempt))
+
+            self._failures = 0
+            WRITER_ROWS.labels(self.name, "written").inc(len(rows))
+            WRITER_FLUSH_LATENCY.labels(self.name).observe(time.monotonic() - start)
+            WRITER_BUFFERED.labels(self.name).set(len(self._rows))
+            logger.debug("Flush ClickHouse: %d righe scritte", len(rows))
+
+            # Sotto il lock: i callback (es. commit degli offset) non si
+            # sovrappongono e arrivano nell'ordine dei flush
+            if self.on_flushed is not None:
+                try:
+                    await self.on_flushed(metas)
+                except Exception as e:
+                    logger.error(f"Errore callback post-flush: {e}")
+        return True
+
+    async def run(self) -> None:
+        """Loop che esegue il flush delle righe più vecchie di `max_age`."""
+        while True:
+            # Dopo flush falliti si attende di più per non martellare ClickHouse
+            delay = self.max_age / 2
+            if self._failures:
+                delay = max(delay, self._sleep_time(self._failures))
+            await asyncio.sleep(delay)
+            if self._first_added is not None and time.monotonic() - self._first_added >= self.max_age:
+                await self.flush()
+
+    def start(self) -> asyncio.Task:
+        """Avvia il flush periodico in background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> bool:
+        """
+        Ferma il flush periodico e scrive le righe rimaste.
+
+        Returns:
+            bool: True se il flush finale è riuscito
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return await self.flush()
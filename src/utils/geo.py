@@ -0,0 +1,501 @@
+# src/utils/geo.py
+"""
+Utility geografiche: distanza haversine e indice spaziale in-memory dei negozi.
+
+L'indice è una griglia uniforme su lat/lon: ogni cella contiene i negozi
+che vi ricadono, così le ricerche per raggio e del negozio più vicino
+esaminano solo le celle adiacenti invece dell'intera tabella.
+Lo stesso indice è usato dal consumer e dal LocationService di Faust.
+"""
+import asyncio
+import logging
+import math
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000  # Raggio medio della Terra in metri
+# Coerente con le distanze haversine: ~111195 m per grado
+METERS_PER_DEG_LAT = EARTH_RADIUS_M * math.pi / 180
+
+# Oltre questo numero di celle di raggio conviene una scansione completa
+_MAX_RING_SEARCH = 64
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calcola la distanza haversine tra due punti in metri.
+
+    Args:
+        lat1, lon1: Coordinate del primo punto
+        lat2, lon2: Coordinate del secondo punto
+
+    Returns:
+        float: Distanza in metri
+    """
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_lat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) *
+         math.sin(delta_lon / 2) ** 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_M * c
+
+
+ArrayLike = Union[Sequence[float], np.ndarray]
+
+
+def haversine_many(lat: float, lon: float, lats: ArrayLike, lons: ArrayLike) -> np.ndarray:
+    """
+    Distanze haversine in metri da un punto a molti punti.
+
+    Args:
+        lat, lon: Coordinate del punto di riferimento
+        lats, lons: Coordinate dei punti (array della stessa lunghezza)
+
+    Returns:
+        np.ndarray: Distanze in metri, una per punto
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlon = np.radians(np.asarray(lons, dtype=np.float64)) - math.radians(lon)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_paired(lats1: ArrayLike, lons1: ArrayLike, lats2: ArrayLike, lons2: ArrayLike) -> np.ndarray:
+    """
+    Distanze haversine in metri tra coppie di punti (elemento per elemento).
+
+    Utile per la distanza percorsa: posizioni precedenti contro posizioni correnti.
+
+    Args:
+        lats1, lons1: Coordinate dei primi punti
+        lats2, lons2: Coordinate dei secondi punti (stessa lunghezza)
+
+    Returns:
+        np.ndarray: Distanze in metri, una per coppia
+    """
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    dlon = np.radians(np.asarray(lons2, dtype=np.float64) - np.asarray(lons1, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_within(
+    lats1: ArrayLike,
+    lons1: ArrayLike,
+    lats2: ArrayLike,
+    lons2: ArrayLike,
+    radius_m: float,
+    chunk_size: int = 1024
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Coppie (i, j) di punti entro un raggio, confrontando tutti con tutti.
+
+    La matrice delle distanze è calcolata a blocchi di `chunk_size` righe
+    per limitare la memoria con insiemi grandi.
+
+    Args:
+        lats1, lons1: Coordinate del primo insieme (es. posizioni del batch)
+        lats2, lons2: Coordinate del secondo insieme (es. negozi)
+        radius_m: Distanza massima in metri
+        chunk_size: Righe della matrice calcolate per volta
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Indici nel primo insieme,
+        indici nel secondo insieme e distanze in metri delle coppie trovate
+    """
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lons1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[np.newaxis, :]
+    lon2 = np.radians(np.asarray(lons2, dtype=np.float64))[np.newaxis, :]
+    cos_lat2 = np.cos(lat2)
+
+    rows, cols, dists = [], [], []
+    for start in range(0, len(lat1), chunk_size):
+        la = lat1[start:start + chunk_size, np.newaxis]
+        lo = lon1[start:start + chunk_size, np.newaxis]
+        a = np.sin((lat2 - la) / 2) ** 2 + np.cos(la) * cos_lat2 * np.sin((lon2 - lo) / 2) ** 2
+        d = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        i, j = np.nonzero(d <= radius_m)
+        rows.append(i + start)
+        cols.append(j)
+        dists.append(d[i, j])
+
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+
+
+def degree_box(latitude: float, radius_m: float) -> Tuple[float, float]:
+    """
+    Semiampiezze in gradi del riquadro che contiene il cerchio di raggio dato.
+
+    Sulla sfera i punti entro `radius_m` differiscono in latitudine al massimo
+    di radius/R e in longitudine al massimo di asin(sin(radius/R) / cos(lat)).
+
+    Args:
+        latitude: Latitudine del centro
+        radius_m: Raggio in metri
+
+    Returns:
+        Tuple[float, float]: Semiampiezza in latitudine e in longitudine
+    """
+    delta = radius_m / EARTH_RADIUS_M
+    # Margine per gli arrotondamenti sui punti esattamente a distanza `radius_m`
+    dlat = math.degrees(delta) + 1e-9
+    cos_lat = math.cos(math.radians(latitude))
+    if delta >= math.pi / 2 or math.sin(delta) >= cos_lat:
+        return dlat, 180.0
+    return dlat, math.degrees(math.asin(math.sin(delta) / cos_lat)) + 1e-9
+
+
+class ShopGridIndex:
+    """
+    Indice spaziale a griglia uniforme per i negozi.
+
+    Ogni negozio è un dict con almeno le chiavi `lat` e `lon`; gli altri
+    campi (shop_id, shop_name, category, ...) vengono restituiti così come sono.
+    Le coordinate sono tenute in array NumPy ordinati per cella: le celle di
+    una stessa riga della griglia sono contigue, quindi una ricerca per raggio
+    legge poche slice e calcola le distanze in modo vettoriale.
+    L'indice è immutabile: per aggiornarlo se ne costruisce uno nuovo.
+    """
+
+    def __init__(self, shops: Iterable[Dict[str, Any]], cell_size_m: float = 250.0):
+        """
+        Costruisce l'indice.
+
+        Args:
+            shops: Negozi da indicizzare (dict con `lat` e `lon`)
+            cell_size_m: Lato della cella della griglia in metri
+        """
+        self.cell_size_m = cell_size_m
+        shops = [s for s in shops if s.get("lat") is not None and s.get("lon") is not None]
+
+        lat = np.array([s["lat"] for s in shops], dtype=np.float64)
+        lon = np.array([s["lon"] for s in shops], dtype=np.float64)
+
+        # Latitudine di riferimento per convertire metri in gradi di longitudine
+        ref_lat = float(lat.mean()) if len(shops) else 45.46
+        self._lat_step = cell_size_m / METERS_PER_DEG_LAT
+        self._lon_step = cell_size_m / (METERS_PER_DEG_LAT * math.cos(math.radians(ref_lat)))
+
+        rows = np.floor(lat / self._lat_step).astype(np.int64)
+        cols = np.floor(lon / self._lon_step).astype(np.int64)
+        if len(shops):
+            self._bounds = (int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max()))
+            self._ncols = self._bounds[3] - self._bounds[2] + 1
+        else:
+            self._bounds = None
+            self._ncols = 0
+
+        # Ordinamento per codice cella (riga-major)
+        codes = self._code(rows, cols) if len(shops) else np.empty(0, dtype=np.int64)
+        order = np.argsort(codes, kind="stable")
+        self._codes = codes[order]
+        self._lat = lat[order]
+        self._lon = lon[order]
+        self._shops: List[Dict[str, Any]] = [shops[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self._shops)
+
+    def _code(self, row, col):
+        return (row - self._bounds[0]) * self._ncols + (col - self._bounds[2])
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self._lat_step)), int(math.floor(lon / self._lon_step))
+
+    def _candidates(
+        self,
+        min_lat: float,
+        max_lat: float,
+        min_lon: float,
+        max_lon: float,
+        radius_m: float
+    ) -> np.ndarray:
+        """Indici dei negozi nelle celle che intersecano il riquadro delle posizioni allargato del raggio."""
+        dlat, dlon = degree_box(max(abs(min_lat), abs(max_lat)), radius_m)
+        row_lo, col_lo = self._cell_of(min_lat - dlat, min_lon - dlon)
+        row_hi, col_hi = self._cell_of(max_lat + dlat, max_lon + dlon)
+        min_row, max_row, min_col, max_col = self._bounds
+        col_lo, col_hi = max(col_lo, min_col), min(col_hi, max_col)
+        if col_lo > col_hi:
+            return np.empty(0, dtype=np.int64)
+
+        ranges = []
+        for r in range(max(row_lo, min_row), min(row_hi, max_row) + 1):
+            lo = np.searchsorted(self._codes, self._code(r, col_lo), side="left")
+            hi = np.searchsorted(self._codes, self._code(r, col_hi), side="right")
+            if hi > lo:
+                ranges.append(np.arange(lo, hi))
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return ranges[0] if len(ranges) == 1 else np.concatenate(ranges)
+
+    def _distances(self, latitude: float, longitude: float, idx: np.ndarray) -> np.ndarray:
+        """Distanze haversine in metri dalla posizione ai negozi `idx`."""
+        return haversine_many(latitude, longitude, self._lat[idx], self._lon[idx])
+
+    def within(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_m: float,
+        limit: Optional[int] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Trova i negozi entro un raggio, ordinati per distanza.
+
+        Args:
+            latitude: Latitudine della posizione
+            longitude: Longitudine della posizione
+            radius_m: Raggio di ricerca in metri
+            limit: Numero massimo di risultati (None = tutti)
+
+        Returns:
+            List[Tuple[Dict, float]]: Coppie (negozio, distanza in metri)
+        """
+        if not self._shops:
+            return []
+
+        idx = self._candidates(latitude, latitude, longitude, longitude, radius_m)
+        if not len(idx):
+            return []
+
+        distances = self._distances(latitude, longitude, idx)
+        mask = distances <= radius_m
+        idx, distances = idx[mask], distances[mask]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return [(self._shops[i], float(d)) for i, d in zip(idx[order], distances[order])]
+
+    def within_many(
+        self,
+        latitudes: ArrayLike,
+        longitudes: ArrayLike,
+        radius_m: float,
+        limit: Optional[int] = None,
+        pairs_within: Callable[..., Tuple[np.ndarray, np.ndarray, np.ndarray]] = haversine_within
+    ) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        Trova i negozi entro un raggio da più posizioni.
+
+        Le posizioni della stessa cella condividono i candidati: per ogni
+        gruppo le distanze sono calcolate con un solo confronto molti contro
+        molti (`pairs_within`, con la firma di `haversine_within`).
+
+        Args:
+            latitudes: Latitudini delle posizioni
+            longitudes: Longitudini delle posizioni
+            radius_m: Raggio di ricerca in metri
+            limit: Numero massimo di risultati per posizione (None = tutti)
+            pairs_within: Ricerca delle coppie entro il raggio
+
+        Returns:
+            List[List[Tuple[Dict, float]]]: Per ogni posizione, coppie (negozio, distanza) ordinate per distanza
+        """
+        lats = np.asarray(latitudes, dtype=np.float64)
+        lons = np.asarray(longitudes, dtype=np.float64)
+        results: List[List[Tuple[Dict[str, Any], float]]] = [[] for _ in range(len(lats))]
+        if not self._shops:
+            return results
+
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for k in range(len(lats)):
+            groups.setdefault(self._cell_of(lats[k], lons[k]), []).append(k)
+
+        for members in groups.values():
+            members = np.asarray(members)
+            g_lats, g_lons = lats[members], lons[members]
+            idx = self._candidates(g_lats.min(), g_lats.max(), g_lons.min(), g_lons.max(), radius_m)
+            if not len(idx):
+                continue
+            points, shops, distances = pairs_within(g_lats, g_lons, self._lat[idx], self._lon[idx], radius_m)
+            order = np.lexsort((distances, points))
+            for p, j, d in zip(points[order], shops[order], distances[order]):
+                found = results[members[p]]
+                if limit is None or len(found) < limit:
+                    found.append((self._shops[idx[j]], float(d)))
+        return results
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Trova il negozio più vicino a una posizione.
+
+        Args:
+            latitude: Latitudine della posizione
+            longitude: Longitudine della posizione
+
+        Returns:
+            Optional[Tuple[Dict, float]]: (negozio, distanza in metri) o None se l'indice è vuoto
+        """
+        if not self._shops:
+            return None
+
+        row, col = self._cell_of(latitude, longitude)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_span = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        # Raggio raddoppiato a ogni passo: `within` esamina tutte le celle del
+        # cerchio, quindi il più vicino entro il raggio è il più vicino in assoluto
+        span = 1
+        while span < max_span and span <= _MAX_RING_SEARCH:
+            found = self.within(latitude, longitude, span * self.cell_size_m, limit=1)
+            if found:
+                return found[0]
+            span *= 2
+
+        # Posizione lontana dai negozi: scansione vettoriale completa
+        distances = self._distances(latitude, longitude, np.arange(len(self._shops)))
+        best = int(np.argmin(distances))
+        return self._shops[best], float(distances[best])
+
+
+def _shop_row(shop: Dict[str, Any], distance: float) -> Dict[str, Any]:
+    """Riga negozio nel formato della query PostGIS."""
+    return {
+        "shop_id": shop["shop_id"],
+        "shop_name": shop["shop_name"],
+        "category": shop["category"],
+        "distance": distance,
+    }
+
+
+def nearby_shops_batch(
+    index: ShopGridIndex,
+    latitudes: Sequence[float],
+    longitudes: Sequence[float],
+    max_distance: float,
+    limit: int = 10,
+    pairs_within: Callable[..., Tuple[np.ndarray, np.ndarray, np.ndarray]] = haversine_within
+) -> List[List[Dict[str, Any]]]:
+    """
+    Cerca nell'indice i negozi vicini a più posizioni.
+
+    Args:
+        index: Indice dei negozi
+        latitudes: Latitudini delle posizioni
+        longitudes: Longitudini delle posizioni
+        max_distance: Distanza massima in metri
+        limit: Negozi massimi per posizione
+        pairs_within: Ricerca delle coppie entro il raggio (vedi `ShopGridIndex.within_many`)
+
+    Returns:
+        List[List[Dict]]: Per ogni posizione, i negozi vicini ordinati per distanza
+    """
+    return [
+        [_shop_row(shop, distance) for shop, distance in found]
+        for found in index.within_many(latitudes, longitudes, max_distance, limit=limit, pairs_within=pairs_within)
+    ]
+
+
+def group_rows_by_position(rows: Iterable[Any], count: int) -> List[List[Dict[str, Any]]]:
+    """
+    Ripartisce per posizione le righe della query PostGIS in blocco.
+
+    Args:
+        rows: Righe con la colonna `idx` (1-based, da WITH ORDINALITY)
+        count: Numero di posizioni cercate
+
+    Returns:
+        List[List[Dict]]: Per ogni posizione le sue righe, senza `idx`
+    """
+    results: List[List[Dict[str, Any]]] = [[] for _ in range(count)]
+    for row in rows:
+        shop = dict(row)
+        results[shop.pop("idx") - 1].append(shop)
+    return results
+
+
+class ShopIndexRefresher:
+    """
+    Mantiene un ShopGridIndex allineato alla tabella `shops` di PostgreSQL.
+
+    Carica i negozi all'avvio e ricontrolla periodicamente un'impronta
+    economica della tabella (numero di righe, id e data di creazione
+    massimi): l'indice viene ricostruito solo quando l'impronta cambia,
+    ad esempio dopo il caricamento giornaliero del DAG `etl_shops`.
+    """
+
+    FINGERPRINT_QUERY = """
+        SELECT count(*) AS n, max(shop_id) AS max_id, max(created_at) AS last_created
+        FROM shops
+    """
+
+    SHOPS_QUERY = """
+        SELECT shop_id, shop_name, category, ST_Y(geom) AS lat, ST_X(geom) AS lon
+        FROM shops
+        WHERE geom IS NOT NULL
+    """
+
+    def __init__(self, pool, refresh_interval: float = 300.0, cell_size_m: float = 250.0):
+        """
+        Inizializza il refresher.
+
+        Args:
+            pool: Pool asyncpg verso il database dei negozi
+            refresh_interval: Secondi tra due controlli dell'impronta
+            cell_size_m: Lato della cella della griglia in metri
+        """
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.cell_size_m = cell_size_m
+        self.index = ShopGridIndex([], cell_size_m)
+        self._fingerprint = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self, force: bool = False) -> bool:
+        """
+        Ricarica l'indice se la tabella è cambiata.
+
+        Args:
+            force: Ricarica anche se l'impronta non è cambiata
+
+        Returns:
+            bool: True se l'indice è stato ricostruito
+        """
+        row = await self.pool.fetchrow(self.FINGERPRINT_QUERY)
+        fingerprint = tuple(row.values()) if row else None
+        if not force and fingerprint == self._fingerprint:
+            return False
+
+        rows = await self.pool.fetch(self.SHOPS_QUERY)
+        self.index = ShopGridIndex((dict(r) for r in rows), self.cell_size_m)
+        self._fingerprint = fingerprint
+        logger.info("Indice negozi ricaricato: %d negozi", len(self.index))
+        return True
+
+    async def run(self) -> None:
+        """Loop di refresh periodico."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Errore refresh indice negozi: {e}")
+
+    def start(self) -> asyncio.Task:
+        """Avvia il refresh periodico in background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Ferma il refresh periodico."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,109 @@
+# src/utils/gps_codec.py
+"""
+Formati di serializzazione dei messaggi di `gps_stream`.
+
+Due formati convivono sul topic, negoziati con l'header Kafka
+`nearyou-encoding`:
+- "json": formato storico, con timestamp ISO e campi profilo;
+- "gps-v1": struct binaria a dimensione fissa (35 byte) con solo
+  user_id, coordinate e timestamp in epoch millis. I campi profilo
+  vengono risolti a valle dalla cache dei profili.
+
+Il payload binario inizia con un prefisso magico, quindi i lettori che non
+vedono gli header (es. i codec Faust) possono riconoscere il formato dai
+primi byte.
+"""
+import json
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+ENCODING_HEADER = "nearyou-encoding"
+JSON = "json"
+BINARY = "gps-v1"
+
+MAGIC = b"NY"
+VERSION = 1
+# magic, versione, user_id, latitudine, longitudine, timestamp in ms
+_STRUCT = struct.Struct("<2sBqddq")
+
+Headers = List[Tuple[str, bytes]]
+
+
+def timestamp_ms(ts: datetime) -> int:
+    """Converte un datetime (naive = UTC) in epoch millis."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+
+def encode_location(event: Dict[str, Any], wire_format: str = JSON) -> Tuple[bytes, Headers]:
+    """
+    Serializza un evento di posizione.
+
+    Args:
+        event: Evento con user_id, latitude, longitude, timestamp (ISO) e campi profilo
+        wire_format: JSON oppure BINARY
+
+    Returns:
+        Tuple[bytes, Headers]: Payload e header Kafka da inviare
+    """
+    if wire_format == BINARY:
+        ts = event["timestamp"]
+        ts = datetime.fromisoformat(ts) if isinstance(ts, str) else ts
+        payload = _STRUCT.pack(
+            MAGIC, VERSION, event["user_id"],
+            event["latitude"], event["longitude"], timestamp_ms(ts)
+        )
+        return payload, [(ENCODING_HEADER, BINARY.encode())]
+    if wire_format != JSON:
+        raise ValueError(f"Formato GPS non supportato: {wire_format}")
+    return json.dumps(event).encode("utf-8"), [(ENCODING_HEADER, JSON.encode())]
+
+
+def is_binary(value: bytes) -> bool:
+    """Indica se il payload è nel formato binario."""
+    return value[:2] == MAGIC
+
+
+def decode_location(value: bytes, headers: Optional[Sequence[Tuple[str, bytes]]] = None) -> Dict[str, Any]:
+    """
+    Deserializza un evento di posizione in entrambi i formati.
+
+    Il formato è preso dall'header `nearyou-encoding`; in sua assenza
+    viene riconosciuto dal prefisso magico. Il risultato ha sempre le
+    stesse chiavi del formato JSON (timestamp ISO UTC); i campi profilo
+    mancano se il messaggio era binario.
+
+    Args:
+        value: Payload del messaggio
+        headers: Header Kafka del messaggio
+
+    Returns:
+        Dict: Evento di posizione
+
+    Raises:
+        ValueError: Se il payload binario ha una versione sconosciuta
+    """
+    encoding = None
+    for key, header_value in headers or ():
+        if key == ENCODING_HEADER:
+            encoding = header_value.decode()
+            break
+    if encoding is None:
+        encoding = BINARY if is_binary(value) else JSON
+
+    if encoding == JSON:
+        return json.loads(value)
+    if encoding != BINARY:
+        raise ValueError(f"Formato GPS non supportato: {encoding}")
+
+    _, version, user_id, lat, lon, ts_ms = _STRUCT.unpack(value)
+    if version != VERSION:
+        raise ValueError(f"Versione del formato GPS non supportata: {version}")
+    return {
+        "user_id": user_id,
+        "latitude": lat,
+        "longitude": lon,
+        "timestamp": datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).isoformat(),
+    }
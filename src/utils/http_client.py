@@ -0,0 +1,174 @@
+# src/utils/http_client.py
+"""
+Client HTTP condiviso con connection pooling, deadline e retry.
+
+Un'unica istanza di `PooledHTTPClient` va creata all'avvio del servizio e
+riusata da tutti i worker: le connessioni keep-alive vengono riutilizzate
+invece di aprire una connessione TCP per ogni chiamata.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Stati HTTP per cui ha senso ritentare
+RETRYABLE_STATUS = {502, 503, 504}
+
+HTTP_CLIENT_REQUESTS = Counter(
+    "http_client_requests_total",
+    "Richieste HTTP in uscita per esito",
+    ["client", "outcome"],
+)
+HTTP_CLIENT_RETRIES = Counter(
+    "http_client_retries_total",
+    "Tentativi ripetuti dopo un errore transitorio",
+    ["client"],
+)
+HTTP_CLIENT_LATENCY = Histogram(
+    "http_client_request_seconds",
+    "Durata delle richieste HTTP in uscita (inclusi i retry)",
+    ["client"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+HTTP_CLIENT_IN_FLIGHT = Gauge(
+    "http_client_requests_in_flight",
+    "Richieste HTTP in corso",
+    ["client"],
+)
+HTTP_CLIENT_POOL_CONNECTIONS = Gauge(
+    "http_client_pool_connections",
+    "Connessioni nel pool per stato",
+    ["client", "state"],
+)
+
+
+class PooledHTTPClient:
+    """Wrapper di `httpx.AsyncClient` con pool limitato, retry con jitter e metriche."""
+
+    def __init__(
+        self,
+        name: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        http2: bool = False
+    ):
+        """
+        Inizializza il client.
+
+        Args:
+            name: Nome del client, usato come label delle metriche
+            max_connections: Connessioni massime aperte verso l'host
+            max_keepalive_connections: Connessioni inattive mantenute nel pool
+            keepalive_expiry: Secondi dopo cui una connessione inattiva viene chiusa
+            timeout: Timeout del singolo tentativo in secondi
+            retries: Numero di tentativi aggiuntivi dopo un errore transitorio
+            backoff: Base in secondi del backoff esponenziale con jitter
+            http2: Abilita HTTP/2 (richiede il pacchetto `h2`)
+        """
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2,
+        )
+        self._client = httpx.AsyncClient(transport=self._transport, timeout=timeout)
+
+        HTTP_CLIENT_POOL_CONNECTIONS.labels(name, "idle").set_function(
+            lambda: self.pool_stats()["idle"]
+        )
+        HTTP_CLIENT_POOL_CONNECTIONS.labels(name, "active").set_function(
+            lambda: self.pool_stats()["active"]
+        )
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Restituisce il numero di connessioni attive e inattive nel pool.
+
+        httpx non espone lo stato del pool: i conteggi vengono dagli interni
+        di httpcore e valgono 0 se questi cambiano in un'altra versione.
+        """
+        try:
+            connections = list(self._transport._pool.connections)
+            idle = sum(1 for c in connections if c.is_idle())
+        except Exception:
+            return {"total": 0, "idle": 0, "active": 0}
+        return {"total": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def _sleep_time(self, attempt: int) -> float:
+        """Backoff esponenziale con full jitter."""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def post_json(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        deadline: Optional[float] = None
+    ) -> httpx.Response:
+        """
+        Invia una POST JSON con retry sugli errori transitori.
+
+        Args:
+            url: URL di destinazione
+            payload: Corpo JSON
+            deadline: Tempo massimo in secondi per l'intera chiamata, retry inclusi
+
+        Returns:
+            httpx.Response: Risposta dell'ultimo tentativo
+
+        Raises:
+            httpx.HTTPError: Se tutti i tentativi falliscono o la deadline scade
+        """
+        start = time.monotonic()
+        budget = deadline if deadline is not None else self.timeout * (self.retries + 1)
+
+        HTTP_CLIENT_IN_FLIGHT.labels(self.name).inc()
+        try:
+            attempt = 0
+            while True:
+                remaining = budget - (time.monotonic() - start)
+                if remaining <= 0:
+                    HTTP_CLIENT_REQUESTS.labels(self.name, "deadline").inc()
+                    raise httpx.TimeoutException(f"Deadline di {budget:.1f}s superata per {url}")
+
+                try:
+                    response = await self._client.post(
+                        url, json=payload, timeout=min(self.timeout, remaining)
+                    )
+                    if response.status_code not in RETRYABLE_STATUS or attempt >= self.retries:
+                        outcome = "ok" if response.status_code < 400 else "http_error"
+                        HTTP_CLIENT_REQUESTS.labels(self.name, outcome).inc()
+                        return response
+                    logger.warning("%s: risposta %d da %s, ritento", self.name, response.status_code, url)
+                except httpx.TransportError as e:
+                    if attempt >= self.retries:
+                        HTTP_CLIENT_REQUESTS.labels(self.name, "transport_error").inc()
+                        raise
+                    logger.warning("%s: errore di trasporto verso %s (%s), ritento", self.name, url, e)
+
+                attempt += 1
+                HTTP_CLIENT_RETRIES.labels(self.name).inc()
+                await asyncio.sleep(min(self._sleep_time(attempt), max(budget - (time.monotonic() - start), 0)))
+        finally:
+            HTTP_CLIENT_IN_FLIGHT.labels(self.name).dec()
+            HTTP_CLIENT_LATENCY.labels(self.name).observe(time.monotonic() - start)
+
+    async def aclose(self) -> None:
+        """Chiude il client e tutte le connessioni del pool."""
+        await self._client.aclose()
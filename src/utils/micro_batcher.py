@@ -0,0 +1,109 @@
+# src/utils/micro_batcher.py
+"""
+Raggruppamento di richieste singole in micro-batch.
+
+I chiamanti attendono il proprio risultato con `submit()` come se la
+chiamata fosse singola; il batcher accumula gli elementi per al massimo
+`max_delay` secondi (o finché non sono `max_items`) e li invia insieme con
+un'unica chiamata a `send`, ad esempio una POST a /generate/batch.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+MICRO_BATCH_SIZE = Histogram(
+    "micro_batch_size",
+    "Elementi inviati in ogni micro-batch",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+class MicroBatcher:
+    """Accumula elementi e li invia a blocchi, restituendo a ciascun chiamante il suo risultato."""
+
+    def __init__(
+        self,
+        send: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_items: int = 32,
+        max_delay: float = 0.02,
+        name: str = "batch"
+    ):
+        """
+        Inizializza il batcher.
+
+        Args:
+            send: Coroutine che elabora una lista di elementi e restituisce i risultati nello stesso ordine
+            max_items: Elementi oltre i quali il batch parte subito
+            max_delay: Attesa massima in secondi del primo elemento prima dell'invio
+            name: Nome usato nelle metriche
+        """
+        self.send = send
+        self.max_items = max(1, max_items)
+        self.max_delay = max_delay
+        self.name = name
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Accoda un elemento e ne attende il risultato.
+
+        Args:
+            item: Elemento da inviare nel prossimo batch
+
+        Returns:
+            Any: Risultato corrispondente restituito da `send`
+
+        Raises:
+            Exception: L'errore sollevato da `send` per il batch dell'elemento
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Avvia l'invio degli elementi accodati."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Invia un batch e distribuisce risultati o errore ai chiamanti."""
+        MICRO_BATCH_SIZE.labels(self.name).observe(len(batch))
+        try:
+            results = await self.send([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name}: {len(results)} risultati per {len(batch)} elementi")
+        except Exception as e:
+            logger.error("%s: invio batch di %d elementi fallito: %s", self.name, len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # Il chiamante può aver rinunciato (cancellazione, timeout)
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Invia gli elementi ancora in coda e attende i batch in corso."""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,72 @@
+# src/utils/shop_activity.py
+"""
+Aggregato di attività di un negozio in una finestra temporale.
+
+Usato come valore delle tabelle a finestre Faust: conta le visite
+(eventi di prossimità) e stima i visitatori unici con HyperLogLog,
+quindi occupa memoria limitata anche per i negozi più frequentati.
+"""
+import struct
+from datetime import datetime, timezone
+from typing import Any, Tuple
+
+from src.utils.hyperloglog import HyperLogLog
+
+_HEADER = struct.Struct("<I")  # visite
+
+SHOP_ACTIVITY_INSERT = """
+    INSERT INTO shop_activity_windows
+    (shop_id, window_start, window_end, window_size_s, visits, unique_visitors)
+    VALUES
+"""
+
+
+class ShopWindow:
+    """Visite e visitatori unici di un negozio in una finestra."""
+
+    __slots__ = ("visits", "visitors")
+
+    def __init__(self, visits: int = 0, visitors: HyperLogLog = None):
+        self.visits = visits
+        self.visitors = visitors if visitors is not None else HyperLogLog()
+
+    def add_visit(self, user_id: int) -> None:
+        """Registra la visita di un utente."""
+        self.visits += 1
+        self.visitors.add(user_id)
+
+    @property
+    def unique_visitors(self) -> int:
+        """Stima dei visitatori distinti."""
+        return self.visitors.count()
+
+    def encode(self) -> bytes:
+        return _HEADER.pack(self.visits) + self.visitors.encode()
+
+    @classmethod
+    def decode(cls, data: bytes) -> "ShopWindow":
+        (visits,) = _HEADER.unpack_from(data)
+        return cls(visits, HyperLogLog.decode(data[_HEADER.size:]))
+
+
+def window_row(key: Tuple[Any, Tuple[float, float]], window: ShopWindow, size_s: int) -> tuple:
+    """
+    Converte una finestra chiusa di Faust in una riga di shop_activity_windows.
+
+    Args:
+        key: Chiave Faust (shop_id, (inizio, fine)) con estremi in epoch secondi
+        window: Aggregato della finestra
+        size_s: Durata della finestra in secondi
+
+    Returns:
+        tuple: Riga nell'ordine delle colonne di SHOP_ACTIVITY_INSERT
+    """
+    shop_id, (start, _) = key
+    # Faust chiude la finestra a start + size - 0.1: la fine esportata è start + size.
+    # clickhouse_driver vuole DateTime naive in UTC
+    window_start = datetime.fromtimestamp(start, tz=timezone.utc).replace(tzinfo=None)
+    window_end = datetime.fromtimestamp(start + size_s, tz=timezone.utc).replace(tzinfo=None)
+    return (
+        int(shop_id), window_start, window_end, size_s,
+        window.visits, window.unique_visitors,
+    )
@@ -0,0 +1,408 @@
+# src/utils/user_state.py
+"""
+Stato compatto di un utente per la tabella Faust `user_states`.
+
+Rispetto al vecchio record JSON:
+- le ultime posizioni stanno in un ring a capacità fissa su array
+  tipizzati, aggiornato in place senza copiare liste a ogni evento;
+- i timestamp sono interi epoch (ms per le posizioni, s per i cooldown);
+- i cooldown delle notifiche scaduti vengono rimossi a ogni controllo,
+  quindi la mappa negozio -> ultima notifica resta limitata;
+- la serializzazione è binaria a layout fisso, così ogni scrittura nel
+  changelog costa poche centinaia di byte al massimo.
+
+Il decoder accetta anche i record JSON del formato precedente, ancora
+presenti nei changelog esistenti.
+"""
+import json
+import struct
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+MAGIC = b"US"
+VERSION = 1
+DEFAULT_CAPACITY = 10
+
+# magic, versione, user_id, ultima lat/lon, ultimo timestamp (ms), distanza totale,
+# negozi visitati, notifiche ricevute, capacità ring, punti nel ring, cooldown attivi
+_HEADER = struct.Struct("<2sBqddqdIIBBH")
+# lat, lon (float32, ~0.5 m di risoluzione) e timestamp in ms
+_POSITION = struct.Struct("<ffq")
+# shop_id e istante dell'ultima notifica in secondi epoch
+_COOLDOWN = struct.Struct("<iI")
+
+
+def _to_ms(ts: datetime) -> int:
+    """Converte un datetime (naive = UTC) in epoch millis."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+
+def _from_ms(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+class UserState:
+    """
+    Stato corrente dell'utente con storia recente limitata.
+
+    Il ring delle posizioni tiene gli ultimi `capacity` punti; i cooldown
+    sono una mappa shop_id -> epoch in secondi dell'ultima notifica.
+    """
+
+    __slots__ = (
+        "user_id", "last_latitude", "last_longitude", "last_seen_ms",
+        "total_distance", "shops_visited", "notifications_received",
+        "capacity", "_lats", "_lons", "_times", "_head", "_count", "cooldowns",
+    )
+
+    def __init__(
+        self,
+        user_id: int,
+        last_latitude: float = 0.0,
+        last_longitude: float = 0.0,
+        last_seen_ms: int = 0,
+        total_distance: float = 0.0,
+        shops_visited: int = 0,
+        notifications_received: int = 0,
+        capacity: int = DEFAULT_CAPACITY
+    ):
+        """
+        Inizializza uno stato vuoto.
+
+        Args:
+            user_id: ID utente
+            last_latitude: Ultima latitudine nota
+            last_longitude: Ultima longitudine nota
+            last_seen_ms: Istante dell'ultima posizione in epoch millis
+            total_distance: Distanza percorsa in metri
+            shops_visited: Negozi visitati
+            notifications_received: Notifiche ricevute
+            capacity: Numero di posizioni recenti conservate (max 255)
+        """
+        if not 0 < capacity < 256:
+            raise ValueError(f"Capacità del ring non valida: {capacity}")
+        self.user_id = user_id
+        self.last_latitude = last_latitude
+        self.last_longitude = last_longitude
+        self.last_seen_ms = last_seen_ms
+        self.total_distance = total_distance
+        self.shops_visited = shops_visited
+        self.notifications_received = notifications_received
+        self.capacity = capacity
+        self._lats = array("f", bytes(4 * capacity))
+        self._lons = array("f", bytes(4 * capacity))
+        self._times = array("q", bytes(8 * capacity))
+        self._head = 0  # prossima cella da scrivere
+        self._count = 0
+        self.cooldowns: Dict[int, int] = {}
+
+    def __repr__(self) -> str:
+        return (
+            f"UserState(user_id={self.user_id}, positions={self._count}, "
+            f"cooldowns={len(self.cooldowns)}, total_distance={self.total_distance:.0f})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, UserState) and self.encode() == other.encode()
+
+    @property
+    def last_seen(self) -> Optional[datetime]:
+        """Istante dell'ultima posizione (UTC), None se non ce ne sono."""
+        return _from_ms(self.last_seen_ms) if self.last_seen_ms else None
+
+    # --- Posizioni -------------------------------------------------------
+
+    def add_position(self, latitude: float, longitude: float, timestamp: datetime) -> None:
+        """
+        Registra una nuova posizione, sovrascrivendo la più vecchia se il ring è pieno.
+
+        Args:
+            latitude: Latitudine
+            longitude: Longitudine
+            timestamp: Istante della posizione
+        """
+        ts_ms = _to_ms(timestamp)
+        self._lats[self._head] = latitude
+        self._lons[self._head] = longitude
+        self._times[self._head] = ts_ms
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+        self.last_latitude = latitude
+        self.last_longitude = longitude
+        self.last_seen_ms = ts_ms
+
+    def _positions(self):
+        """Indici del ring dal punto più vecchio al più recente."""
+        start = (self._head - self._count) % self.capacity
+        return ((start + i) % self.capacity for i in range(self._count))
+
+    @property
+    def recent_positions(self) -> List[Dict[str, Any]]:
+        """Posizioni recenti dalla più vecchia, nel formato del record storico."""
+        return [
+            {
+                "lat": self._lats[i],
+                "lon": self._lons[i],
+                "timestamp": _from_ms(self._times[i]).isoformat(),
+            }
+            for i in self._positions()
+        ]
+
+    # --- Cooldown notifiche -----------------------------------------------
+
+    def evict_cooldowns(self, now: datetime, cooldown_s: float) -> int:
+        """
+        Rimuove i cooldown scaduti.
+
+        Args:
+            now: Istante di riferimento
+            cooldown_s: Durata del cooldown in secondi
+
+        Returns:
+            int: Numero di voci rimosse
+        """
+        threshold = _to_ms(now) // 1000 - cooldown_s
+        expired = [shop_id for shop_id, ts in self.cooldowns.items() if ts <= threshold]
+        for shop_id in expired:
+            del self.cooldowns[shop_id]
+        return len(expired)
+
+    def in_cooldown(self, shop_id: int, now: datetime, cooldown_s: float) -> bool:
+        """
+        Indica se il negozio ha già notificato l'utente negli ultimi `cooldown_s` secondi.
+
+        Prima del controllo rimuove tutti i cooldown scaduti.
+
+        Args:
+            shop_id: ID negozio
+            now: Istante dell'evento
+            cooldown_s: Durata del cooldown in secondi
+
+        Returns:
+            bool: True se la notifica va saltata
+        """
+        self.evict_cooldowns(now, cooldown_s)
+        return shop_id in self.cooldowns
+
+    def mark_notified(self, shop_id: int, now: datetime) -> None:
+        """Avvia il cooldown del negozio dall'istante indicato."""
+        self.cooldowns[shop_id] = _to_ms(now) // 1000
+
+    def clear_notified(self, shop_id: int) -> None:
+        """Annulla il cooldown del negozio (es. notifica non inviata)."""
+        self.cooldowns.pop(shop_id, None)
+
+    # --- Serializzazione ---------------------------------------------------
+
+    def encode(self) -> bytes:
+        """
+        Serializza lo stato nel formato binario.
+
+        Returns:
+            bytes: Header, posizioni dalla più vecchia e cooldown attivi
+        """
+        parts = [_HEADER.pack(
+            MAGIC, VERSION, self.user_id,
+            self.last_latitude, self.last_longitude, self.last_seen_ms,
+            self.total_distance, self.shops_visited, self.notifications_received,
+            self.capacity, self._count, len(self.cooldowns)
+        )]
+        for i in self._positions():
+            parts.append(_POSITION.pack(self._lats[i], self._lons[i], self._times[i]))
+        for shop_id, ts in self.cooldowns.items():
+            parts.append(_COOLDOWN.pack(shop_id, ts))
+        return b"".join(parts)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "UserState":
+        """
+        Deserializza uno stato in formato binario o nel vecchio formato JSON.
+
+        Args:
+            data: Payload del changelog
+
+        Returns:
+            UserState: Stato ricostruito
+
+        Raises:
+            ValueError: Se il payload binario ha una versione sconosciuta
+        """
+        if data[:2] != MAGIC:
+            return cls.from_legacy(json.loads(data))
+
+        (_, version, user_id, lat, lon, last_seen_ms, total_distance,
+         shops_visited, notifications, capacity, count, cooldowns) = _HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Versione dello stato utente non supportata: {version}")
+
+        state = cls(user_id, lat, lon, last_seen_ms, total_distance, shops_visited, notifications, capacity)
+        offset = _HEADER.size
+        for _ in range(count):
+            p_lat, p_lon, p_ts = _POSITION.unpack_from(data, offset)
+            offset += _POSITION.size
+            state._lats[state._head] = p_lat
+            state._lons[state._head] = p_lon
+            state._times[state._head] = p_ts
+            state._head = (state._head + 1) % capacity
+        state._count = count
+        for _ in range(cooldowns):
+            shop_id, ts = _COOLDOWN.unpack_from(data, offset)
+            offset += _COOLDOWN.size
+            state.cooldowns[shop_id] = ts
+        return state
+
+    @classmethod
+    def from_legacy(cls, record: Dict[str, Any], capacity: int = DEFAULT_CAPACITY) -> "UserState":
+        """
+        Converte un record JSON del vecchio `faust.Record` UserState.
+
+        Args:
+            record: Campi del record (timestamp ISO, chiavi dei cooldown come stringhe)
+            capacity: Capacità del ring
+
+        Returns:
+            UserState: Stato equivalente
+        """
+        state = cls(
+            record["user_id"],
+            total_distance=record.get("total_distance", 0.0),
+            shops_visited=record.get("shops_visited", 0),
+            notifications_received=record.get("notifications_received", 0),
+            capacity=capacity,
+        )
+        for position in record.get("recent_positions") or []:
+            state.add_position(position["lat"], position["lon"], datetime.fromisoformat(position["timestamp"]))
+        # L'ultima posizione nota prevale su quella del ring
+        state.last_latitude = record["last_latitude"]
+        state.last_longitude = record["last_longitude"]
+        state.last_seen_ms = _to_ms(datetime.fromisoformat(record["last_seen"]))
+        for shop_id, ts in (record.get("recent_notifications") or {}).items():
+            state.mark_notified(int(shop_id), datetime.fromisoformat(ts))
+        return state
+
+
+# --- Aggiornamenti a batch ---------------------------------------------------
+# Gli eventi sono qualsiasi oggetto con gli attributi usati (user_id,
+# latitude, longitude, timestamp, shop_id): gli agent Faust passano i propri
+# record, i test semplici namespace.
+
+
+def apply_location_batch(
+    events: Iterable[Any],
+    get_state: Callable[[int], Optional[UserState]],
+    paired_distances: Callable[[Sequence[float], Sequence[float], Sequence[float], Sequence[float]], Any],
+    capacity: int = DEFAULT_CAPACITY
+) -> Dict[int, UserState]:
+    """
+    Applica un batch di posizioni allo stato degli utenti.
+
+    Lo stato è letto una volta per utente e le distanze percorse sono
+    calcolate con una sola chiamata su tutte le coppie di posizioni
+    consecutive del batch.
+
+    Args:
+        events: Eventi di posizione nell'ordine di arrivo
+        get_state: Lettura dello stato corrente (None se l'utente è nuovo)
+        paired_distances: Distanze in metri tra coppie (es. haversine_paired)
+        capacity: Capacità del ring per gli stati nuovi
+
+    Returns:
+        Dict[int, UserState]: Stati aggiornati da scrivere, per utente
+    """
+    by_user: Dict[int, List[Any]] = {}
+    for event in events:
+        by_user.setdefault(event.user_id, []).append(event)
+
+    states = {}
+    prev_lats, prev_lons, cur_lats, cur_lons = [], [], [], []
+    for user_id, user_events in by_user.items():
+        first = user_events[0]
+        state = get_state(user_id)
+        if state is None:
+            state = UserState(
+                user_id,
+                last_latitude=first.latitude,
+                last_longitude=first.longitude,
+                capacity=capacity
+            )
+        states[user_id] = state
+        lat, lon = state.last_latitude, state.last_longitude
+        for event in user_events:
+            prev_lats.append(lat)
+            prev_lons.append(lon)
+            cur_lats.append(event.latitude)
+            cur_lons.append(event.longitude)
+            lat, lon = event.latitude, event.longitude
+
+    if not states:
+        return states
+    distances = paired_distances(prev_lats, prev_lons, cur_lats, cur_lons)
+
+    offset = 0
+    for user_id, user_events in by_user.items():
+        state = states[user_id]
+        traveled = float(sum(distances[offset:offset + len(user_events)]))
+        offset += len(user_events)
+
+        for event in user_events:
+            state.add_position(event.latitude, event.longitude, event.timestamp)
+        state.total_distance += traveled
+    return states
+
+
+def filter_cooldown(
+    events: Iterable[Any],
+    get_state: Callable[[int], Optional[UserState]],
+    cooldown_s: float
+) -> List[Any]:
+    """
+    Seleziona gli eventi di prossimità da notificare.
+
+    Scarta gli utenti senza stato e i negozi in cooldown; due eventi dello
+    stesso batch per la stessa coppia utente/negozio contano come duplicati.
+    Lo stato viene solo letto: il cooldown parte quando la notifica è
+    stata davvero inviata (vedi `record_notifications`).
+
+    Args:
+        events: Eventi di prossimità del batch
+        get_state: Lettura dello stato corrente
+        cooldown_s: Durata del cooldown in secondi
+
+    Returns:
+        List: Eventi candidati, nell'ordine di arrivo
+    """
+    states: Dict[int, Optional[UserState]] = {}
+    seen = set()
+    candidates = []
+    for event in events:
+        if event.user_id not in states:
+            states[event.user_id] = get_state(event.user_id)
+        state = states[event.user_id]
+        if state is None:
+            continue
+        key = (event.user_id, event.shop_id)
+        if key in seen or state.in_cooldown(event.shop_id, event.timestamp, cooldown_s):
+            continue
+        seen.add(key)
+        candidates.append(event)
+    return candidates
+
+
+def record_notifications(state: UserState, sent: Iterable[Any]) -> None:
+    """
+    Registra sullo stato le notifiche inviate.
+
+    Va applicata a uno stato appena riletto, così da non sovrascrivere le
+    posizioni arrivate mentre i messaggi venivano generati.
+
+    Args:
+        state: Stato corrente dell'utente
+        sent: Eventi di prossimità notificati
+    """
+    for event in sent:
+        state.mark_notified(event.shop_id, event.timestamp)
+        state.notifications_received += 1
@@ -5,7 +5,7 @@ Contiene fixture condivise tra i diversi livelli di test.
 import os
 import pytest
 import asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 # Imposta l'ambiente di test
 os.environ["ENVIRONMENT"] = "test"
@@ -21,6 +21,16 @@ def mock_clickhouse_client():
     client.execute.return_value = []
     return client
 
+# Fixture per client ClickHouse asincrono mock
+@pytest.fixture
+def mock_async_clickhouse_client():
+    """Restituisce un mock di AsyncClickHouseClient per i test."""
+    client = MagicMock()
+    client.query = AsyncMock(return_value=[])
+    client.insert = AsyncMock(return_value=None)
+    client.close = AsyncMock()
+    return client
+
 # Fixture per client Kafka mock
 @pytest.fixture
 def mock_kafka_producer():
@@ -86,7 +86,7 @@ async def test_producer_to_consumer_flow():
             
             # Mock per postgres e clickhouse
             with patch("asyncpg.create_pool") as mock_pg_pool, \
-                 patch("src.data_pipeline.consumer.CHClient") as mock_ch:
+                 patch("src.data_pipeline.consumer.get_async_clickhouse") as mock_ch:
                 
                 # Configura postgres mock
                 pg_pool = AsyncMock()
@@ -100,7 +100,9 @@ async def test_producer_to_consumer_flow():
                 
                 # Configura clickhouse mock
                 ch_client = MagicMock()
-                ch_client.execute.return_value = None
+                ch_client.query = AsyncMock(return_value=[])
+                ch_client.insert = AsyncMock(return_value=None)
+                ch_client.close = AsyncMock()
                 mock_ch.return_value = ch_client
                 
                 # Mock per get_personalized_message
@@ -118,7 +120,7 @@ async def test_producer_to_consumer_flow():
                         consumer_task.cancel()
                         
                         # Verifica che clickhouse sia stato chiamato per salvare l'evento
-                        ch_client.execute.assert_called()
+                        ch_client.insert.assert_called()
                         
                         # Verifica che postgres sia stato interrogato per trovare il negozio più vicino
                         pg_pool.fetchrow.assert_called()
\ No newline at end of file
@@ -1,28 +1,32 @@
 """
 Test unitari per il consumer Kafka.
 """
+import asyncio
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 import json
 from datetime import datetime
 
 # Importa il modulo da testare
-from src.data_pipeline.consumer import get_user_profile, get_shop_category, get_personalized_message
+from src.data_pipeline.consumer import (
+    get_user_profile, get_shop_category, get_personalized_message, OffsetTracker, FlushOnRevoke, worker
+)
+from src.cache.profile_cache import UserProfileCache
 
 @pytest.mark.unit
 class TestConsumerFunctions:
     
     @pytest.mark.asyncio
-    async def test_get_user_profile(self, mock_clickhouse_client):
+    async def test_get_user_profile(self, mock_async_clickhouse_client):
         """Testa la funzione get_user_profile."""
         # Setup del mock
         user_id = 1
-        mock_clickhouse_client.execute.return_value = [
+        mock_async_clickhouse_client.query.return_value = [
             (1, 30, "Ingegnere", "tecnologia, viaggi")
         ]
         
         # Esecuzione
-        result = await get_user_profile(mock_clickhouse_client, user_id)
+        result = await get_user_profile(mock_async_clickhouse_client, user_id)
         
         # Verifica
         assert result is not None
@@ -32,7 +36,7 @@ class TestConsumerFunctions:
         assert result["interests"] == "tecnologia, viaggi"
         
         # Verifica chiamata al client
-        mock_clickhouse_client.execute.assert_called_once()
+        mock_async_clickhouse_client.query.assert_awaited_once()
     
     @pytest.mark.asyncio
     async def test_get_shop_category(self):
@@ -65,25 +69,114 @@ class TestConsumerFunctions:
             "description": "Negozio a 50m di distanza"
         }
         
-        # Mock di httpx.AsyncClient
-        with patch("httpx.AsyncClient") as mock_client:
-            # Configura il comportamento del mock
-            mock_response = MagicMock()
-            mock_response.status_code = 200
-            mock_response.json.return_value = {
-                "message": "Ciao Ingegnere! Ti meriti una pausa al Caffè Milano!",
-                "cached": False
-            }
-            
-            mock_client_instance = AsyncMock()
-            mock_client_instance.post.return_value = mock_response
-            mock_client.return_value.__aenter__.return_value = mock_client_instance
-            
-            # Esecuzione
-            result = await get_personalized_message(user_data, poi_data)
-            
-            # Verifica
-            assert result == "Ciao Ingegnere! Ti meriti una pausa al Caffè Milano!"
-            
-            # Verifica chiamata API
-            mock_client_instance.post.assert_called_once()
\ No newline at end of file
+        # Mock del client HTTP condiviso
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "message": "Ciao Ingegnere! Ti meriti una pausa al Caffè Milano!",
+            "cached": False
+        }
+
+        mock_http_client = AsyncMock()
+        mock_http_client.post_json.return_value = mock_response
+
+        # Esecuzione
+        result = await get_personalized_message(mock_http_client, user_data, poi_data)
+
+        # Verifica
+        assert result == "Ciao Ingegnere! Ti meriti una pausa al Caffè Milano!"
+
+        # Verifica chiamata API
+        mock_http_client.post_json.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_profile_error_still_writes_event(self):
+        """Testa che un errore ClickHouse sul profilo non faccia perdere l'evento."""
+        # Setup: negozio vicino, profilo non recuperabile
+        msg = MagicMock(topic="user-events", partition=0, offset=42, value={
+            "user_id": 1, "latitude": 45.46, "longitude": 9.19,
+            "timestamp": "2024-01-01T12:00:00+00:00",
+        })
+        queue = asyncio.Queue()
+        queue.put_nowait(msg)
+        tracker = MagicMock()
+        writer = AsyncMock()
+        messages = AsyncMock()
+        profiles = UserProfileCache(
+            AsyncMock(side_effect=ConnectionError("ClickHouse non raggiungibile")),
+            AsyncMock(return_value=[])
+        )
+        shop = {"shop_name": "CafeTest", "category": "bar", "distance": 20.0}
+
+        # Esecuzione
+        with patch("src.data_pipeline.consumer.find_nearest_shop", AsyncMock(return_value=shop)):
+            task = asyncio.create_task(worker(queue, tracker, writer, None, profiles, None, messages))
+            await queue.join()
+            task.cancel()
+
+        # Verifica: riga scritta senza messaggio, nessun errore in cache
+        writer.add.assert_awaited_once()
+        row = writer.add.await_args.args[0]
+        assert row[0] == 42 and row[6] == "CafeTest" and row[7] == ""
+        tracker.done.assert_not_called()
+        messages.submit.assert_not_awaited()
+        assert 1 not in profiles.entries
+
+
+@pytest.mark.unit
+class TestOffsetTracker:
+
+    def test_out_of_order_completion(self):
+        """Testa che il commit non superi i messaggi ancora in elaborazione."""
+        # Setup
+        tracker = OffsetTracker()
+        for offset in (5, 6, 7):
+            tracker.add("tp0", offset)
+
+        # Esecuzione: il messaggio 6 termina prima del 5
+        tracker.done("tp0", 6)
+
+        # Verifica
+        assert tracker.committable() == {"tp0": 5}
+
+        tracker.done("tp0", 5)
+        assert tracker.committable() == {"tp0": 7}
+
+        tracker.done("tp0", 7)
+        assert tracker.committable() == {"tp0": 8}
+
+    def test_revoked_partitions_are_not_committed(self):
+        """Testa che dopo una revoca la partizione non venga più committata."""
+        # Setup
+        tracker = OffsetTracker()
+        tracker.add("tp0", 5)
+        tracker.add("tp1", 9)
+        tracker.done("tp0", 5)
+        tracker.done("tp1", 9)
+
+        # Esecuzione: tp1 passa a un altro membro mentre il messaggio 10 è in elaborazione
+        tracker.add("tp1", 10)
+        tracker.revoke(["tp1"])
+        tracker.done("tp1", 10)
+
+        # Verifica
+        assert tracker.committable() == {"tp0": 6}
+        assert tracker.committable(assigned={"tp1"}) == {}
+
+    @pytest.mark.asyncio
+    async def test_listener_flushes_before_revoke(self):
+        """Testa che il listener scriva il buffer prima di dimenticare le partizioni."""
+        # Setup
+        tracker = OffsetTracker()
+        tracker.add("tp0", 1)
+        tracker.done("tp0", 1)
+        seen_by_flush = []
+        writer = AsyncMock()
+        writer.flush.side_effect = lambda: seen_by_flush.append(tracker.committable()) or True
+
+        # Esecuzione
+        await FlushOnRevoke(writer, tracker).on_partitions_revoked({"tp0"})
+
+        # Verifica: il commit durante il flush vede ancora la partizione
+        assert seen_by_flush == [{"tp0": 2}]
+        assert tracker.committable() == {}
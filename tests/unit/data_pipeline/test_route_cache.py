@@ -0,0 +1,99 @@
+"""
+Test unitari per la cache e il pool dei percorsi del simulatore.
+"""
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from src.data_pipeline.route_cache import RouteProvider, synthetic_route, save_routes_file
+from src.utils.geo import haversine_m
+
+OSRM_COORDS = [[9.18, 45.46], [9.185, 45.465], [9.19, 45.47]]
+
+
+@pytest.mark.unit
+class TestRouteProvider:
+
+    def test_synthetic_route(self):
+        """Testa il percorso in linea retta tra due punti."""
+        coords = synthetic_route(9.18, 45.46, 9.19, 45.47, step_m=100)
+
+        assert coords[0] == [9.18, 45.46]
+        assert coords[-1] == pytest.approx([9.19, 45.47])
+        step = haversine_m(coords[0][1], coords[0][0], coords[1][1], coords[1][0])
+        assert 50 < step <= 100
+
+    @pytest.mark.asyncio
+    async def test_cache_hit_on_same_cells(self, tmp_path):
+        """Testa che punti nella stessa coppia di celle riusino il percorso e che la cache persista."""
+        path = str(tmp_path / "routes.json")
+        provider = RouteProvider(cache_path=path, cell_m=500)
+
+        with patch("src.data_pipeline.route_cache.fetch_osrm_route", AsyncMock(return_value=OSRM_COORDS)) as osrm:
+            first = await provider.get_route(9.1801, 45.4601, 9.2501, 45.4801)
+            second = await provider.get_route(9.1802, 45.4602, 9.2502, 45.4802)
+
+        assert osrm.await_count == 1
+        assert first == second == [{"lon": lon, "lat": lat} for lon, lat in OSRM_COORDS]
+        assert provider.stats["hits"] == 1
+
+        await provider.aclose()
+        reloaded = RouteProvider(cache_path=path, cell_m=500)
+        assert len(reloaded.cache) == 1
+        await reloaded.aclose()
+
+    @pytest.mark.asyncio
+    async def test_synthetic_fallback(self):
+        """Testa il fallback in linea retta quando OSRM non risponde."""
+        provider = RouteProvider(cell_m=500)
+
+        with patch("src.data_pipeline.route_cache.fetch_osrm_route", AsyncMock(side_effect=OSError("down"))):
+            route = await provider.get_route(9.15, 45.42, 9.25, 45.48)
+
+        assert len(route) > 2
+        assert provider.stats["synthetic"] == 1
+        assert len(provider.cache) == 0
+        await provider.aclose()
+
+    @pytest.mark.asyncio
+    async def test_pool_skips_osrm(self, tmp_path):
+        """Testa che con un pool caricato non si interroghi OSRM."""
+        path = str(tmp_path / "pool.json")
+        save_routes_file(path, {"0,0,1,1": OSRM_COORDS}, 250)
+        provider = RouteProvider(pool_path=path)
+
+        with patch("src.data_pipeline.route_cache.fetch_osrm_route", AsyncMock()) as osrm:
+            route = await provider.random_route()
+
+        osrm.assert_not_awaited()
+        assert route[0] == {"lon": 9.18, "lat": 45.46}
+        await provider.aclose()
+
+    @pytest.mark.asyncio
+    async def test_cache_with_other_cell_size_is_discarded(self, tmp_path):
+        """Testa che una cache salvata con un altro lato di cella non venga riusata."""
+        path = str(tmp_path / "routes.json")
+        save_routes_file(path, {"0,0,1,1": OSRM_COORDS}, 250)
+
+        same = RouteProvider(cache_path=path, cell_m=250)
+        other = RouteProvider(cache_path=path, cell_m=500)
+
+        assert len(same.cache) == 1
+        assert other.cache == {}
+        await same.aclose()
+        await other.aclose()
+
+    @pytest.mark.asyncio
+    async def test_save_runs_in_thread_on_snapshot(self, tmp_path):
+        """Testa che il salvataggio avvenga fuori dall'event loop su una copia della cache."""
+        path = str(tmp_path / "routes.json")
+        provider = RouteProvider(cache_path=path, cell_m=500)
+        provider._store("0,0,1,1", OSRM_COORDS)
+
+        with patch("src.data_pipeline.route_cache.asyncio.to_thread", AsyncMock()) as to_thread:
+            await provider.save()
+
+        _, saved_path, routes, cell_m = to_thread.await_args.args
+        assert (saved_path, cell_m) == (path, 500)
+        assert routes == provider.cache and routes is not provider.cache
+        assert not provider._dirty
+        await provider._client.aclose()
@@ -0,0 +1,93 @@
+"""
+Test unitari per lo scheduler a tick del simulatore.
+"""
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.data_pipeline.tick_engine import TickEngine
+
+
+def make_producer():
+    """Producer fittizio: send() restituisce un future già consegnato."""
+    producer = MagicMock()
+
+    async def send(topic, value=None, key=None, headers=None):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+
+    producer.send = AsyncMock(side_effect=send)
+    return producer
+
+
+ROUTE = [{"lon": 9.18, "lat": 45.46}, {"lon": 9.19, "lat": 45.47}]
+USERS = [(i, 30, "Ingegnere", "tecnologia") for i in range(10)]
+
+
+@pytest.mark.unit
+class TestTickEngine:
+
+    def make_engine(self, producer, **kwargs):
+        engine = TickEngine(producer, "gps_stream", USERS, AsyncMock(return_value=ROUTE), **kwargs)
+        # Assegna subito i percorsi senza avviare i fetcher
+        for user in engine.users:
+            user.route = list(ROUTE)
+            engine.active.append(user)
+        return engine
+
+    @pytest.mark.asyncio
+    async def test_tick_respects_target_eps(self):
+        """Testa che un tick non emetta più punti del budget."""
+        producer = make_producer()
+        engine = self.make_engine(producer, target_eps=40, tick_interval=0.1)
+
+        emitted = await engine.tick(now=0.0)
+
+        assert emitted == 4
+        assert producer.send.await_count == 4
+        topic = producer.send.await_args.args[0]
+        kwargs = producer.send.await_args.kwargs
+        assert topic == "gps_stream"
+        assert kwargs["key"] == b"3"
+        assert json.loads(kwargs["value"])["user_id"] == 3
+        assert kwargs["headers"] == [("nearyou-encoding", b"json")]
+
+    @pytest.mark.asyncio
+    async def test_point_interval_and_route_end(self):
+        """Testa l'intervallo minimo per utente e il passaggio ai fetcher a fine percorso."""
+        producer = make_producer()
+        engine = self.make_engine(producer, target_eps=1000, tick_interval=0.1, point_interval=2.0)
+
+        assert await engine.tick(now=0.0) == 10
+        # Nessun utente è ancora scaduto
+        assert await engine.tick(now=1.0) == 0
+        # Secondo e ultimo punto del percorso
+        assert await engine.tick(now=2.0) == 10
+
+        assert len(engine.active) == 0
+        assert engine.needs_route.qsize() == 20  # 10 iniziali + 10 a fine percorso
+        assert engine.stats["sent"] == 20
+
+    @pytest.mark.asyncio
+    async def test_delivery_errors_summary(self):
+        """Testa il conteggio degli errori di consegna nei callback."""
+        producer = MagicMock()
+
+        async def send(topic, value=None, key=None, headers=None):
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(TimeoutError("ack timeout"))
+            return future
+
+        producer.send = AsyncMock(side_effect=send)
+        engine = self.make_engine(producer, target_eps=20, tick_interval=0.1)
+        previous = dict(engine.stats)
+
+        await engine.tick(now=0.0)
+        await asyncio.sleep(0)  # esegue i callback di consegna
+
+        assert engine.stats["sent"] == 2
+        assert engine.stats["delivered"] == 0
+        assert engine.error_types == {"TimeoutError": 2}
+        assert "TimeoutError=2" in engine.stats_summary(previous, 1.0)
@@ -3,7 +3,7 @@ Test unitari per le API della dashboard.
 """
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 # Importa il modulo da testare
 from services.dashboard.main_user import app
@@ -21,7 +21,7 @@ class TestDashboardAPI:
     def test_login_success(self, mock_ch):
         """Testa il login con credenziali valide."""
         # Setup del mock
-        mock_ch.execute.return_value = [(1, "password123")]
+        mock_ch.query = AsyncMock(return_value=[(1, "password123")])
         
         # Esecuzione
         response = self.client.post(
@@ -38,7 +38,7 @@ class TestDashboardAPI:
     def test_login_invalid_credentials(self, mock_ch):
         """Testa il login con credenziali non valide."""
         # Setup del mock
-        mock_ch.execute.return_value = [(1, "password123")]
+        mock_ch.query = AsyncMock(return_value=[(1, "password123")])
         
         # Esecuzione
         response = self.client.post(
@@ -67,7 +67,7 @@ class TestDashboardAPI:
         mock_get_current_user.return_value = {"user_id": 1}
         
         ch_instance = MagicMock()
-        ch_instance.execute.return_value = [(1, 30, "Ingegnere", "tecnologia, viaggi")]
+        ch_instance.query = AsyncMock(return_value=[(1, 30, "Ingegnere", "tecnologia, viaggi")])
         mock_ch_client.return_value.__enter__.return_value = ch_instance
         
         # Esecuzione
@@ -1,11 +1,20 @@
 """
 Test unitari per il servizio di generazione messaggi.
 """
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from services.message_generator.services.generator_service import MessageGeneratorService
 from services.message_generator.models.message import UserProfile, PointOfInterest
+from services.message_generator import cache_utils
+from services.message_generator.cache_utils import CachedMessage
+
+# PromptTemplate valida le variabili: il template deve usarle tutte
+TEST_PROMPT = (
+    "Test prompt {age} {profession} {interests} "
+    "{name} {category} {description}"
+)
 
 
 @pytest.mark.unit
@@ -15,7 +24,7 @@ class TestMessageGeneratorService:
         """Testa l'inizializzazione del service."""
         # Setup
         llm_client = MagicMock()
-        prompt_template = "Test prompt {age}"
+        prompt_template = TEST_PROMPT
         
         # Esecuzione
         service = MessageGeneratorService(llm_client, prompt_template)
@@ -24,53 +33,396 @@ class TestMessageGeneratorService:
         assert service.llm_client == llm_client
         assert "Test prompt" in service.prompt_template.template
     
+    @pytest.mark.asyncio
     @patch("services.message_generator.services.generator_service.cache_utils")
-    def test_generate_message_cache_hit(self, mock_cache_utils):
+    async def test_generate_message_cache_hit(self, mock_cache_utils):
         """Testa la generazione di messaggi con cache hit."""
         # Setup
         llm_client = MagicMock()
-        prompt_template = "Test prompt"
+        prompt_template = TEST_PROMPT
         service = MessageGeneratorService(llm_client, prompt_template)
         
         user_params = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
         poi_params = {"name": "CafeTest", "category": "bar", "description": ""}
         
         # Configura il mock per simulare un cache hit
-        mock_cache_utils.get_cached_message.return_value = "Messaggio dalla cache"
+        mock_cache_utils.FRESH = cache_utils.FRESH
+        mock_cache_utils.generate_cache_key.return_value = "key"
+        mock_cache_utils.lookup_message.return_value = CachedMessage("Messaggio dalla cache", cache_utils.FRESH)
         
         # Esecuzione
-        message, is_cached = service.generate_message(user_params, poi_params)
+        message, is_cached, is_fallback = await service.generate_message(user_params, poi_params)
         
         # Verifica
         assert message == "Messaggio dalla cache"
         assert is_cached is True
-        mock_cache_utils.get_cached_message.assert_called_once_with(user_params, poi_params)
-        # Verifica che _call_llm non sia stato chiamato
-        llm_client.assert_not_called()
+        assert is_fallback is False
+        mock_cache_utils.lookup_message.assert_called_once_with("key")
+        # Verifica che il LLM non sia stato chiamato
+        llm_client.apredict_messages.assert_not_called()
     
+    @pytest.mark.asyncio
     @patch("services.message_generator.services.generator_service.cache_utils")
-    def test_generate_message_cache_miss(self, mock_cache_utils):
+    async def test_generate_message_cache_miss(self, mock_cache_utils):
         """Testa la generazione di messaggi con cache miss."""
         # Setup
         llm_client = MagicMock()
         llm_client.return_value.content = "Messaggio generato dal LLM"
-        prompt_template = "Test prompt {age}"
+        prompt_template = TEST_PROMPT
         service = MessageGeneratorService(llm_client, prompt_template)
         
         user_params = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
         poi_params = {"name": "CafeTest", "category": "bar", "description": ""}
         
         # Configura il mock per simulare un cache miss
-        mock_cache_utils.get_cached_message.return_value = None
+        mock_cache_utils.generate_cache_key.return_value = "key"
+        mock_cache_utils.lookup_message.return_value = None
+        mock_cache_utils.acquire_generation_lock.return_value = "token"
         
         # Patch del metodo _call_llm
-        with patch.object(service, '_call_llm', return_value="Messaggio generato dal LLM") as mock_call_llm:
+        with patch.object(service, '_call_llm', AsyncMock(return_value="Messaggio generato dal LLM")) as mock_call_llm:
             # Esecuzione
-            message, is_cached = service.generate_message(user_params, poi_params)
+            message, is_cached, is_fallback = await service.generate_message(user_params, poi_params)
             
             # Verifica
             assert message == "Messaggio generato dal LLM"
             assert is_cached is False
-            mock_cache_utils.get_cached_message.assert_called_once_with(user_params, poi_params)
-            mock_call_llm.assert_called_once_with(user_params, poi_params)
-            mock_cache_utils.cache_message.assert_called_once_with(user_params, poi_params, "Messaggio generato dal LLM")
\ No newline at end of file
+            assert is_fallback is False
+            mock_cache_utils.lookup_message.assert_called_once_with("key")
+            mock_call_llm.assert_awaited_once_with(user_params, poi_params)
+            mock_cache_utils.store_message.assert_called_once()
+            mock_cache_utils.release_generation_lock.assert_called_once_with("key", "token")
+    
+    @pytest.mark.asyncio
+    @patch("services.message_generator.services.generator_service.cache_utils")
+    async def test_generate_batch_dedupes_and_reads_cache_once(self, mock_cache_utils):
+        """Testa che il batch legga la cache una volta e generi solo le miss distinte."""
+        # Setup
+        service = MessageGeneratorService.__new__(MessageGeneratorService)
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        bar = {"name": "CafeTest", "category": "bar", "description": ""}
+        shop = {"name": "ShopTest", "category": "abbigliamento", "description": ""}
+        
+        mock_cache_utils.generate_cache_key.side_effect = lambda u, p: p["name"]
+        mock_cache_utils.FRESH = cache_utils.FRESH
+        mock_cache_utils.lookup_messages.return_value = {
+            "CafeTest": CachedMessage("Messaggio dalla cache", cache_utils.FRESH)
+        }
+        mock_cache_utils.acquire_generation_lock.return_value = "token"
+        
+        with patch.object(service, '_call_llm', AsyncMock(return_value="Messaggio generato")) as mock_call_llm:
+            # Esecuzione
+            results = await service.generate_batch([(user, shop), (user, bar), (user, shop)])
+        
+        # Verifica
+        assert results == [
+            ("Messaggio generato", False, False),
+            ("Messaggio dalla cache", True, False),
+            ("Messaggio generato", True, False),
+        ]
+        mock_cache_utils.lookup_messages.assert_called_once_with(["ShopTest", "CafeTest"])
+        mock_call_llm.assert_awaited_once_with(user, shop)
+        assert mock_cache_utils.store_message.call_args[0][:3] == ("ShopTest", shop, "Messaggio generato")
+    
+    @pytest.mark.asyncio
+    async def test_call_llm_timeout_uses_fallback(self):
+        """Testa che una chiamata LLM oltre il timeout restituisca il fallback segnalandolo."""
+        # Setup
+        async def slow_llm(messages):
+            await asyncio.sleep(1)
+        
+        llm_client = MagicMock()
+        llm_client.apredict_messages = slow_llm
+        service = MessageGeneratorService.__new__(MessageGeneratorService)
+        service.llm_client = llm_client
+        service.prompt_template = MagicMock()
+        service.semaphore = asyncio.Semaphore(1)
+        service.timeout = 0.01
+        
+        # Esecuzione
+        message, _, generated = await service._timed_call_llm({"age": 30}, {"name": "CafeTest", "category": "bar"})
+        
+        # Verifica
+        assert message == "CafeTest è a pochi passi! Che ne dici di un ottimo caffè?"
+        assert generated is False
+
+
+@pytest.mark.unit
+class TestCacheStampede:
+    
+    @staticmethod
+    def _service(llm_result="Messaggio generato", delay=0.05):
+        async def slow_llm(user_params, poi_params):
+            await asyncio.sleep(delay)
+            return llm_result
+        
+        service = MessageGeneratorService.__new__(MessageGeneratorService)
+        service._refreshes = set()
+        service._call_llm = AsyncMock(side_effect=slow_llm)
+        return service
+    
+    def test_should_refresh_early(self):
+        """Testa che XFetch anticipi il refresh solo vicino alla scadenza."""
+        # Setup
+        now = 1000.0
+        
+        # Esecuzione e verifica
+        with patch("services.message_generator.cache_utils.random.random", return_value=0.5):
+            # -ln(0.5) * 2s ≈ 1.4s di anticipo
+            assert cache_utils.should_refresh_early(2.0, now + 60, now=now) is False
+            assert cache_utils.should_refresh_early(2.0, now + 1, now=now) is True
+            assert cache_utils.should_refresh_early(2.0, now - 1, now=now) is True
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_call_llm_once(self):
+        """Testa che richieste concorrenti sulla stessa chiave mancante generino una sola volta."""
+        # Setup
+        from src.cache.memory_cache import MemoryCache
+        service = self._service()
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", MemoryCache()), \
+             patch.object(cache_utils, "CACHE_ENABLED", True), \
+             patch.dict(cache_utils.cache_stats, {"llm_calls_avoided": 0}):
+            # Esecuzione
+            results = await asyncio.gather(*(service.generate_message(user, poi) for _ in range(5)))
+            avoided = cache_utils.cache_stats["llm_calls_avoided"]
+        
+        # Verifica
+        assert {message for message, _, _ in results} == {"Messaggio generato"}
+        assert sorted(cached for _, cached, _ in results) == [False, True, True, True, True]
+        service._call_llm.assert_awaited_once()
+        assert avoided == 4
+    
+    @pytest.mark.asyncio
+    async def test_stale_message_served_while_refreshing(self):
+        """Testa che un messaggio scaduto venga servito e rigenerato una sola volta in background."""
+        # Setup
+        from src.cache.memory_cache import MemoryCache
+        service = self._service(llm_result="Messaggio nuovo")
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", MemoryCache()), \
+             patch.object(cache_utils, "CACHE_ENABLED", True):
+            key = cache_utils.generate_cache_key(user, poi)
+            cache_utils.cache.set(key, {"message": "Messaggio vecchio", "delta": 1.0, "expires_at": 0})
+            
+            # Esecuzione
+            first = await asyncio.gather(*(service.generate_message(user, poi) for _ in range(3)))
+            await asyncio.gather(*service._refreshes)
+            after = await service.generate_message(user, poi)
+        
+        # Verifica
+        assert first == [("Messaggio vecchio", True, False)] * 3
+        assert after == ("Messaggio nuovo", True, False)
+        service._call_llm.assert_awaited_once()
+
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_cached_message(self):
+        """Testa che un errore del LLM durante il refresh non sostituisca il messaggio con il fallback."""
+        # Setup
+        from src.cache.memory_cache import MemoryCache
+        service = self._service()
+        service._call_llm = AsyncMock(side_effect=RuntimeError("Timeout LLM"))
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", MemoryCache()), \
+             patch.object(cache_utils, "CACHE_ENABLED", True):
+            key = cache_utils.generate_cache_key(user, poi)
+            cache_utils.cache.set(key, {"message": "Messaggio vero", "delta": 1.0, "expires_at": 0})
+            
+            # Esecuzione
+            first = await service.generate_message(user, poi)
+            await asyncio.gather(*service._refreshes)
+            stored = cache_utils.cache.get(key)
+        
+        # Verifica
+        assert first == ("Messaggio vero", True, False)
+        assert stored["message"] == "Messaggio vero"
+        service._call_llm.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_fallback_is_reported_on_miss_and_hit(self):
+        """Testa che il fallback del LLM sia segnalato sia alla generazione sia quando letto dalla cache."""
+        # Setup
+        from src.cache.memory_cache import MemoryCache
+        service = self._service()
+        service._call_llm = AsyncMock(side_effect=RuntimeError("Errore LLM"))
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", MemoryCache()), \
+             patch.object(cache_utils, "CACHE_ENABLED", True):
+            # Esecuzione
+            generated = await service.generate_message(user, poi)
+            cached = await service.generate_message(user, poi)
+            batch = await service.generate_batch([(user, poi)])
+        
+        # Verifica
+        fallback = "CafeTest è a pochi passi! Che ne dici di un ottimo caffè?"
+        assert generated == (fallback, False, True)
+        assert cached == (fallback, True, True)
+        assert batch == [(fallback, True, True)]
+    
+    @pytest.mark.asyncio
+    async def test_lock_backend_error_generates_without_waiting(self):
+        """Testa che un errore del backend dei lock non faccia attendere la richiesta."""
+        # Setup
+        service = self._service(delay=0)
+        lock_backend = MagicMock()
+        lock_backend.get.return_value = None
+        lock_backend.acquire_lock.side_effect = ConnectionError("Redis non disponibile")
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", lock_backend), \
+             patch.object(cache_utils, "CACHE_ENABLED", True), \
+             patch.object(service, "_wait_for_message", AsyncMock()) as mock_wait:
+            # Esecuzione
+            result = await service.generate_message(user, poi)
+        
+        # Verifica
+        assert result == ("Messaggio generato", False, False)
+        mock_wait.assert_not_awaited()
+        lock_backend.release_lock.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_redis_calls_run_outside_event_loop(self):
+        """Testa che letture, lock e scritture sulla cache non blocchino il thread dell'event loop."""
+        import threading
+        from src.cache.memory_cache import MemoryCache
+        
+        # Setup
+        service = self._service(delay=0)
+        backend = MemoryCache()
+        threads = []
+        
+        def tracked(method):
+            def call(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return method(*args, **kwargs)
+            return call
+        
+        for name in ("get", "set", "acquire_lock", "release_lock"):
+            setattr(backend, name, tracked(getattr(backend, name)))
+        user = {"age": 30, "profession": "Ingegnere", "interests": "tech"}
+        poi = {"name": "CafeTest", "category": "bar", "description": ""}
+        
+        with patch.object(cache_utils, "cache", backend), \
+             patch.object(cache_utils, "CACHE_ENABLED", True):
+            # Esecuzione
+            result = await service.generate_message(user, poi)
+        
+        # Verifica
+        assert result == ("Messaggio generato", False, False)
+        assert len(threads) >= 4
+        assert threading.get_ident() not in threads
+
+
+@pytest.mark.unit
+class TestGeneratorRuntime:
+    
+    @pytest.mark.asyncio
+    async def test_reload_only_on_config_change(self, tmp_path):
+        """Testa che il service condiviso venga ricostruito solo se la configurazione cambia."""
+        from services.message_generator.api import dependencies
+        
+        # Setup
+        config = tmp_path / "llm.json"
+        config.write_text('{"model": "model-a"}')
+        runtime = dependencies.GeneratorRuntime()
+        
+        with patch.object(dependencies, "API_KEY", "test-key"), \
+             patch.object(dependencies, "LLM_CONFIG_PATH", str(config)), \
+             patch.object(dependencies, "MessageGeneratorService") as mock_service:
+            # Esecuzione
+            await runtime.reload(force=True)
+            unchanged = await runtime.reload()
+            config.write_text('{"model": "model-b"}')
+            changed = await runtime.reload()
+        
+        # Verifica
+        assert unchanged is False
+        assert changed is True
+        assert mock_service.call_count == 2
+        assert runtime.settings["model"] == "model-b"
+    
+    @pytest.mark.asyncio
+    async def test_reload_resizes_connection_pool(self, tmp_path):
+        """Testa che il pool HTTP segua max_concurrency ricaricato e che la vecchia sessione venga chiusa."""
+        from services.message_generator.api import dependencies
+        
+        # Setup
+        config = tmp_path / "llm.json"
+        config.write_text('{"max_concurrency": 4}')
+        runtime = dependencies.GeneratorRuntime()
+        
+        with patch.object(dependencies, "API_KEY", "test-key"), \
+             patch.object(dependencies, "LLM_CONFIG_PATH", str(config)), \
+             patch.object(dependencies, "MessageGeneratorService"):
+            # Esecuzione
+            await runtime.start()
+            first = runtime.http_session
+            first_limit = first.connector.limit
+            config.write_text('{"max_concurrency": 10}')
+            await runtime.reload()
+            second = runtime.http_session
+            second_limit = second.connector.limit
+            first_closed_before_stop = first.closed
+            await runtime.stop()
+        
+        # Verifica
+        assert first_limit == 8
+        assert second_limit == 20
+        # Le chiamate in corso possono ancora usare la sessione precedente
+        assert first_closed_before_stop is False
+        assert first.closed and second.closed
+
+
+@pytest.mark.unit
+class TestAdminReload:
+    
+    @pytest.mark.asyncio
+    async def test_reload_rejected_without_configured_token(self):
+        """Testa che /admin/reload rifiuti le chiamate se il token non è configurato."""
+        from fastapi import HTTPException
+        from services.message_generator.api import routes
+        
+        # Setup
+        with patch.object(routes, "ADMIN_TOKEN", None), \
+             patch.object(routes, "runtime") as mock_runtime:
+            mock_runtime.reload = AsyncMock()
+            
+            # Esecuzione
+            with pytest.raises(HTTPException) as exc_info:
+                await routes.reload_config(x_admin_token=None)
+        
+        # Verifica
+        assert exc_info.value.status_code == 403
+        mock_runtime.reload.assert_not_awaited()
+    
+    @pytest.mark.asyncio
+    async def test_reload_with_valid_token(self):
+        """Testa che /admin/reload ricarichi la configurazione con il token corretto."""
+        from fastapi import HTTPException
+        from services.message_generator.api import routes
+        
+        # Setup
+        with patch.object(routes, "ADMIN_TOKEN", "secret"), \
+             patch.object(routes, "runtime") as mock_runtime:
+            mock_runtime.reload = AsyncMock()
+            mock_runtime.settings = {"provider": "openai", "model": "model-a"}
+            
+            # Esecuzione
+            with pytest.raises(HTTPException) as exc_info:
+                await routes.reload_config(x_admin_token="wrong")
+            result = await routes.reload_config(x_admin_token="secret")
+        
+        # Verifica
+        assert exc_info.value.status_code == 403
+        assert result == {"reloaded": True, "provider": "openai", "model": "model-a"}
+        mock_runtime.reload.assert_awaited_once_with(force=True)
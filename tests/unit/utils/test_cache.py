@@ -1,12 +1,17 @@
 """
 Test unitari per il sistema di cache.
 """
+import asyncio
 import pytest
 import time
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from src.cache.memory_cache import MemoryCache
 from src.cache.redis_cache import RedisCache
+from src.cache.profile_cache import UserProfileCache, get_user_profile
+from src.cache.single_flight import SingleFlightCache
+from src.cache.tiered_cache import TieredCache
+from src.cache.message_keys import generate_cache_key
 
 @pytest.mark.unit
 class TestMemoryCache:
@@ -124,4 +129,186 @@ class TestRedisCache:
         # Verifica
         assert result == "test_value"
         mock_redis_instance.setex.assert_called_once_with("test_key", 86400, b'"test_value"')
-        mock_redis_instance.get.assert_called_once_with("test_key")
\ No newline at end of file
+        mock_redis_instance.get.assert_called_once_with("test_key")
+
+
+@pytest.mark.unit
+class TestUserProfileCache:
+
+    @pytest.mark.asyncio
+    async def test_preload_and_negative_entries(self):
+        """Testa precaricamento in blocco e caching degli utenti inesistenti."""
+        # Setup
+        profile = {"user_id": 1, "age": 30, "profession": "Ingegnere", "interests": "tech"}
+        fetch_one = AsyncMock(return_value=None)
+        fetch_all = AsyncMock(return_value=[profile])
+        cache = UserProfileCache(fetch_one, fetch_all)
+
+        # Esecuzione
+        await cache.refresh()
+
+        # Verifica: utente precaricato senza query singola
+        assert await cache.get(1) == profile
+        fetch_one.assert_not_awaited()
+
+        # Utente sconosciuto: una sola query, poi voce negativa
+        assert await cache.get(99) is None
+        assert await cache.get(99) is None
+        fetch_one.assert_awaited_once_with(99)
+        assert cache.info()["negative_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lru_bound(self):
+        """Testa lo scarto delle voci meno usate oltre il limite."""
+        # Setup
+        fetch_one = AsyncMock(side_effect=lambda uid: {"user_id": uid})
+        cache = UserProfileCache(fetch_one, AsyncMock(return_value=[]), max_entries=2)
+
+        # Esecuzione
+        await cache.get(1)
+        await cache.get(2)
+        await cache.get(1)  # 1 diventa la voce più recente
+        await cache.get(3)  # scarta 2
+
+        # Verifica
+        assert len(cache) == 2
+        assert 2 not in cache.entries
+        assert 1 in cache.entries and 3 in cache.entries
+
+    @pytest.mark.asyncio
+    async def test_fetch_error_is_not_cached(self):
+        """Testa che un errore della query non diventi una voce negativa."""
+        # Setup: la prima query fallisce, la seconda trova il profilo
+        ch_client = MagicMock()
+        ch_client.query = AsyncMock(side_effect=[
+            ConnectionError("ClickHouse non raggiungibile"),
+            [(7, 30, "Ingegnere", "tech")],
+        ])
+        cache = UserProfileCache(
+            lambda user_id: get_user_profile(ch_client, user_id), AsyncMock(return_value=[])
+        )
+
+        # Esecuzione / Verifica
+        with pytest.raises(ConnectionError):
+            await cache.get(7)
+        assert 7 not in cache.entries
+
+        profile = await cache.get(7)
+        assert profile["profession"] == "Ingegnere"
+        assert ch_client.query.await_count == 2
+
+
+@pytest.mark.unit
+class TestSingleFlightCache:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_call(self):
+        """Testa che richieste concorrenti con la stessa chiave facciano una sola chiamata."""
+        # Setup
+        release = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return "messaggio"
+
+        cache = SingleFlightCache(ttl=60)
+
+        # Esecuzione
+        tasks = [asyncio.create_task(cache.get_or_compute("k", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        # Verifica
+        assert len(calls) == 1
+        assert [shared for _, shared in results].count(False) == 1
+        assert all(value == "messaggio" for value, _ in results)
+        assert cache.info()["coalesced"] == 4
+
+        # Richiesta successiva servita dalla cache locale
+        assert await cache.get_or_compute("k", compute) == ("messaggio", True)
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_errors_are_not_cached(self):
+        """Testa che errori e risultati non memorizzabili non restino in cache."""
+        # Setup
+        compute = AsyncMock(side_effect=[Exception("503"), "", "ok"])
+        cache = SingleFlightCache(ttl=60, cacheable=bool)
+
+        # Esecuzione / Verifica
+        with pytest.raises(Exception):
+            await cache.get_or_compute("k", compute)
+        assert await cache.get_or_compute("k", compute) == ("", False)
+        assert await cache.get_or_compute("k", compute) == ("ok", False)
+        assert len(cache) == 1
+
+    def test_message_key_normalization(self):
+        """Testa che profili simili producano la stessa chiave."""
+        poi = {"name": "Bar Roma", "category": "bar", "description": "a 50m"}
+        key_a = generate_cache_key({"age": 31, "profession": "Ingegnere", "interests": "sport, cibo"}, poi)
+        key_b = generate_cache_key({"age": 34, "profession": "ingegnere", "interests": "Cibo,sport"}, poi)
+
+        assert key_a == key_b
+        assert key_a != generate_cache_key({"age": 36, "profession": "ingegnere", "interests": "sport,cibo"}, poi)
+
+
+@pytest.mark.unit
+class TestTieredCache:
+    
+    def test_hot_key_served_from_l1(self):
+        """Testa che dopo la prima lettura la chiave arrivi dalla L1 senza toccare L2."""
+        # Setup
+        l2 = MagicMock()
+        l2.get.return_value = "messaggio"
+        cache = TieredCache(l2, channel=None)
+        
+        # Esecuzione
+        first = cache.get("key")
+        second = cache.get("key")
+        
+        # Verifica
+        assert first == second == "messaggio"
+        l2.get.assert_called_once_with("key")
+        assert cache.tier_stats() == {
+            "l1": {"hits": 1, "misses": 1, "hit_rate": 0.5},
+            "l2": {"hits": 1, "misses": 0, "hit_rate": 1.0},
+        }
+    
+    def test_get_many_reads_only_l1_misses_from_l2(self):
+        """Testa che get_many chieda a L2 solo le chiavi assenti in L1."""
+        # Setup
+        l2 = MemoryCache()
+        l2.set("warm", "b")
+        cache = TieredCache(l2, channel=None)
+        cache.set("hot", "a")
+        
+        # Esecuzione
+        with patch.object(l2, "get_many", wraps=l2.get_many) as l2_get_many:
+            result = cache.get_many(["hot", "warm", "cold"])
+        
+        # Verifica
+        assert result == {"hot": "a", "warm": "b"}
+        l2_get_many.assert_called_once_with(["warm", "cold"])
+    
+    def test_invalidation_from_other_process_drops_l1_entry(self):
+        """Testa che un messaggio pub/sub di un altro processo tolga la chiave dalla L1."""
+        # Setup
+        l2 = MagicMock()
+        cache = TieredCache(l2, channel="test:invalidate")
+        handler = l2.subscribe.call_args[0][1]
+        cache.set("key", "vecchio")
+        l2.get.return_value = "nuovo"
+        
+        # Esecuzione
+        handler(f"{cache.instance_id}:key")  # messaggio proprio: ignorato
+        own = cache.get("key")
+        handler("altro-processo:key")
+        other = cache.get("key")
+        
+        # Verifica
+        assert own == "vecchio"
+        assert other == "nuovo"
+        l2.publish.assert_called_once_with("test:invalidate", f"{cache.instance_id}:key")
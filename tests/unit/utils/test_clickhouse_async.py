@@ -0,0 +1,129 @@
+"""
+Test unitari per il client ClickHouse asincrono.
+"""
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.utils import clickhouse_async
+from src.utils.clickhouse_async import AsyncClickHouseClient, get_async_clickhouse
+
+
+@pytest.fixture
+def ch_client_class():
+    """Sostituisce clickhouse_driver.Client con mock distinti per ogni istanza."""
+    with patch("src.utils.clickhouse_async.CHClient", side_effect=lambda **kwargs: MagicMock()) as cls:
+        yield cls
+
+
+@pytest.mark.unit
+class TestAsyncClickHouseClient:
+
+    @pytest.mark.asyncio
+    async def test_query_runs_in_executor(self, ch_client_class):
+        """Testa che la query giri in un thread del pool con il timeout come impostazione."""
+        # Setup
+        threads = []
+        ch = AsyncClickHouseClient(pool_size=2, timeout=5)
+
+        def execute(sql, params=None, settings=None):
+            threads.append(threading.current_thread().name)
+            return [(1,)]
+
+        for client in list(ch._clients._queue):
+            client.execute.side_effect = execute
+
+        # Esecuzione
+        rows = await ch.query("SELECT 1", name="test")
+
+        # Verifica
+        assert rows == [(1,)]
+        assert threads[0].startswith("clickhouse")
+        assert threads[0] != threading.current_thread().name
+        await ch.close()
+
+    @pytest.mark.asyncio
+    async def test_sub_second_timeout_is_not_unlimited(self, ch_client_class):
+        """Testa che un timeout sotto il secondo non diventi max_execution_time=0."""
+        # Setup
+        ch = AsyncClickHouseClient(pool_size=1, timeout=5)
+        client = ch._clients._queue[0]
+        client.execute.return_value = []
+
+        # Esecuzione
+        await ch.query("SELECT 1", timeout=0.3)
+        await ch.query("SELECT 1", timeout=2.5)
+        await ch.query("SELECT 1")
+
+        # Verifica
+        limits = [c.kwargs["settings"]["max_execution_time"] for c in client.execute.call_args_list]
+        assert limits == [1, 3, 5]
+        await ch.close()
+
+    @pytest.mark.asyncio
+    async def test_pool_limits_concurrent_queries(self, ch_client_class):
+        """Testa che ogni client serva una query alla volta."""
+        # Setup
+        lock = threading.Lock()
+        running = [0, 0]  # correnti, massimo
+        ch = AsyncClickHouseClient(pool_size=2, timeout=5)
+
+        def execute(sql, params=None, settings=None):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            threading.Event().wait(0.02)
+            with lock:
+                running[0] -= 1
+            return []
+
+        for client in list(ch._clients._queue):
+            client.execute.side_effect = execute
+
+        # Esecuzione
+        await asyncio.gather(*(ch.query("SELECT 1") for _ in range(6)))
+
+        # Verifica
+        assert running[1] == 2
+        assert ch._clients.qsize() == 2
+        await ch.close()
+
+    @pytest.mark.asyncio
+    async def test_timeout_returns_client_only_when_thread_finishes(self, ch_client_class):
+        """Testa che dopo un timeout il client torni nel pool solo a query terminata."""
+        # Setup
+        release = threading.Event()
+        ch = AsyncClickHouseClient(pool_size=1, timeout=5)
+        ch._clients._queue[0].execute.side_effect = lambda *args, **kwargs: release.wait(5)
+
+        # Esecuzione
+        with pytest.raises(asyncio.TimeoutError):
+            await ch.query("SELECT sleep(3)", timeout=0.05)
+
+        # Verifica: il thread usa ancora il client, che non può essere riassegnato
+        assert ch._clients.empty()
+        release.set()
+        for _ in range(100):
+            if not ch._clients.empty():
+                break
+            await asyncio.sleep(0.01)
+        assert ch._clients.qsize() == 1
+        await ch.close()
+
+    @pytest.mark.asyncio
+    async def test_close_resets_shared_client(self, ch_client_class):
+        """Testa che dopo close() il client condiviso venga ricreato."""
+        # Setup
+        with patch.object(clickhouse_async, "_default_client", None):
+            first = get_async_clickhouse()
+
+            # Esecuzione
+            await first.close()
+            second = get_async_clickhouse()
+
+            # Verifica
+            assert second is not first
+            assert get_async_clickhouse() is second
+            await second.close()
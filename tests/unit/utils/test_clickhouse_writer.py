@@ -0,0 +1,126 @@
+"""
+Test unitari per il writer ClickHouse a micro-batch.
+"""
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+
+from src.utils.clickhouse_writer import ClickHouseBatchWriter
+
+
+@pytest.mark.unit
+class TestClickHouseBatchWriter:
+
+    @pytest.mark.asyncio
+    async def test_flush_on_size(self, mock_async_clickhouse_client):
+        """Testa il flush automatico al raggiungimento della dimensione massima."""
+        # Setup
+        on_flushed = AsyncMock()
+        writer = ClickHouseBatchWriter(
+            mock_async_clickhouse_client, "INSERT INTO t VALUES", max_rows=2, on_flushed=on_flushed
+        )
+
+        # Esecuzione
+        await writer.add((1, "a"), meta=10)
+        mock_async_clickhouse_client.insert.assert_not_awaited()
+        await writer.add((2, "b"), meta=11)
+
+        # Verifica
+        mock_async_clickhouse_client.insert.assert_awaited_once_with(
+            "INSERT INTO t VALUES", [(1, "a"), (2, "b")], name="batch_insert"
+        )
+        on_flushed.assert_awaited_once_with([10, 11])
+        assert len(writer) == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_rows(self, mock_async_clickhouse_client):
+        """Testa che un flush fallito non perda righe né esegua il callback."""
+        # Setup
+        on_flushed = AsyncMock()
+        mock_async_clickhouse_client.insert.side_effect = Exception("too many parts")
+        writer = ClickHouseBatchWriter(
+            mock_async_clickhouse_client, "INSERT INTO t VALUES", max_rows=100, on_flushed=on_flushed
+        )
+        await writer.add((1, "a"), meta=10)
+
+        # Esecuzione
+        assert await writer.flush() is False
+
+        # Verifica
+        assert len(writer) == 1
+        on_flushed.assert_not_awaited()
+
+        # Il tentativo successivo scrive le righe rimaste
+        mock_async_clickhouse_client.insert.side_effect = None
+        assert await writer.stop() is True
+        on_flushed.assert_awaited_once_with([10])
+        assert len(writer) == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_retries_with_backoff(self, mock_async_clickhouse_client):
+        """Testa che un errore transitorio venga ritentato nello stesso flush."""
+        # Setup
+        mock_async_clickhouse_client.insert.side_effect = [Exception("timeout"), 1]
+        writer = ClickHouseBatchWriter(
+            mock_async_clickhouse_client, "INSERT INTO t VALUES", max_rows=100, retries=2, backoff=0
+        )
+        await writer.add((1, "a"))
+
+        # Esecuzione
+        assert await writer.flush() is True
+
+        # Verifica
+        assert mock_async_clickhouse_client.insert.await_count == 2
+        assert len(writer) == 0
+
+    @pytest.mark.asyncio
+    async def test_backpressure_when_buffer_full(self, mock_async_clickhouse_client):
+        """Testa che add() attenda un flush riuscito quando il buffer è pieno."""
+        # Setup: i primi flush falliscono, il buffer si riempie
+        mock_async_clickhouse_client.insert.side_effect = [Exception("down"), Exception("down"), 2, 1]
+        writer = ClickHouseBatchWriter(
+            mock_async_clickhouse_client, "INSERT INTO t VALUES",
+            max_rows=1, max_buffer=2, backoff=0
+        )
+        await writer.add((1, "a"))
+        await writer.add((2, "b"))
+        assert len(writer) == 2
+
+        # Esecuzione: la terza riga entra solo dopo che il buffer è stato scritto
+        await writer.add((3, "c"))
+
+        # Verifica
+        assert mock_async_clickhouse_client.insert.await_args_list[2].args[1] == [(1, "a"), (2, "b")]
+        assert mock_async_clickhouse_client.insert.await_args_list[3].args[1] == [(3, "c")]
+        assert len(writer) == 0
+
+    @pytest.mark.asyncio
+    async def test_callbacks_are_serialized(self, mock_async_clickhouse_client):
+        """Testa che la callback di un flush finisca prima che parta il flush successivo."""
+        # Setup: la prima callback resta sospesa finché non viene rilasciata
+        release = asyncio.Event()
+        events = []
+
+        async def on_flushed(metas):
+            events.append(("start", metas))
+            if metas == [1]:
+                await release.wait()
+            events.append(("end", metas))
+
+        writer = ClickHouseBatchWriter(
+            mock_async_clickhouse_client, "INSERT INTO t VALUES", max_rows=10, on_flushed=on_flushed
+        )
+        await writer.add((1, "a"), meta=1)
+        first = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        await writer.add((2, "b"), meta=2)
+        second = asyncio.create_task(writer.flush())
+
+        # Esecuzione
+        await asyncio.sleep(0.01)
+        assert mock_async_clickhouse_client.insert.await_count == 1
+        release.set()
+        await asyncio.gather(first, second)
+
+        # Verifica
+        assert events == [("start", [1]), ("end", [1]), ("start", [2]), ("end", [2])]
@@ -0,0 +1,237 @@
+"""
+Test unitari per le utility geografiche.
+"""
+import math
+import random
+import pytest
+
+from src.utils.geo import (
+    EARTH_RADIUS_M, METERS_PER_DEG_LAT, haversine_m, haversine_many, haversine_paired, haversine_within, ShopGridIndex,
+    group_rows_by_position, nearby_shops_batch
+)
+
+
+def _random_shops(n, seed=42):
+    rnd = random.Random(seed)
+    return [
+        {
+            "shop_id": i,
+            "shop_name": f"Negozio {i}",
+            "category": "bar",
+            "lat": rnd.uniform(45.40, 45.50),
+            "lon": rnd.uniform(9.10, 9.30),
+        }
+        for i in range(n)
+    ]
+
+
+def _destination(lat, lon, bearing_deg, distance_m):
+    """Punto a `distance_m` metri da (lat, lon) nella direzione indicata, sulla sfera della haversine."""
+    d = distance_m / EARTH_RADIUS_M
+    b = math.radians(bearing_deg)
+    p = math.radians(lat)
+    lat2 = math.asin(math.sin(p) * math.cos(d) + math.cos(p) * math.sin(d) * math.cos(b))
+    lon2 = math.radians(lon) + math.atan2(
+        math.sin(b) * math.sin(d) * math.cos(p), math.cos(d) - math.sin(p) * math.sin(lat2)
+    )
+    return math.degrees(lat2), math.degrees(lon2)
+
+
+@pytest.mark.unit
+class TestShopGridIndex:
+
+    def test_haversine(self):
+        """Testa la distanza haversine su una coppia nota."""
+        # Duomo -> Castello Sforzesco, circa 1.1 km
+        distance = haversine_m(45.4642, 9.1900, 45.4705, 9.1793)
+        assert 1000 < distance < 1200
+
+    def test_empty_index(self):
+        """Testa il comportamento con indice vuoto."""
+        index = ShopGridIndex([])
+
+        assert len(index) == 0
+        assert index.nearest(45.46, 9.19) is None
+        assert index.within(45.46, 9.19, 200) == []
+
+    def test_nearest_matches_linear_scan(self):
+        """Testa che il negozio più vicino coincida con la scansione completa."""
+        shops = _random_shops(500)
+        index = ShopGridIndex(shops, cell_size_m=250)
+
+        rnd = random.Random(7)
+        for _ in range(50):
+            lat, lon = rnd.uniform(45.38, 45.52), rnd.uniform(9.08, 9.32)
+            expected = min(shops, key=lambda s: haversine_m(lat, lon, s["lat"], s["lon"]))
+
+            shop, distance = index.nearest(lat, lon)
+
+            assert shop["shop_id"] == expected["shop_id"]
+            assert distance == pytest.approx(haversine_m(lat, lon, expected["lat"], expected["lon"]))
+
+    def test_nearest_far_away(self):
+        """Testa la ricerca da una posizione lontana dalla griglia."""
+        index = ShopGridIndex(_random_shops(20))
+
+        shop, distance = index.nearest(0.0, 0.0)
+
+        assert shop is not None
+        assert distance > 1_000_000
+
+    def test_within_radius(self):
+        """Testa la ricerca per raggio con ordinamento e limite."""
+        shops = _random_shops(500)
+        index = ShopGridIndex(shops, cell_size_m=100)
+        lat, lon = 45.46, 9.19
+
+        expected = sorted(
+            s["shop_id"] for s in shops if haversine_m(lat, lon, s["lat"], s["lon"]) <= 800
+        )
+        found = index.within(lat, lon, 800)
+
+        assert sorted(s["shop_id"] for s, _ in found) == expected
+        assert [d for _, d in found] == sorted(d for _, d in found)
+        assert len(index.within(lat, lon, 800, limit=3)) == min(3, len(expected))
+
+    def test_within_radius_multiple_of_cell(self):
+        """Testa i negozi appena dentro il raggio quando il raggio è un multiplo della cella."""
+        # Setup: posizioni a ridosso dei bordi di cella, negozi a 249.9 m in più direzioni
+        step = 250 / METERS_PER_DEG_LAT
+        row = math.floor(45.4642 / step)
+        queries = [((row + 1) * step - 1e-7, 9.19), (row * step + 1e-7, 9.19), (45.4642, 9.19)]
+        for lat, lon in queries:
+            shops = [
+                dict(zip(("lat", "lon"), _destination(lat, lon, bearing, 249.9)), shop_id=bearing)
+                for bearing in range(0, 360, 30)
+            ]
+            shops.append({"shop_id": -1, "lat": 45.40, "lon": 9.10})
+            index = ShopGridIndex(shops, cell_size_m=250)
+
+            # Esecuzione
+            found = index.within(lat, lon, 250)
+
+            # Verifica
+            assert sorted(s["shop_id"] for s, _ in found) == list(range(0, 360, 30))
+
+    def test_nearest_at_ring_boundary(self):
+        """Testa che il più vicino appena oltre la cella adiacente non perda contro uno più lontano."""
+        # Setup: posizione sul bordo superiore della cella, A a nord (due righe sopra), B a sud
+        step = 250 / METERS_PER_DEG_LAT
+        lat, lon = (math.floor(45.4642 / step) + 1) * step - 1e-7, 9.19
+        near = dict(zip(("lat", "lon"), _destination(lat, lon, 0, 249.9)), shop_id="A")
+        far = dict(zip(("lat", "lon"), _destination(lat, lon, 180, 249.95)), shop_id="B")
+        index = ShopGridIndex([near, far], cell_size_m=250)
+
+        # Esecuzione
+        shop, distance = index.nearest(lat, lon)
+
+        # Verifica
+        assert shop["shop_id"] == "A"
+        assert distance == pytest.approx(249.9)
+
+
+@pytest.mark.unit
+class TestBatchHaversine:
+
+    def test_many_and_paired_match_scalar(self):
+        """Testa che le API in blocco coincidano con la haversine scalare."""
+        shops = _random_shops(50)
+        lats = [s["lat"] for s in shops]
+        lons = [s["lon"] for s in shops]
+
+        many = haversine_many(45.46, 9.19, lats, lons)
+        paired = haversine_paired(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+        assert many == pytest.approx([haversine_m(45.46, 9.19, la, lo) for la, lo in zip(lats, lons)])
+        assert paired == pytest.approx([
+            haversine_m(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(len(lats) - 1)
+        ])
+
+    def test_within_radius_pairs(self):
+        """Testa le coppie molti-contro-molti entro un raggio, anche a blocchi."""
+        points = _random_shops(40, seed=1)
+        shops = _random_shops(300, seed=2)
+
+        i, j, d = haversine_within(
+            [p["lat"] for p in points], [p["lon"] for p in points],
+            [s["lat"] for s in shops], [s["lon"] for s in shops],
+            radius_m=1000, chunk_size=7
+        )
+
+        expected = {
+            (a, b) for a, p in enumerate(points) for b, s in enumerate(shops)
+            if haversine_m(p["lat"], p["lon"], s["lat"], s["lon"]) <= 1000
+        }
+        assert set(zip(i.tolist(), j.tolist())) == expected
+        assert (d <= 1000).all()
+
+
+@pytest.mark.unit
+class TestNearbyShopsBatch:
+
+    def test_batch_matches_single_searches(self):
+        """Testa che la ricerca in blocco dia per ogni posizione i negozi della ricerca singola."""
+        # Setup
+        index = ShopGridIndex(_random_shops(300), cell_size_m=250)
+        points = _random_shops(20, seed=3)
+        lats = [p["lat"] for p in points]
+        lons = [p["lon"] for p in points]
+
+        # Esecuzione
+        results = nearby_shops_batch(index, lats, lons, max_distance=800, limit=5)
+
+        # Verifica
+        assert len(results) == len(points)
+        for lat, lon, shops in zip(lats, lons, results):
+            expected = index.within(lat, lon, 800, limit=5)
+            assert [s["shop_id"] for s in shops] == [shop["shop_id"] for shop, _ in expected]
+            assert all(set(s) == {"shop_id", "shop_name", "category", "distance"} for s in shops)
+            assert [s["distance"] for s in shops] == sorted(s["distance"] for s in shops)
+
+    def test_within_many_groups_positions_by_cell(self):
+        """Testa che le posizioni della stessa cella condividano un solo confronto molti contro molti."""
+        # Setup: 30 posizioni raccolte in tre zone
+        index = ShopGridIndex(_random_shops(300), cell_size_m=250)
+        rnd = random.Random(11)
+        centers = [(45.45, 9.15), (45.47, 9.20), (45.49, 9.25)]
+        points = [
+            (lat + rnd.uniform(-1e-4, 1e-4), lon + rnd.uniform(-1e-4, 1e-4))
+            for lat, lon in centers for _ in range(10)
+        ]
+        calls = []
+
+        def pairs_within(*args):
+            calls.append(len(args[0]))
+            return haversine_within(*args)
+
+        # Esecuzione
+        results = index.within_many(
+            [p[0] for p in points], [p[1] for p in points], 600, limit=4, pairs_within=pairs_within
+        )
+
+        # Verifica
+        assert sum(calls) == len(points)
+        assert len(calls) < len(points)
+        for (lat, lon), found in zip(points, results):
+            expected = index.within(lat, lon, 600, limit=4)
+            assert [s["shop_id"] for s, _ in found] == [s["shop_id"] for s, _ in expected]
+            assert [d for _, d in found] == pytest.approx([d for _, d in expected])
+
+    def test_group_rows_by_position(self):
+        """Testa la ripartizione delle righe PostGIS per indice 1-based, con posizioni vuote."""
+        # Setup
+        rows = [
+            {"idx": 1, "shop_id": 10, "distance": 5.0},
+            {"idx": 3, "shop_id": 30, "distance": 1.0},
+            {"idx": 3, "shop_id": 31, "distance": 2.0},
+        ]
+
+        # Esecuzione
+        results = group_rows_by_position(rows, 3)
+
+        # Verifica
+        assert results == [
+            [{"shop_id": 10, "distance": 5.0}],
+            [],
+            [{"shop_id": 30, "distance": 1.0}, {"shop_id": 31, "distance": 2.0}],
+        ]
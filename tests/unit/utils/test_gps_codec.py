@@ -0,0 +1,52 @@
+"""
+Test unitari per i formati dei messaggi GPS.
+"""
+import json
+import pytest
+
+from src.utils.gps_codec import BINARY, ENCODING_HEADER, JSON, decode_location, encode_location
+
+EVENT = {
+    "user_id": 42,
+    "latitude": 45.4642,
+    "longitude": 9.19,
+    "timestamp": "2025-05-01T10:00:00.250000+00:00",
+    "age": 30,
+    "profession": "Ingegnere",
+    "interests": "tecnologia, viaggi",
+}
+
+
+@pytest.mark.unit
+class TestGpsCodec:
+
+    def test_binary_roundtrip(self):
+        """Testa che il formato binario conservi coordinate, utente e timestamp."""
+        payload, headers = encode_location(EVENT, BINARY)
+
+        assert headers == [(ENCODING_HEADER, b"gps-v1")]
+        assert len(payload) < len(json.dumps(EVENT)) / 4
+
+        decoded = decode_location(payload, headers)
+        assert decoded == {
+            "user_id": 42,
+            "latitude": 45.4642,
+            "longitude": 9.19,
+            "timestamp": "2025-05-01T10:00:00.250000+00:00",
+        }
+
+    def test_format_detection_without_headers(self):
+        """Testa il riconoscimento del formato quando mancano gli header."""
+        binary, _ = encode_location(EVENT, BINARY)
+        text, headers = encode_location(EVENT, JSON)
+
+        assert headers == [(ENCODING_HEADER, b"json")]
+        assert decode_location(binary)["user_id"] == 42
+        assert decode_location(text) == EVENT
+
+    def test_unknown_format(self):
+        """Testa che un formato sconosciuto venga rifiutato."""
+        with pytest.raises(ValueError):
+            encode_location(EVENT, "avro")
+        with pytest.raises(ValueError):
+            decode_location(b"{}", [(ENCODING_HEADER, b"avro")])
@@ -0,0 +1,117 @@
+"""
+Test unitari per il client HTTP con pool e retry.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from src.utils.http_client import PooledHTTPClient
+
+URL = "http://message-generator/generate"
+
+
+def _client(handler, **kwargs):
+    """PooledHTTPClient che risponde con `handler` invece che dalla rete."""
+    client = PooledHTTPClient("test", backoff=0, **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def _replies(*replies):
+    """Handler che restituisce (o solleva) le risposte in sequenza, contando le chiamate."""
+    calls = []
+
+    def handler(request):
+        reply = replies[min(len(calls), len(replies) - 1)]
+        calls.append(request)
+        if isinstance(reply, Exception):
+            raise reply
+        return httpx.Response(reply, json={})
+
+    return handler, calls
+
+
+@pytest.mark.unit
+class TestPooledHTTPClient:
+
+    @pytest.mark.asyncio
+    async def test_retry_on_5xx(self):
+        """Testa che una risposta 503 venga ritentata."""
+        # Setup
+        handler, calls = _replies(503, 200)
+        client = _client(handler, retries=2)
+
+        # Esecuzione
+        response = await client.post_json(URL, {"a": 1})
+
+        # Verifica
+        assert response.status_code == 200
+        assert len(calls) == 2
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_retry_on_transport_error(self):
+        """Testa il retry sugli errori di trasporto e il rilancio quando i tentativi finiscono."""
+        # Setup
+        handler, calls = _replies(httpx.ConnectError("rifiutata"), 200)
+        client = _client(handler, retries=1)
+        failing_handler, failing_calls = _replies(httpx.ConnectError("rifiutata"))
+        failing = _client(failing_handler, retries=1)
+
+        # Esecuzione / Verifica
+        assert (await client.post_json(URL, {})).status_code == 200
+        assert len(calls) == 2
+
+        with pytest.raises(httpx.ConnectError):
+            await failing.post_json(URL, {})
+        assert len(failing_calls) == 2
+        await client.aclose()
+        await failing.aclose()
+
+    @pytest.mark.asyncio
+    async def test_no_retry_past_deadline(self):
+        """Testa che scaduta la deadline non partano altri tentativi."""
+        # Setup: ogni tentativo dura 50 ms e risponde 503
+        calls = []
+
+        async def slow_handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.05)
+            return httpx.Response(503)
+
+        client = _client(slow_handler, retries=10)
+
+        # Esecuzione
+        with pytest.raises(httpx.TimeoutException):
+            await client.post_json(URL, {}, deadline=0.08)
+
+        # Verifica
+        assert len(calls) == 2
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_no_retry_on_4xx(self):
+        """Testa che gli errori del client non vengano ritentati."""
+        # Setup
+        handler, calls = _replies(422, 200)
+        client = _client(handler, retries=2)
+
+        # Esecuzione
+        response = await client.post_json(URL, {})
+
+        # Verifica
+        assert response.status_code == 422
+        assert len(calls) == 1
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_pool_stats_without_pool_internals(self):
+        """Testa che pool_stats non fallisca se il trasporto non espone il pool."""
+        # Setup
+        client = PooledHTTPClient("test-stats")
+        client._transport = object()
+
+        # Esecuzione / Verifica
+        assert client.pool_stats() == {"total": 0, "idle": 0, "active": 0}
+        await client.aclose()
@@ -0,0 +1,62 @@
+"""
+Test unitari per HyperLogLog e le finestre di attività dei negozi.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from src.utils.hyperloglog import HyperLogLog
+from src.utils.shop_activity import ShopWindow, window_row
+
+
+@pytest.mark.unit
+class TestHyperLogLog:
+
+    @pytest.mark.parametrize("n", [10, 1000, 50000])
+    def test_count_accuracy(self, n):
+        """Testa che la stima resti entro l'errore atteso."""
+        hll = HyperLogLog()
+        for user_id in range(n):
+            hll.add(user_id)
+            hll.add(user_id)  # i duplicati non contano
+
+        assert abs(hll.count() - n) <= max(1, n * 0.1)
+
+    def test_merge(self):
+        """Testa l'unione di due stimatori con elementi in comune."""
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(1000):
+            a.add(i)
+            b.add(i + 500)
+
+        a.merge(b)
+
+        assert abs(a.count() - 1500) <= 150
+
+    def test_sparse_and_dense_roundtrip(self):
+        """Testa la serializzazione sparsa (pochi elementi) e densa."""
+        small, large = HyperLogLog(), HyperLogLog()
+        for i in range(5):
+            small.add(i)
+        for i in range(5000):
+            large.add(f"user-{i}")
+
+        assert len(small.encode()) < 20
+        assert HyperLogLog.decode(small.encode()).registers == small.registers
+        assert HyperLogLog.decode(large.encode()).registers == large.registers
+
+
+@pytest.mark.unit
+class TestShopWindow:
+
+    def test_window_row(self):
+        """Testa la conversione di una finestra chiusa in riga ClickHouse."""
+        window = ShopWindow()
+        for user_id in (1, 2, 2, 3):
+            window.add_visit(user_id)
+        decoded = ShopWindow.decode(window.encode())
+
+        start = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+        row = window_row((7, (start, start + 300 - 0.1)), decoded, 300)
+
+        assert row == (7, datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 1, 12, 5), 300, 4, 3)
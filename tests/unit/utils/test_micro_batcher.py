@@ -0,0 +1,66 @@
+"""
+Test unitari per il raggruppamento delle richieste in micro-batch.
+"""
+import asyncio
+import pytest
+
+from src.utils.micro_batcher import MicroBatcher
+
+
+@pytest.mark.unit
+class TestMicroBatcher:
+    
+    @pytest.mark.asyncio
+    async def test_submit_groups_concurrent_items(self):
+        """Testa che le richieste concorrenti partano in un solo batch con risultati in ordine."""
+        # Setup
+        batches = []
+        
+        async def send(items):
+            batches.append(items)
+            return [item * 10 for item in items]
+        
+        batcher = MicroBatcher(send, max_items=10, max_delay=0.01)
+        
+        # Esecuzione
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        
+        # Verifica
+        assert results == [0, 10, 20, 30, 40]
+        assert batches == [[0, 1, 2, 3, 4]]
+    
+    @pytest.mark.asyncio
+    async def test_submit_flushes_when_full(self):
+        """Testa che un batch pieno parta senza attendere il ritardo massimo."""
+        # Setup
+        batches = []
+        
+        async def send(items):
+            batches.append(items)
+            return items
+        
+        batcher = MicroBatcher(send, max_items=2, max_delay=60)
+        
+        # Esecuzione
+        results = await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=1
+        )
+        
+        # Verifica
+        assert results == [0, 1, 2, 3]
+        assert batches == [[0, 1], [2, 3]]
+    
+    @pytest.mark.asyncio
+    async def test_send_error_reaches_every_caller(self):
+        """Testa che l'errore di invio venga propagato a tutti i chiamanti del batch."""
+        # Setup
+        async def send(items):
+            raise RuntimeError("generatore non raggiungibile")
+        
+        batcher = MicroBatcher(send, max_items=10, max_delay=0.01)
+        
+        # Esecuzione
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+        
+        # Verifica
+        assert all(isinstance(r, RuntimeError) for r in results)
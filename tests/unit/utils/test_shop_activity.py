@@ -0,0 +1,60 @@
+"""
+Test unitari per l'aggregato di attività dei negozi.
+"""
+from datetime import datetime
+
+import pytest
+
+from src.utils.shop_activity import ShopWindow, window_row
+
+# 2024-01-01 12:00:00 UTC
+START = 1704110400.0
+
+
+@pytest.mark.unit
+class TestShopWindow:
+
+    def test_visits_and_unique_visitors(self):
+        """Testa che le visite ripetute contino nelle visite ma non nei visitatori unici."""
+        # Setup
+        window = ShopWindow()
+
+        # Esecuzione
+        for user_id in (1, 2, 2, 3, 1):
+            window.add_visit(user_id)
+
+        # Verifica
+        assert window.visits == 5
+        assert window.unique_visitors == 3
+
+    def test_binary_roundtrip(self):
+        """Testa encode/decode della finestra."""
+        # Setup
+        window = ShopWindow()
+        for user_id in range(100):
+            window.add_visit(user_id)
+
+        # Esecuzione
+        decoded = ShopWindow.decode(window.encode())
+
+        # Verifica
+        assert decoded.visits == 100
+        assert decoded.unique_visitors == window.unique_visitors
+
+    def test_window_row_end_and_naive_utc(self):
+        """Testa la riga esportata: fine a start + size e DateTime naive in UTC."""
+        # Setup: Faust chiude la finestra a start + size - 0.1
+        window = ShopWindow()
+        window.add_visit(7)
+        key = ("42", (START, START + 300 - 0.1))
+
+        # Esecuzione
+        row = window_row(key, window, 300)
+
+        # Verifica
+        shop_id, window_start, window_end, size_s, visits, unique_visitors = row
+        assert shop_id == 42
+        assert window_start == datetime(2024, 1, 1, 12, 0, 0)
+        assert window_end == datetime(2024, 1, 1, 12, 5, 0)
+        assert window_start.tzinfo is None and window_end.tzinfo is None
+        assert (size_s, visits, unique_visitors) == (300, 1, 1)
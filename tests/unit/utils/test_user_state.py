@@ -0,0 +1,175 @@
+"""
+Test unitari per lo stato utente compatto.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils.geo import haversine_m, haversine_paired
+from src.utils.user_state import (
+    UserState, apply_location_batch, filter_cooldown, record_notifications
+)
+
+T0 = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.unit
+class TestUserState:
+
+    def test_ring_keeps_last_positions(self):
+        """Testa che il ring conservi solo le ultime `capacity` posizioni."""
+        # Setup
+        state = UserState(1, capacity=3)
+
+        # Esecuzione
+        for i in range(5):
+            state.add_position(45.0 + i, 9.0, T0 + timedelta(seconds=i))
+
+        # Verifica
+        positions = state.recent_positions
+        assert [p["lat"] for p in positions] == [47.0, 48.0, 49.0]
+        assert state.last_latitude == 49.0
+        assert state.last_seen == T0 + timedelta(seconds=4)
+
+    def test_cooldown_eviction(self):
+        """Testa che i cooldown scaduti vengano rimossi al controllo."""
+        # Setup
+        state = UserState(1)
+        state.mark_notified(10, T0)
+        state.mark_notified(20, T0 + timedelta(minutes=20))
+
+        # Esecuzione / Verifica
+        assert state.in_cooldown(10, T0 + timedelta(minutes=10), 1800)
+        assert not state.in_cooldown(10, T0 + timedelta(minutes=31), 1800)
+        assert state.cooldowns.keys() == {20}
+
+    def test_binary_roundtrip(self):
+        """Testa encode/decode del formato binario."""
+        # Setup
+        state = UserState(42, total_distance=1234.5, notifications_received=3, capacity=4)
+        for i in range(6):
+            state.add_position(45.46 + i / 1000, 9.19, T0 + timedelta(seconds=2 * i))
+        state.mark_notified(7, T0)
+
+        # Esecuzione
+        data = state.encode()
+        decoded = UserState.decode(data)
+
+        # Verifica
+        assert decoded == state
+        assert decoded.recent_positions == state.recent_positions
+        assert decoded.cooldowns == {7: int(T0.timestamp())}
+        assert len(data) < 150
+
+    def test_decode_legacy_json(self):
+        """Testa la lettura dei record JSON del formato precedente."""
+        # Setup
+        record = {
+            "user_id": 5,
+            "last_latitude": 45.5,
+            "last_longitude": 9.2,
+            "last_seen": T0.isoformat(),
+            "total_distance": 10.0,
+            "shops_visited": 0,
+            "notifications_received": 1,
+            "recent_positions": [{"lat": 45.5, "lon": 9.2, "timestamp": T0.isoformat()}],
+            "recent_notifications": {"3": T0.isoformat()},
+        }
+
+        # Esecuzione
+        state = UserState.decode(json.dumps(record).encode())
+
+        # Verifica
+        assert state.user_id == 5
+        assert state.last_seen == T0
+        assert len(state.recent_positions) == 1
+        assert state.in_cooldown(3, T0 + timedelta(minutes=5), 1800)
+
+
+def _location(user_id, lat, lon, seconds):
+    return SimpleNamespace(user_id=user_id, latitude=lat, longitude=lon, timestamp=T0 + timedelta(seconds=seconds))
+
+
+def _proximity(user_id, shop_id, seconds=0):
+    return SimpleNamespace(user_id=user_id, shop_id=shop_id, timestamp=T0 + timedelta(seconds=seconds))
+
+
+@pytest.mark.unit
+class TestBatchUpdates:
+
+    def test_location_batch_reads_once_and_sums_distances(self):
+        """Testa il batch di posizioni: una lettura per utente, distanze da posizioni consecutive."""
+        # Setup
+        existing = UserState(1, last_latitude=45.46, last_longitude=9.19)
+        reads = []
+
+        def get_state(user_id):
+            reads.append(user_id)
+            return existing if user_id == 1 else None
+
+        events = [
+            _location(1, 45.47, 9.19, 1),
+            _location(2, 45.50, 9.20, 2),
+            _location(1, 45.48, 9.19, 3),
+            _location(2, 45.51, 9.20, 4),
+        ]
+
+        # Esecuzione
+        states = apply_location_batch(events, get_state, haversine_paired, capacity=5)
+
+        # Verifica
+        assert sorted(reads) == [1, 2]
+        assert states[1] is existing
+        assert states[1].total_distance == pytest.approx(
+            haversine_m(45.46, 9.19, 45.47, 9.19) + haversine_m(45.47, 9.19, 45.48, 9.19)
+        )
+        # Utente nuovo: il primo punto non conta come spostamento
+        assert states[2].total_distance == pytest.approx(haversine_m(45.50, 9.20, 45.51, 9.20))
+        assert states[2].capacity == 5
+        assert [p["lat"] for p in states[2].recent_positions] == pytest.approx([45.50, 45.51])
+        assert states[1].last_seen == T0 + timedelta(seconds=3)
+
+    def test_empty_location_batch(self):
+        """Testa che un batch vuoto non calcoli distanze."""
+        # Esecuzione / Verifica
+        assert apply_location_batch([], lambda user_id: None, lambda *args: pytest.fail("calcolo inutile")) == {}
+
+    def test_cooldown_filter(self):
+        """Testa il filtro: stato mancante, negozio in cooldown e duplicati nel batch."""
+        # Setup
+        state = UserState(1)
+        state.mark_notified(10, T0 - timedelta(minutes=5))
+        states = {1: state, 2: UserState(2)}
+        events = [
+            _proximity(1, 10),   # in cooldown
+            _proximity(1, 20),
+            _proximity(1, 20),   # duplicato nel batch
+            _proximity(2, 20),
+            _proximity(3, 20),   # nessuno stato
+        ]
+
+        # Esecuzione
+        candidates = filter_cooldown(events, states.get, 1800)
+
+        # Verifica
+        assert [(e.user_id, e.shop_id) for e in candidates] == [(1, 20), (2, 20)]
+        # Il filtro non avvia cooldown: lo fa solo una notifica inviata
+        assert state.cooldowns.keys() == {10}
+
+    def test_record_notifications_keeps_newer_positions(self):
+        """Testa che le notifiche si applichino allo stato riletto senza perdere le posizioni."""
+        # Setup: lo stato è cambiato mentre i messaggi venivano generati
+        current = UserState(1)
+        current.add_position(45.47, 9.19, T0 + timedelta(seconds=30))
+        sent = [_proximity(1, 10), _proximity(1, 20)]
+
+        # Esecuzione
+        record_notifications(current, sent)
+
+        # Verifica
+        assert current.notifications_received == 2
+        assert current.cooldowns.keys() == {10, 20}
+        assert current.last_latitude == pytest.approx(45.47)
+        assert filter_cooldown([_proximity(1, 10, 60)], {1: current}.get, 1800) == []